@@ -0,0 +1,72 @@
+#!/usr/bin/python3
+# This file is part of prometheus-enhanced-snmp-exporte.
+#
+# prometheus-enhanced-snmp-exporte is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# prometheus-enhanced-snmp-exporte is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with prometheus-enhanced-snmp-exporte. If not, see <https://www.gnu.org/licenses/>.
+
+'''
+    compare two results of suite.py
+
+    print the change of every measure, and exit with 1 when one of them
+    regressed by more than --threshold percent
+'''
+
+import argparse
+import json
+import sys
+
+
+def main():
+    parser = argparse.ArgumentParser(description='compare benchmark results')
+    parser.add_argument('base', help='results of the reference commit')
+    parser.add_argument('new', help='results to check')
+    parser.add_argument('-t', '--threshold', type=float, default=10, help='allowed regression, in percent')
+    args = parser.parse_args()
+
+    with open(args.base) as base_file:
+        base = json.load(base_file)
+    with open(args.new) as new_file:
+        new = json.load(new_file)
+
+    print('{} -> {}'.format(base['commit'][:12], new['commit'][:12]))
+    regressions = []
+    names = sorted(set(base['results']) | set(new['results']))
+    width = max(len(name) for name in names) if names else 0
+    for name in names:
+        if name not in base['results'] or name not in new['results']:
+            side = 'base' if name not in base['results'] else 'new'
+            print('{:<{}}  missing in {}'.format(name, width, side))
+            continue
+        before = base['results'][name]
+        after = new['results'][name]
+        if before['value'] == 0:
+            change = 0.0
+        else:
+            change = (after['value'] - before['value']) / before['value'] * 100
+        # positive when better
+        gain = change if after['better'] == 'higher' else -change
+        flag = ''
+        if gain < -args.threshold:
+            flag = '  REGRESSION'
+            regressions.append(name)
+        print('{:<{}}  {:>14.6g} {:>14.6g} {:<10} {:>+8.1f}%{}'.format(
+            name, width, before['value'], after['value'], after['unit'], change, flag))
+    for name, error in sorted(new.get('errors', {}).items()):
+        print('{:<{}}  failed: {}'.format(name, width, error))
+    if regressions:
+        print('{} measures regressed by more than {}%'.format(len(regressions), args.threshold))
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,186 @@
+#!/usr/bin/python3
+# This file is part of prometheus-enhanced-snmp-exporte.
+#
+# prometheus-enhanced-snmp-exporte is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# prometheus-enhanced-snmp-exporte is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with prometheus-enhanced-snmp-exporte. If not, see <https://www.gnu.org/licenses/>.
+
+'''
+    stub prometheus remote write receiver
+
+    decode every request (snappy + protobuf WriteRequest), count series and
+    samples, and optionally fail a ratio of the requests to exercise retries.
+    statistics are printed as json every --report seconds
+'''
+
+import argparse
+import json
+import random
+import struct
+import threading
+import time
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from socketserver import ThreadingMixIn
+
+
+def read_varint(data: bytes, offset: int):
+    result = 0
+    shift = 0
+    while True:
+        byte = data[offset]
+        offset += 1
+        result |= (byte & 0x7f) << shift
+        shift += 7
+        if byte < 0x80:
+            return result, offset
+
+
+def snappy_decompress(data: bytes) -> bytes:
+    length, offset = read_varint(data, 0)
+    out = bytearray()
+    while offset < len(data):
+        tag = data[offset]
+        offset += 1
+        kind = tag & 3
+        if kind == 0:
+            size = tag >> 2
+            if size >= 60:
+                extra = size - 59
+                size = int.from_bytes(data[offset:offset + extra], 'little')
+                offset += extra
+            size += 1
+            out += data[offset:offset + size]
+            offset += size
+            continue
+        if kind == 1:
+            size = ((tag >> 2) & 7) + 4
+            distance = ((tag >> 5) << 8) | data[offset]
+            offset += 1
+        elif kind == 2:
+            size = (tag >> 2) + 1
+            distance = int.from_bytes(data[offset:offset + 2], 'little')
+            offset += 2
+        else:
+            size = (tag >> 2) + 1
+            distance = int.from_bytes(data[offset:offset + 4], 'little')
+            offset += 4
+        for _ in range(size):
+            out.append(out[-distance])
+    if len(out) != length:
+        raise ValueError('bad snappy length')
+    return bytes(out)
+
+
+def fields(data: bytes):
+    offset = 0
+    while offset < len(data):
+        key, offset = read_varint(data, offset)
+        wire_type = key & 7
+        if wire_type == 0:
+            value, offset = read_varint(data, offset)
+        elif wire_type == 1:
+            value = struct.unpack('<d', data[offset:offset + 8])[0]
+            offset += 8
+        elif wire_type == 2:
+            size, offset = read_varint(data, offset)
+            value = data[offset:offset + size]
+            offset += size
+        else:
+            raise ValueError('unsupported wire type {}'.format(wire_type))
+        yield key >> 3, value
+
+
+class Stats(object):
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.failed_requests = 0
+        self.series = 0
+        self.samples = 0
+        self.names = set()
+
+
+class ReceiverHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self) -> None:
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        stats = self.server.stats
+        if random.random() < self.server.fail_ratio:
+            with stats.lock:
+                stats.failed_requests += 1
+            self._reply(503)
+            return
+        series = 0
+        samples = 0
+        names = set()
+        for field, timeseries in fields(snappy_decompress(body)):
+            if field != 1:
+                continue
+            series += 1
+            for ts_field, value in fields(timeseries):
+                if ts_field == 2:
+                    samples += 1
+                elif ts_field == 1:
+                    label = dict(fields(value))
+                    if label.get(1) == b'__name__':
+                        names.add(label[2].decode())
+        with stats.lock:
+            stats.requests += 1
+            stats.series += series
+            stats.samples += samples
+            stats.names.update(names)
+        self._reply(204)
+
+    def _reply(self, status: int) -> None:
+        self.send_response(status)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, format: str, *args) -> None:
+        pass
+
+
+class ReceiverServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+def main():
+    parser = argparse.ArgumentParser(description='stub remote write receiver')
+    parser.add_argument('--listen', default='127.0.0.1:9201', help='listen address and port')
+    parser.add_argument('--fail-ratio', type=float, default=0.0, help='ratio of requests answered with a 503')
+    parser.add_argument('--report', type=float, default=10, help='delay between two reports')
+    args = parser.parse_args()
+
+    host, port = args.listen.rsplit(':', 1)
+    server = ReceiverServer((host, int(port)), ReceiverHandler)
+    server.stats = Stats()
+    server.fail_ratio = args.fail_ratio
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    start = time.perf_counter()
+    while True:
+        time.sleep(args.report)
+        stats = server.stats
+        with stats.lock:
+            print(json.dumps({
+                'benchmark': 'remote_write_receiver',
+                'seconds': time.perf_counter() - start,
+                'requests': stats.requests,
+                'failed_requests': stats.failed_requests,
+                'series': stats.series,
+                'samples': stats.samples,
+                'metric_names': sorted(stats.names),
+            }), flush=True)
+
+
+if __name__ == '__main__':
+    main()
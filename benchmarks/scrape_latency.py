@@ -0,0 +1,126 @@
+#!/usr/bin/python3
+# This file is part of prometheus-enhanced-snmp-exporte.
+#
+# prometheus-enhanced-snmp-exporte is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# prometheus-enhanced-snmp-exporte is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with prometheus-enhanced-snmp-exporte. If not, see <https://www.gnu.org/licenses/>.
+
+'''
+    scrape latency of the prometheus exposition with several concurrent clients
+
+    each client keeps its connection open (keep-alive) and scrapes the endpoint
+    in loop, the result is printed as json
+'''
+
+import argparse
+import http.client
+import json
+import threading
+import time
+
+from prometheus_enhanced_snmp_exporter.prometheus import PrometheusMetricStorage
+from prometheus_enhanced_snmp_exporter.storage import LabelStorage, TemplateStorage
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description='scrape latency benchmark')
+    parser.add_argument('--hosts', type=int, default=100, help='number of polled hosts')
+    parser.add_argument('--metrics', type=int, default=10, help='number of metrics')
+    parser.add_argument('--series', type=int, default=100, help='series per metric and host')
+    parser.add_argument('--clients', type=int, default=4, help='concurrent scrapers')
+    parser.add_argument('--scrapes', type=int, default=10, help='scrapes per client')
+    parser.add_argument('--encoding', default=None, help='Accept-Encoding sent by the clients (gzip, zstd)')
+    parser.add_argument('--accept', default=None, help='Accept header sent by the clients, to select the format')
+    return parser.parse_args()
+
+
+def fill(metrics: PrometheusMetricStorage, hosts: int, metric_count: int, series: int) -> None:
+    for metric_idx in range(metric_count):
+        metric_name = 'bench_metric_{}'.format(metric_idx)
+        metrics.add_metric(metric_name, 'gauge', 'benchmark metric')
+        for host_idx in range(hosts):
+            hostname = 'host-{}'.format(host_idx)
+            metrics.clear(hostname, metric_name)
+            for series_idx in range(series):
+                labels = {'hostname': hostname, 'ifIndex': str(series_idx), 'ifDescr': 'Ethernet{}'.format(series_idx)}
+                metrics.update_metric(hostname, metric_name, labels, series_idx)
+            metrics.release_update_lock(hostname, metric_name)
+
+
+def percentile(values, ratio: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * ratio))]
+
+
+def scrape(port: int, scrapes: int, path: str, headers, latencies, first_bytes, sizes) -> None:
+    connection = http.client.HTTPConnection('127.0.0.1', port)
+    for _ in range(scrapes):
+        start = time.perf_counter()
+        connection.request('GET', path, headers=headers)
+        response = connection.getresponse()
+        response.read(1)
+        first_byte = time.perf_counter()
+        size = 1 + len(response.read())
+        end = time.perf_counter()
+        latencies.append(end - start)
+        first_bytes.append(first_byte - start)
+        sizes.append(size)
+    connection.close()
+
+
+def main():
+    args = get_args()
+    metrics = PrometheusMetricStorage('127.0.0.1:0', '/metrics', LabelStorage(), TemplateStorage())
+    metrics.daemon = True
+    fill_start = time.perf_counter()
+    fill(metrics, args.hosts, args.metrics, args.series)
+    fill_duration = time.perf_counter() - fill_start
+    metrics.start_serving()
+    port = metrics._server.server_address[1]
+
+    latencies = []
+    first_bytes = []
+    sizes = []
+    headers = {}
+    if args.encoding:
+        headers['Accept-Encoding'] = args.encoding
+    if args.accept:
+        headers['Accept'] = args.accept
+    clients = [threading.Thread(target=scrape, args=(port, args.scrapes, '/metrics', headers, latencies, first_bytes, sizes))
+               for _ in range(args.clients)]
+    start = time.perf_counter()
+    for client in clients:
+        client.start()
+    for client in clients:
+        client.join()
+    duration = time.perf_counter() - start
+
+    print(json.dumps({
+        'benchmark': 'scrape_latency',
+        'series': args.hosts * args.metrics * args.series,
+        'clients': args.clients,
+        'encoding': args.encoding,
+        'accept': args.accept,
+        'scrapes': len(latencies),
+        'fill_seconds': fill_duration,
+        'body_bytes': sizes[0],
+        'scrapes_per_second': len(latencies) / duration,
+        'latency_p50': percentile(latencies, 0.5),
+        'latency_p95': percentile(latencies, 0.95),
+        'latency_max': max(latencies),
+        'first_byte_p50': percentile(first_bytes, 0.5),
+        'first_byte_p95': percentile(first_bytes, 0.95),
+    }, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,526 @@
+#!/usr/bin/python3
+# This file is part of prometheus-enhanced-snmp-exporte.
+#
+# prometheus-enhanced-snmp-exporte is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# prometheus-enhanced-snmp-exporte is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with prometheus-enhanced-snmp-exporte. If not, see <https://www.gnu.org/licenses/>.
+
+'''
+    SNMP v1/v2c agent simulator
+
+    serve GET, GETNEXT and GETBULK over UDP from recorded walks (snmpwalk -On
+    output), or from a generated switch with --interfaces rows in its interface
+    tables. A single process acts as many agents, on consecutive ports or on
+    consecutive 127.x addresses, with an optional latency and packet loss.
+    Counters grow with time, at a different rate on each agent.
+    statistics are printed as json every --report seconds
+'''
+
+import argparse
+import asyncio
+import bisect
+import ipaddress
+import json
+import random
+import re
+import sys
+import time
+from typing import Dict, List, Optional, Tuple
+
+# BER tags
+INTEGER = 0x02
+OCTET_STRING = 0x04
+NULL = 0x05
+OBJECT_IDENTIFIER = 0x06
+SEQUENCE = 0x30
+IP_ADDRESS = 0x40
+COUNTER32 = 0x41
+GAUGE32 = 0x42
+TIMETICKS = 0x43
+COUNTER64 = 0x46
+NO_SUCH_OBJECT = 0x80
+NO_SUCH_INSTANCE = 0x81
+END_OF_MIB_VIEW = 0x82
+GET_REQUEST = 0xa0
+GET_NEXT_REQUEST = 0xa1
+GET_RESPONSE = 0xa2
+GET_BULK_REQUEST = 0xa5
+
+NO_SUCH_NAME = 2
+
+# a response bigger than this is truncated, as an agent would do
+MAX_RESPONSE_SIZE = 60000
+
+Oid = Tuple[int, ...]
+
+
+def encode_length(length: int) -> bytes:
+    if length < 0x80:
+        return bytes([length])
+    size = (length.bit_length() + 7) // 8
+    return bytes([0x80 | size]) + length.to_bytes(size, 'big')
+
+
+def encode_tlv(tag: int, content: bytes) -> bytes:
+    return bytes([tag]) + encode_length(len(content)) + content
+
+
+def encode_integer(value: int, tag: int = INTEGER) -> bytes:
+    size = (value if value >= 0 else ~value).bit_length() // 8 + 1
+    return encode_tlv(tag, value.to_bytes(size, 'big', signed=True))
+
+
+def encode_unsigned(value: int, tag: int) -> bytes:
+    # a leading zero byte keeps the high bit clear
+    return encode_tlv(tag, value.to_bytes(value.bit_length() // 8 + 1, 'big'))
+
+
+def encode_oid(oid: Oid) -> bytes:
+    content = bytearray([oid[0] * 40 + oid[1]])
+    for component in oid[2:]:
+        chunk = [component & 0x7f]
+        component >>= 7
+        while component:
+            chunk.append(0x80 | (component & 0x7f))
+            component >>= 7
+        content += bytes(reversed(chunk))
+    return encode_tlv(OBJECT_IDENTIFIER, bytes(content))
+
+
+def decode_tlv(data: bytes, offset: int) -> Tuple[int, int, int]:
+    '''
+        return tag, content offset and content end
+    '''
+    tag = data[offset]
+    length = data[offset + 1]
+    offset += 2
+    if length & 0x80:
+        size = length & 0x7f
+        length = int.from_bytes(data[offset:offset + size], 'big')
+        offset += size
+    end = offset + length
+    if end > len(data):
+        raise ValueError('truncated message')
+    return tag, offset, end
+
+
+def decode_integer(data: bytes, offset: int) -> Tuple[int, int]:
+    tag, start, end = decode_tlv(data, offset)
+    if tag != INTEGER:
+        raise ValueError('integer expected')
+    return int.from_bytes(data[start:end], 'big', signed=True), end
+
+
+def decode_oid(content: bytes) -> Oid:
+    oid = list(divmod(content[0], 40)) if content[0] < 80 else [2, content[0] - 80]
+    component = 0
+    for byte in content[1:]:
+        component = (component << 7) | (byte & 0x7f)
+        if not byte & 0x80:
+            oid.append(component)
+            component = 0
+    return tuple(oid)
+
+
+class Request(object):
+    __slots__ = ('version', 'community', 'pdu_type', 'request_id', 'non_repeaters', 'max_repetitions', 'oids')
+
+    def __init__(self, data: bytes) -> None:
+        tag, offset, _ = decode_tlv(data, 0)
+        if tag != SEQUENCE:
+            raise ValueError('message should be a sequence')
+        self.version, offset = decode_integer(data, offset)
+        tag, start, offset = decode_tlv(data, offset)
+        if tag != OCTET_STRING:
+            raise ValueError('community expected')
+        self.community = data[start:offset]
+        self.pdu_type, offset, _ = decode_tlv(data, offset)
+        self.request_id, offset = decode_integer(data, offset)
+        # error status and index, reused by getbulk
+        self.non_repeaters, offset = decode_integer(data, offset)
+        self.max_repetitions, offset = decode_integer(data, offset)
+        _, offset, end = decode_tlv(data, offset)
+        self.oids = []  # type: List[Oid]
+        while offset < end:
+            _, varbind_start, varbind_end = decode_tlv(data, offset)
+            tag, oid_start, oid_end = decode_tlv(data, varbind_start)
+            if tag != OBJECT_IDENTIFIER:
+                raise ValueError('oid expected')
+            self.oids.append(decode_oid(data[oid_start:oid_end]))
+            offset = varbind_end
+
+
+def encode_response(request: Request, varbinds: List[bytes], error_status: int = 0, error_index: int = 0) -> bytes:
+    pdu = encode_integer(request.request_id) + encode_integer(error_status) + encode_integer(error_index) + \
+        encode_tlv(SEQUENCE, b''.join(varbinds))
+    return encode_tlv(SEQUENCE, encode_integer(request.version) + encode_tlv(OCTET_STRING, request.community) +
+                      encode_tlv(GET_RESPONSE, pdu))
+
+
+def parse_oid(text: str) -> Oid:
+    return tuple(int(component) for component in text.strip().lstrip('.').split('.'))
+
+
+def parse_walk_value(value_type: str, value: str) -> Optional[Tuple]:
+    '''
+        a value is (tag, encoded value) for constants, or (tag, initial value)
+        for counters, which grow with time
+    '''
+    value = value.strip()
+    if value_type == 'STRING':
+        if len(value) >= 2 and value.startswith('"') and value.endswith('"'):
+            value = value[1:-1]
+        return OCTET_STRING, encode_tlv(OCTET_STRING, value.encode())
+    if value_type in ('Hex-STRING', 'BITS'):
+        hex_digits = re.findall(r'\b[0-9A-Fa-f]{2}\b', value)
+        return OCTET_STRING, encode_tlv(OCTET_STRING, bytes(int(digit, 16) for digit in hex_digits))
+    if value_type == 'INTEGER':
+        match = re.search(r'-?\d+', value.split('(')[-1])
+        return INTEGER, encode_integer(int(match.group(0)))
+    if value_type in ('Gauge32', 'Unsigned32'):
+        return GAUGE32, encode_unsigned(int(re.search(r'\d+', value).group(0)), GAUGE32)
+    if value_type == 'Timeticks':
+        return TIMETICKS, int(re.search(r'\d+', value).group(0))
+    if value_type == 'Counter32':
+        return COUNTER32, int(value.split()[0])
+    if value_type == 'Counter64':
+        return COUNTER64, int(value.split()[0])
+    if value_type == 'IpAddress':
+        return IP_ADDRESS, encode_tlv(IP_ADDRESS, ipaddress.IPv4Address(value).packed)
+    if value_type == 'OID':
+        return OBJECT_IDENTIFIER, encode_oid(parse_oid(value))
+    return None
+
+
+class Mib(object):
+    '''
+        sorted oids of an agent, shared by every agent simulating the same device
+    '''
+    def __init__(self, name: str, values: Dict[Oid, Tuple]) -> None:
+        self.name = name
+        self.oids = sorted(values)
+        self.encoded_oids = [encode_oid(oid) for oid in self.oids]
+        self.values = [values[oid] for oid in self.oids]
+        self._index = {oid: position for position, oid in enumerate(self.oids)}
+
+    def find(self, oid: Oid) -> Optional[int]:
+        return self._index.get(oid)
+
+    def find_next(self, oid: Oid) -> Optional[int]:
+        position = bisect.bisect_right(self.oids, oid)
+        return position if position < len(self.oids) else None
+
+
+def load_walk(filename: str) -> Dict[Oid, Tuple]:
+    values = {}  # type: Dict[Oid, Tuple]
+    skipped = 0
+    line_format = re.compile(r'^(\.?[0-9.]+) = (?:([A-Za-z0-9-]+): ?)?(.*)$')
+    # an entry is parsed once complete, strings and hex strings could span several lines
+    entry = None  # type: Optional[List[str]]
+
+    def add_entry() -> int:
+        oid, value_type, lines = entry
+        parsed = parse_walk_value(value_type, '\n'.join(lines))
+        if parsed is None:
+            return 1
+        values[parse_oid(oid)] = parsed
+        return 0
+
+    with open(filename, errors='replace') as walk_file:
+        for line in walk_file:
+            line = line.rstrip('\n')
+            match = line_format.match(line)
+            if match is None:
+                if entry is not None:
+                    entry[2].append(line)
+                elif line.strip():
+                    skipped += 1
+                continue
+            if entry is not None:
+                skipped += add_entry()
+            oid, value_type, value = match.groups()
+            # empty string is written = ""
+            entry = [oid, value_type or 'STRING', [value]]
+    if entry is not None:
+        skipped += add_entry()
+    if skipped:
+        print('{}: {} entries skipped'.format(filename, skipped), file=sys.stderr)
+    return values
+
+
+def resize_table(values: Dict[Oid, Tuple], entry: Oid, rows: int) -> None:
+    '''
+        replace the rows of a table by rows indexed 1 to rows, copied from the existing ones
+    '''
+    columns = {}  # type: Dict[int, List[Tuple]]
+    for oid in sorted(values):
+        if oid[:len(entry)] == entry and len(oid) > len(entry) + 1:
+            columns.setdefault(oid[len(entry)], []).append(values.pop(oid))
+    for column, column_values in columns.items():
+        for row in range(rows):
+            values[entry + (column, row + 1)] = column_values[row % len(column_values)]
+
+
+def generated_switch(interfaces: int) -> Dict[Oid, Tuple]:
+    '''
+        system group, ifTable and ifXTable of a switch
+    '''
+    def string(text: str) -> Tuple:
+        return OCTET_STRING, encode_tlv(OCTET_STRING, text.encode())
+
+    values = {
+        (1, 3, 6, 1, 2, 1, 1, 1, 0): string('simulated switch'),
+        (1, 3, 6, 1, 2, 1, 1, 2, 0): (OBJECT_IDENTIFIER, encode_oid((1, 3, 6, 1, 4, 1, 8072, 3, 2, 10))),
+        (1, 3, 6, 1, 2, 1, 1, 3, 0): (TIMETICKS, 0),
+        (1, 3, 6, 1, 2, 1, 1, 5, 0): string('switch'),
+        (1, 3, 6, 1, 2, 1, 2, 1, 0): (INTEGER, encode_integer(interfaces)),
+    }  # type: Dict[Oid, Tuple]
+    if_entry = (1, 3, 6, 1, 2, 1, 2, 2, 1)
+    if_x_entry = (1, 3, 6, 1, 2, 1, 31, 1, 1, 1)
+    for index in range(1, interfaces + 1):
+        name = 'Ethernet{}'.format(index)
+        values[if_entry + (1, index)] = (INTEGER, encode_integer(index))
+        values[if_entry + (2, index)] = string(name)
+        values[if_entry + (3, index)] = (INTEGER, encode_integer(6))
+        values[if_entry + (5, index)] = (GAUGE32, encode_unsigned(1000000000, GAUGE32))
+        values[if_entry + (7, index)] = (INTEGER, encode_integer(1))
+        values[if_entry + (8, index)] = (INTEGER, encode_integer(1 if index % 10 else 2))
+        values[if_entry + (10, index)] = (COUNTER32, 0)
+        values[if_entry + (14, index)] = (COUNTER32, 0)
+        values[if_entry + (16, index)] = (COUNTER32, 0)
+        values[if_x_entry + (1, index)] = string(name)
+        values[if_x_entry + (6, index)] = (COUNTER64, 0)
+        values[if_x_entry + (10, index)] = (COUNTER64, 0)
+        values[if_x_entry + (15, index)] = (GAUGE32, encode_unsigned(1000, GAUGE32))
+        values[if_x_entry + (18, index)] = string('port {}'.format(index))
+    return values
+
+
+class Stats(object):
+    def __init__(self) -> None:
+        self.requests = 0
+        self.responses = 0
+        self.lost = 0
+        self.ignored = 0
+        self.varbinds = 0
+
+
+class Agent(asyncio.DatagramProtocol):
+    def __init__(self, agent_id: int, mib: Mib, args: argparse.Namespace, stats: Stats,
+                 rng: random.Random) -> None:
+        self.agent_id = agent_id
+        self.mib = mib
+        self.community = args.community.encode()
+        self.latency = args.latency / 1000
+        self.jitter = args.jitter / 1000
+        self.loss = args.loss
+        self.stats = stats
+        self.rng = rng
+        self.transport = None  # type: Optional[asyncio.DatagramTransport]
+        self.start = time.monotonic()
+        # counters of each agent grow at their own rate
+        self.rate = 1000 * (agent_id % 97 + 1)
+
+    def connection_made(self, transport) -> None:
+        self.transport = transport
+
+    def encode_value(self, position: int) -> bytes:
+        tag, value = self.mib.values[position]
+        if isinstance(value, bytes):
+            return value
+        elapsed = time.monotonic() - self.start
+        if tag == TIMETICKS:
+            return encode_unsigned((value + int(elapsed * 100)) % 2 ** 32, TIMETICKS)
+        # a rate by oid too, so series differ within the agent
+        increment = int(elapsed * self.rate * (position % 13 + 1))
+        if tag == COUNTER32:
+            return encode_unsigned((value + increment) % 2 ** 32, COUNTER32)
+        return encode_unsigned((value + increment) % 2 ** 64, COUNTER64)
+
+    def varbind(self, position: int) -> bytes:
+        return encode_tlv(SEQUENCE, self.mib.encoded_oids[position] + self.encode_value(position))
+
+    def answer(self, request: Request) -> bytes:
+        mib = self.mib
+        varbinds = []  # type: List[bytes]
+        if request.pdu_type == GET_REQUEST:
+            for index, oid in enumerate(request.oids):
+                position = mib.find(oid)
+                if position is None:
+                    if request.version == 0:
+                        return encode_response(request, [encode_tlv(SEQUENCE, encode_oid(oid) + encode_tlv(NULL, b''))
+                                                         for oid in request.oids], NO_SUCH_NAME, index + 1)
+                    varbinds.append(encode_tlv(SEQUENCE, encode_oid(oid) + encode_tlv(NO_SUCH_INSTANCE, b'')))
+                else:
+                    varbinds.append(self.varbind(position))
+        elif request.pdu_type == GET_NEXT_REQUEST:
+            for index, oid in enumerate(request.oids):
+                position = mib.find_next(oid)
+                if position is None:
+                    if request.version == 0:
+                        return encode_response(request, [encode_tlv(SEQUENCE, encode_oid(oid) + encode_tlv(NULL, b''))
+                                                         for oid in request.oids], NO_SUCH_NAME, index + 1)
+                    varbinds.append(encode_tlv(SEQUENCE, encode_oid(oid) + encode_tlv(END_OF_MIB_VIEW, b'')))
+                else:
+                    varbinds.append(self.varbind(position))
+        elif request.pdu_type == GET_BULK_REQUEST and request.version == 1:
+            non_repeaters = max(0, min(request.non_repeaters, len(request.oids)))
+            size = 0
+            for oid in request.oids[:non_repeaters]:
+                position = mib.find_next(oid)
+                if position is None:
+                    varbinds.append(encode_tlv(SEQUENCE, encode_oid(oid) + encode_tlv(END_OF_MIB_VIEW, b'')))
+                else:
+                    varbinds.append(self.varbind(position))
+                size += len(varbinds[-1])
+            positions = [mib.find_next(oid) for oid in request.oids[non_repeaters:]]
+            last_oids = list(request.oids[non_repeaters:])
+            for _ in range(max(0, request.max_repetitions)):
+                if size > MAX_RESPONSE_SIZE or all(position is None for position in positions):
+                    break
+                for column, position in enumerate(positions):
+                    if position is None:
+                        varbind = encode_tlv(SEQUENCE, encode_oid(last_oids[column]) +
+                                             encode_tlv(END_OF_MIB_VIEW, b''))
+                    else:
+                        varbind = self.varbind(position)
+                        last_oids[column] = mib.oids[position]
+                        positions[column] = position + 1 if position + 1 < len(mib.oids) else None
+                    varbinds.append(varbind)
+                    size += len(varbind)
+        else:
+            return b''
+        self.stats.varbinds += len(varbinds)
+        return encode_response(request, varbinds)
+
+    def datagram_received(self, data: bytes, addr) -> None:
+        self.stats.requests += 1
+        if self.loss and self.rng.random() < self.loss:
+            self.stats.lost += 1
+            return
+        try:
+            request = Request(data)
+        except (ValueError, IndexError):
+            self.stats.ignored += 1
+            return
+        # community@context, as used for vlan indexed communities, share the agent data
+        if request.community != self.community and not request.community.startswith(self.community + b'@'):
+            self.stats.ignored += 1
+            return
+        response = self.answer(request)
+        if not response:
+            self.stats.ignored += 1
+            return
+        self.stats.responses += 1
+        delay = self.latency + (self.rng.uniform(0, self.jitter) if self.jitter else 0)
+        if delay > 0:
+            asyncio.get_event_loop().call_later(delay, self.transport.sendto, response, addr)
+        else:
+            self.transport.sendto(response, addr)
+
+
+def agent_addresses(args: argparse.Namespace) -> List[Tuple[str, int]]:
+    if args.mode == 'ports':
+        return [(args.address, args.port + agent_id) for agent_id in range(args.agents)]
+    base = ipaddress.IPv4Address(args.address)
+    return [(str(base + agent_id), args.port) for agent_id in range(args.agents)]
+
+
+def raise_file_limit(sockets: int) -> None:
+    try:
+        import resource
+    except ImportError:
+        return
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    wanted = sockets + 64
+    if soft != resource.RLIM_INFINITY and soft < wanted:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (wanted if hard == resource.RLIM_INFINITY else min(wanted, hard),
+                                                    hard))
+
+
+def write_inventory(filename: str, addresses: List[Tuple[str, int]], mibs: List[Mib], args: argparse.Namespace) -> None:
+    # inventory file of the exporter, one target group by simulated device
+    groups = []
+    for mib_id, mib in enumerate(mibs):
+        targets = ['{}:{}'.format(host, port) if port != 161 else host
+                   for agent_id, (host, port) in enumerate(addresses) if agent_id % len(mibs) == mib_id]
+        groups.append({'targets': targets, 'labels': {'__version': args.version, '__community': args.community,
+                                                      'device': mib.name}})
+    with open(filename, 'w') as inventory:
+        json.dump(groups, inventory, indent=2)
+
+
+async def report(stats: Stats, interval: float) -> None:
+    start = time.monotonic()
+    while True:
+        await asyncio.sleep(interval)
+        print(json.dumps({'elapsed': round(time.monotonic() - start, 3), 'requests': stats.requests,
+                          'responses': stats.responses, 'lost': stats.lost, 'ignored': stats.ignored,
+                          'varbinds': stats.varbinds}), flush=True)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='SNMP agent simulator')
+    parser.add_argument('-w', '--walk', action='append', default=[],
+                        help='snmpwalk -On output to serve, agents use the walks in turn (repeatable)')
+    parser.add_argument('--interfaces', type=int, default=48,
+                        help='interfaces of the generated switch, without --walk')
+    parser.add_argument('--table', action='append', default=[],
+                        help='resize a table of the walks, as ENTRY_OID=ROWS (repeatable)')
+    parser.add_argument('-n', '--agents', type=int, default=1)
+    parser.add_argument('--mode', choices=['ports', 'addresses'], default='ports',
+                        help='agents on consecutive ports of --address, or consecutive addresses from --address')
+    parser.add_argument('--address', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=16100, help='port, or first port with --mode ports')
+    parser.add_argument('--community', default='public')
+    parser.add_argument('--version', default='v2c', help='snmp version written in the inventory file')
+    parser.add_argument('--latency', type=float, default=0, help='response delay in ms')
+    parser.add_argument('--jitter', type=float, default=0, help='random extra delay in ms')
+    parser.add_argument('--loss', type=float, default=0, help='ratio of requests left unanswered')
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--inventory', help='write the agents in an exporter inventory file')
+    parser.add_argument('--report', type=float, default=10, help='statistics interval in seconds')
+    args = parser.parse_args()
+
+    if args.walk:
+        walks = [(filename, load_walk(filename)) for filename in args.walk]
+    else:
+        walks = [('switch{}'.format(args.interfaces), generated_switch(args.interfaces))]
+    for table in args.table:
+        entry, rows = table.split('=')
+        for _, values in walks:
+            resize_table(values, parse_oid(entry), int(rows))
+    mibs = [Mib(name, values) for name, values in walks]
+
+    rng = random.Random(args.seed)
+    stats = Stats()
+    addresses = agent_addresses(args)
+    raise_file_limit(len(addresses))
+    loop = asyncio.get_event_loop()
+    for agent_id, address in enumerate(addresses):
+        mib = mibs[agent_id % len(mibs)]
+        loop.run_until_complete(loop.create_datagram_endpoint(
+            lambda agent_id=agent_id, mib=mib: Agent(agent_id, mib, args, stats, rng), local_addr=address))
+    if args.inventory:
+        write_inventory(args.inventory, addresses, mibs, args)
+    print(json.dumps({'agents': len(addresses), 'first': '{}:{}'.format(*addresses[0]),
+                      'last': '{}:{}'.format(*addresses[-1]),
+                      'oids': {mib.name: len(mib.oids) for mib in mibs}}), flush=True)
+    loop.create_task(report(stats, args.report))
+    try:
+        loop.run_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
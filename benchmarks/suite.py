@@ -0,0 +1,308 @@
+#!/usr/bin/python3
+# This file is part of prometheus-enhanced-snmp-exporte.
+#
+# prometheus-enhanced-snmp-exporte is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# prometheus-enhanced-snmp-exporte is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with prometheus-enhanced-snmp-exporte. If not, see <https://www.gnu.org/licenses/>.
+
+'''
+    benchmark suite of the polling, the label storage and the exposition
+
+    each case runs in its own process, so memory measures are not polluted by
+    the previous cases. The results are printed as json, and could be compared
+    between two commits with compare.py
+'''
+
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import platform
+import queue
+import resource
+import subprocess
+import sys
+import time
+from typing import Callable, Dict, List, Tuple
+
+from prometheus_enhanced_snmp_exporter.influxdb import InfluxDBMeasurement
+from prometheus_enhanced_snmp_exporter.prometheus import PrometheusMetricStorage
+from prometheus_enhanced_snmp_exporter.storage import LabelStorage, TemplateStorage
+
+SIMULATOR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'snmp_simulator.py')
+
+# a result is (value, unit, better) where better is 'higher' or 'lower'
+Result = Tuple[float, str, str]
+
+# ifHCInOctets and sysUpTime.0 of the simulated switch
+WALK_OID = '1.3.6.1.2.1.31.1.1.1.6'
+GET_OID = '1.3.6.1.2.1.1.3.0'
+
+
+def rss() -> int:
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except OSError:
+        # peak rss, in kilobytes on linux
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def size_name(size: int) -> str:
+    for factor, suffix in ((1000000, 'M'), (1000, 'k')):
+        if size >= factor and size % factor == 0:
+            return '{}{}'.format(size // factor, suffix)
+    return str(size)
+
+
+def bench_querier(agents: int, interfaces: int, concurrency: int, rounds: int) -> Dict[str, Result]:
+    '''
+        oids per second through SNMPQuerier.query, against the simulator
+    '''
+    from prometheus_enhanced_snmp_exporter.config import ParserConfiguration
+    from prometheus_enhanced_snmp_exporter.snmp import SNMPQuerier
+
+    port = 20000 + os.getpid() % 20000
+    simulator = subprocess.Popen([sys.executable, SIMULATOR, '--agents', str(agents), '--port', str(port),
+                                  '--interfaces', str(interfaces), '--report', '3600'],
+                                 stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    try:
+        # the simulator prints its agents once they all listen
+        simulator.stdout.readline()
+        config = ParserConfiguration({'hosts': [], 'modules': {}, 'description': {}})
+        querier = SNMPQuerier(config, LabelStorage(), TemplateStorage(), None)
+        hostnames = ['127.0.0.1:{}'.format(port + agent) for agent in range(agents)]
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def query(hostname: str, oid: str, query_type: str) -> int:
+            async with semaphore:
+                output = await querier.query(oid, hostname, 'public', 'v2c', 'value', '', query_type)
+            if query_type == 'walk':
+                return len(output or {})
+            return 0 if output is None else 1
+
+        async def run(oid: str, query_type: str) -> Tuple[int, float]:
+            start = time.perf_counter()
+            counts = await asyncio.gather(*[query(hostname, oid, query_type)
+                                            for _ in range(rounds) for hostname in hostnames])
+            return sum(counts), time.perf_counter() - start
+
+        loop = asyncio.get_event_loop()
+        # first queries resolve the oids and warm the engine up
+        loop.run_until_complete(run(GET_OID, 'get'))
+        walked, walk_duration = loop.run_until_complete(run(WALK_OID, 'walk'))
+        got, get_duration = loop.run_until_complete(run(GET_OID, 'get'))
+    finally:
+        simulator.terminate()
+        simulator.wait()
+    if walked != agents * interfaces * rounds:
+        raise RuntimeError('{} oids walked, {} expected'.format(walked, agents * interfaces * rounds))
+    return {
+        'querier_walk_oids_per_second': (walked / walk_duration, 'oids/s', 'higher'),
+        'querier_get_per_second': (got / get_duration, 'requests/s', 'higher'),
+    }
+
+
+def fill_labels(storage: LabelStorage, rows: int) -> None:
+    # an interface table, and an address table joined on ifIndex
+    for row in range(rows):
+        index = str(row + 1)
+        storage.set_label('host', 'if', 'interfaces', 'ifIndex', index, 'default', 'default', index)
+        storage.set_label('host', 'if', 'interfaces', 'ifName', 'Ethernet{}'.format(index), 'default', 'default', index)
+        storage.set_label('host', 'if', 'interfaces', 'ifAlias', 'port {}'.format(index), 'default', 'default', index)
+        address_index = '10.{}.{}.{}'.format(row >> 16 & 255, row >> 8 & 255, row & 255)
+        storage.set_label('host', 'if', 'addresses', 'ipAdEntIfIndex', index, 'default', 'default', address_index)
+        storage.set_label('host', 'if', 'addresses', 'ipAdEntAddr', address_index, 'default', 'default', address_index)
+    storage.set_join('host', 'if', 'address_join', 'addresses', 'interfaces', 'ipAdEntIfIndex', 'ifIndex')
+
+
+def bench_labels(rows: int, samples: int) -> Dict[str, Result]:
+    '''
+        label resolution of every row, and join resolution of a sample of rows
+    '''
+    storage = LabelStorage()
+    start = time.perf_counter()
+    fill_labels(storage, rows)
+    fill_duration = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for row in range(rows):
+        if not storage.resolve_label('host', 'if', '.interfaces', 'default', 'default', str(row + 1)):
+            raise RuntimeError('label of row {} not resolved'.format(row + 1))
+    resolve_duration = time.perf_counter() - start
+
+    # joins are slow on big tables, only a sample of the rows is resolved
+    step = max(1, rows // samples)
+    joined = 0
+    start = time.perf_counter()
+    for row in range(0, rows, step):
+        address_index = '10.{}.{}.{}'.format(row >> 16 & 255, row >> 8 & 255, row & 255)
+        if storage.resolve_label('host', 'if', '.address_join.addresses', 'default', 'default', address_index):
+            joined += 1
+    join_duration = time.perf_counter() - start
+    if joined != len(range(0, rows, step)):
+        raise RuntimeError('{} joins resolved on {}'.format(joined, len(range(0, rows, step))))
+    name = size_name(rows)
+    return {
+        'label_set_{}_per_second'.format(name): (rows * 5 / fill_duration, 'labels/s', 'higher'),
+        'label_resolve_{}_per_second'.format(name): (rows / resolve_duration, 'rows/s', 'higher'),
+        'label_join_{}_per_second'.format(name): (joined / join_duration, 'rows/s', 'higher'),
+    }
+
+
+def fill_metrics(metrics: PrometheusMetricStorage, series: int, series_per_host: int) -> None:
+    metrics.add_metric('bench_if_in_octets', 'counter', 'benchmark metric')
+    for host in range(max(1, series // series_per_host)):
+        hostname = 'host-{}'.format(host)
+        metrics.clear(hostname, 'bench_if_in_octets')
+        for index in range(min(series, series_per_host)):
+            labels = {'hostname': hostname, 'ifIndex': str(index), 'ifName': 'Ethernet{}'.format(index)}
+            metrics.update_metric(hostname, 'bench_if_in_octets', labels, str(index * 1000))
+        metrics.release_update_lock(hostname, 'bench_if_in_octets')
+
+
+def bench_exposition(series: int, series_per_host: int, scrapes: int) -> Dict[str, Result]:
+    '''
+        metric_print latency, and memory used by the series
+    '''
+    metrics = PrometheusMetricStorage('127.0.0.1:0', '/metrics', LabelStorage(), TemplateStorage())
+    rss_before = rss()
+    start = time.perf_counter()
+    fill_metrics(metrics, series, series_per_host)
+    fill_duration = time.perf_counter() - start
+    rss_after = rss()
+    # the first print renders every block, the next ones reuse the rendered blocks
+    durations = []
+    for _ in range(scrapes + 1):
+        start = time.perf_counter()
+        body = metrics.metric_print()
+        durations.append(time.perf_counter() - start)
+    if body.count(b'\n') < series:
+        raise RuntimeError('{} lines printed for {} series'.format(body.count(b'\n'), series))
+    name = size_name(series)
+    return {
+        'series_update_{}_per_second'.format(name): (series / fill_duration, 'series/s', 'higher'),
+        'metric_print_{}_seconds'.format(name): (durations[0], 's', 'lower'),
+        'metric_print_cached_{}_seconds'.format(name): (min(durations[1:]), 's', 'lower'),
+        'rss_per_series_{}_bytes'.format(name): ((rss_after - rss_before) / series, 'bytes', 'lower'),
+    }
+
+
+def bench_influx_lines(rows: int, fields: int, rounds: int) -> Dict[str, Result]:
+    '''
+        influxdb line protocol generation, from the update of the fields to the batches
+    '''
+    measurement = InfluxDBMeasurement('interfaces')
+    field_names = ['field_{}'.format(field) for field in range(fields)]
+    for field_name in field_names:
+        measurement.add_metric(field_name)
+    labels = [{'hostname': 'host-{}'.format(row // 100), 'ifIndex': str(row % 100), 'ifName': 'Ethernet{}'.format(row)}
+              for row in range(rows)]
+    points = 0
+    size = 0
+    start = time.perf_counter()
+    for poll in range(rounds):
+        for field_name in field_names:
+            for row_labels in labels:
+                measurement.update(row_labels['hostname'], row_labels, field_name, float(poll))
+        for batch, batch_points in measurement.push_to_influx():
+            points += batch_points
+            size += len(batch)
+    duration = time.perf_counter() - start
+    if points != rows * rounds:
+        raise RuntimeError('{} points written, {} expected'.format(points, rows * rounds))
+    return {
+        'influx_lines_per_second': (points / duration, 'lines/s', 'higher'),
+        'influx_bytes_per_second': (size / duration, 'bytes/s', 'higher'),
+    }
+
+
+def cases(args: argparse.Namespace) -> List[Tuple[str, Callable, Dict]]:
+    label_rows = [10000, 20000] if args.quick else [10000, 100000]
+    series = [10000, 100000] if args.quick else [100000, 1000000, 5000000]
+    return [('querier', bench_querier, {'agents': args.agents, 'interfaces': args.interfaces,
+                                        'concurrency': args.concurrency, 'rounds': 1 if args.quick else 3})] + \
+        [('labels_{}'.format(size_name(rows)), bench_labels, {'rows': rows, 'samples': 1000}) for rows in label_rows] + \
+        [('exposition_{}'.format(size_name(size)), bench_exposition,
+          {'series': size, 'series_per_host': 1000, 'scrapes': 1 if size > 1000000 else 3}) for size in series] + \
+        [('influx_lines', bench_influx_lines, {'rows': 10000 if args.quick else 100000, 'fields': 4, 'rounds': 3})]
+
+
+def run_case(func: Callable, kwargs: Dict, results) -> None:
+    try:
+        results.put(('ok', func(**kwargs)))
+    except Exception as e:
+        results.put(('error', '{}: {}'.format(type(e).__name__, e)))
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], stderr=subprocess.DEVNULL,
+                                       cwd=os.path.dirname(os.path.abspath(__file__))).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def main():
+    parser = argparse.ArgumentParser(description='benchmark suite')
+    parser.add_argument('-o', '--output', help='write the results in this file, instead of stdout')
+    parser.add_argument('-k', '--only', action='append', default=[], help='run cases starting by this name')
+    parser.add_argument('--quick', action='store_true', help='smaller sizes, for a quick check')
+    parser.add_argument('--agents', type=int, default=100, help='simulated agents polled by the querier case')
+    parser.add_argument('--interfaces', type=int, default=48, help='interfaces of each simulated agent')
+    parser.add_argument('--concurrency', type=int, default=50, help='queries in flight in the querier case')
+    args = parser.parse_args()
+
+    context = multiprocessing.get_context('fork')
+    report = {
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'cpus': os.cpu_count(),
+        'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'results': {},
+        'errors': {},
+    }
+    for name, func, kwargs in cases(args):
+        if args.only and not any(name.startswith(only) for only in args.only):
+            continue
+        print('running {}'.format(name), file=sys.stderr)
+        results = context.Queue()
+        process = context.Process(target=run_case, args=(func, kwargs, results))
+        process.start()
+        while True:
+            try:
+                status, output = results.get(timeout=1)
+                break
+            except queue.Empty:
+                # killed, by the oom killer for instance
+                if not process.is_alive():
+                    status, output = 'error', 'exited with code {}'.format(process.exitcode)
+                    break
+        process.join()
+        if status == 'error':
+            print('{} failed: {}'.format(name, output), file=sys.stderr)
+            report['errors'][name] = output
+            continue
+        for metric, (value, unit, better) in output.items():
+            report['results'][metric] = {'value': value, 'unit': unit, 'better': better}
+    output = json.dumps(report, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            output_file.write(output + '\n')
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    main()
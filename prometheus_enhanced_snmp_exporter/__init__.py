@@ -17,15 +17,24 @@
 import asyncio
 import argparse
 import logging
+import os
 import sys
+import time
 from datetime import datetime
+from typing import TYPE_CHECKING
 
 from .config import ParserConfiguration, parse_config, BadConfigurationException
-from .snmp import SNMPQuerier
 from .storage import LabelStorage, TemplateStorage
-from .prometheus import PrometheusMetricStorage
-from .influxdb import InfluxDBDriver
-from .scheduler import JobScheduler
+from .accounting import SeriesAccounting
+from .driver import OutputDriver
+from .inventory import Inventory
+from .mib import resolve_many
+from .plan import compile_hosts, compile_modules, compile_plans, load_plan_cache, plan_cache_key, save_plan_cache
+
+# pysnmp, apscheduler and the drivers are imported when they are used, so --check
+# and the start don't pay for the import of the ones not needed
+if TYPE_CHECKING:
+    from .scheduler import JobScheduler
 
 logger = logging.getLogger(__name__)
 
@@ -41,7 +50,18 @@ def get_args(handler):
                         required=False)
     parser.add_argument('-M', '--max-threads',
                         help="maximum number of thread used for fetching", default=1, type=int)
+    parser.add_argument('--plan-cache', help="file keeping compiled poll plans between restarts",
+                        default=None, required=False)
+    capture = parser.add_mutually_exclusive_group()
+    capture.add_argument('--record', metavar='DIR', help="write every agent response to DIR, a file by host",
+                         default=None, required=False)
+    capture.add_argument('--replay', metavar='DIR', help="answer queries from the responses recorded in DIR, "
+                         "without network", default=None, required=False)
+    parser.add_argument('--replay-speed', help="speed of the replay clock, 10 replays a capture 10 times faster",
+                        default=1, type=float)
     args = parser.parse_args()
+    if args.replay_speed <= 0:
+        parser.error('--replay-speed must be positive')
 
     if args.log_level == "debug":
         handler.setLevel(logging.DEBUG)
@@ -72,16 +92,79 @@ def init_logger():
     return handler
 
 
-def create_metric(config: ParserConfiguration, scheduler: JobScheduler, storage: LabelStorage, template_storage: TemplateStorage):
-    if config.driver == 'prometheus':
-        return PrometheusMetricStorage(config.driver_config.listen,
-                                       config.driver_config.path, storage, template_storage)
+def create_driver(name: str, driver_config, scheduler: 'JobScheduler', storage: LabelStorage,
+                  template_storage: TemplateStorage, accounting: SeriesAccounting) -> OutputDriver:
+    if name == 'prometheus':
+        from .prometheus import PrometheusMetricStorage
+        return PrometheusMetricStorage(driver_config.listen,
+                                       driver_config.path, storage, template_storage,
+                                       driver_config.timestamps, accounting,
+                                       driver_config.usage_metrics)
+    elif name == 'remote_write':
+        from .remote_write import RemoteWriteDriver
+        return RemoteWriteDriver(driver_config.url,
+                                 shards=driver_config.shards,
+                                 batch_size=driver_config.batch_size,
+                                 queue_size=driver_config.queue_size,
+                                 max_retries=driver_config.max_retries,
+                                 max_backoff=driver_config.max_backoff,
+                                 flush_interval=driver_config.flush_interval,
+                                 timeout=driver_config.timeout,
+                                 username=driver_config.username,
+                                 password=driver_config.password)
     else:
+        from .influxdb import InfluxDBDriver
         return InfluxDBDriver(scheduler,
-                              config.driver_config.host,
-                              config.driver_config.db,
-                              config.driver_config.username,
-                              config.driver_config.password)
+                              driver_config.host,
+                              driver_config.db,
+                              driver_config.username,
+                              driver_config.password,
+                              port=driver_config.port,
+                              ssl=driver_config.ssl,
+                              batch_size=driver_config.batch_size,
+                              concurrency=driver_config.concurrency,
+                              compress=driver_config.gzip,
+                              timeout=driver_config.timeout,
+                              buffer_points=driver_config.buffer_points,
+                              spool_dir=driver_config.spool_dir,
+                              spool_max_size=driver_config.spool_max_size,
+                              flush_points=driver_config.flush_points,
+                              flush_bytes=driver_config.flush_bytes,
+                              flush_interval=driver_config.flush_interval,
+                              dedup=driver_config.dedup,
+                              heartbeat=driver_config.heartbeat)
+
+
+def create_metric(config: ParserConfiguration, scheduler: 'JobScheduler', storage: LabelStorage,
+                  template_storage: TemplateStorage, accounting: SeriesAccounting) -> OutputDriver:
+    if len(config.drivers) == 1:
+        driver = config.drivers[0]
+        return create_driver(driver.name, driver.config, scheduler, storage, template_storage, accounting)
+    from .fanout import FanOutDriver
+    return FanOutDriver([(driver.name, create_driver(driver.name, driver.config, scheduler, storage, template_storage,
+                                                     accounting),
+                          driver.queue_size) for driver in config.drivers])
+
+
+def check_config(config: ParserConfiguration, workers: int) -> bool:
+    '''
+        resolve every oid of the modules against the mibs, in worker processes
+    '''
+    start = time.monotonic()
+    oids = set()
+
+    def collect_oid(oid: str) -> str:
+        oids.add(oid)
+        return oid
+
+    compile_modules(config, collect_oid)
+    resolved = resolve_many(sorted(oids), workers)
+    unresolved = sorted(oid for oid, numeric_oid in resolved.items() if numeric_oid is None)
+    for oid in unresolved:
+        logger.error("can't resolve %s", oid)
+    logger.info('%s oids of %s modules checked in %.2fs with %s processes, %s unresolved',
+                len(oids), len(config.modules.items()), time.monotonic() - start, workers, len(unresolved))
+    return not unresolved
 
 
 def main_without_scheduler():
@@ -91,22 +174,71 @@ def main_without_scheduler():
     arguments = get_args(handler)
     logger.debug('argument parsed')
 
-    try:
-        config = parse_config(arguments.filename)
-    except BadConfigurationException:
-        logger.error('bad configuration, exit with 1')
-        sys.exit(1)
+    cached_plans = None
+    if arguments.plan_cache is not None and not arguments.check:
+        try:
+            plan_key = plan_cache_key(arguments.filename)
+        except OSError as e:
+            logger.error("can't read config file %s %s", arguments.filename, e.strerror)
+            sys.exit(1)
+        cached_plans = load_plan_cache(arguments.plan_cache, plan_key)
+    if cached_plans is not None:
+        logger.info('configuration and poll plans loaded from %s', arguments.plan_cache)
+        config, modules, plans = cached_plans
     else:
-        logger.debug('config valid')
+        parse_start = time.monotonic()
+        try:
+            config = parse_config(arguments.filename)
+        except BadConfigurationException:
+            logger.error('bad configuration, exit with 1')
+            sys.exit(1)
+        else:
+            logger.debug('config valid')
+        logger.info('configuration parsed in %.2fs', time.monotonic() - parse_start)
     if arguments.check:
+        if not check_config(config, os.cpu_count() or 1):
+            logger.error('bad configuration, exit with 1')
+            sys.exit(1)
         logger.info('configuration valid, exit as required with --check')
         sys.exit(0)
 
-    storage = LabelStorage()
-    template_storage = TemplateStorage()
-    scheduler = JobScheduler(arguments.max_threads)
-    metrics = create_metric(config, scheduler, storage, template_storage)
-    querier = SNMPQuerier(config, storage, template_storage, metrics)
+    from .scheduler import JobScheduler
+    from .snmp import SNMPQuerier
+    from .reload import ConfigReloader
+
+    recorder = replay = None
+    speed = 1.0
+    if arguments.record is not None:
+        from .replay import Recorder
+        recorder = Recorder(arguments.record)
+        logger.info('record agent responses in %s', arguments.record)
+    elif arguments.replay is not None:
+        from .replay import Replayer
+        speed = arguments.replay_speed
+        replay = Replayer(arguments.replay, speed)
+
+    # label storages are measured only when their usage is exposed
+    usage_metrics = any(driver.name == 'prometheus' and driver.config.usage_metrics for driver in config.drivers)
+    storage = LabelStorage(usage_metrics)
+    template_storage = TemplateStorage(usage_metrics)
+    accounting = SeriesAccounting()
+    scheduler = JobScheduler(arguments.max_threads, speed)
+    metrics = create_metric(config, scheduler, storage, template_storage, accounting)
+    querier = SNMPQuerier(config, storage, template_storage, metrics, recorder, replay, accounting)
+    if cached_plans is None:
+        logger.info('compile poll plans')
+        modules, plans = compile_plans(config, querier.resolve_oid)
+        if arguments.plan_cache is not None:
+            save_plan_cache(arguments.plan_cache, plan_key, config, modules, plans)
+    inventory = None
+    static_plans = plans
+    if config.inventory is not None:
+        inventory = Inventory(config.inventory)
+        inventory.scan()
+        inventory_hosts = inventory.hosts(config.modules, [host_plan.hostname for host_plan in static_plans])
+        logger.info('%s hosts loaded from inventory', len(inventory_hosts))
+        plans = static_plans + compile_hosts(inventory_hosts, modules)
+    querier.set_plans(plans)
 
     logger.info('warmup template cache')
     loop = asyncio.get_event_loop()
@@ -121,8 +253,19 @@ def main_without_scheduler():
     for metric_name, metric_data in config.descriptions.items():
         metrics.add_metric(
             metric_name, metric_data['type'], metric_data['description'])
+    for module_name, module_data in config.modules.items():
+        metrics.add_module(
+            module_name, [metric.name for metric in module_data.metrics])
     loop.run_until_complete(querier.warmup_metrics(
         arguments.max_threads, scheduler))
+    # reload could start once the initial warmup is done
+    ConfigReloader(arguments.filename, config, modules, static_plans, querier, metrics, scheduler,
+                   arguments.max_threads, arguments.plan_cache, inventory).install()
+    for driver in config.drivers:
+        if driver.name == 'prometheus' and driver.config.debug_token:
+            from .debug import DebugEndpoints
+            DebugEndpoints(driver.config.debug_token, loop, querier.polls).install(metrics)
+            break
     end_time = datetime.now()
     logger.info('Initalization duration : %s', end_time - start_time)
     return (metrics, scheduler)
@@ -0,0 +1,113 @@
+# This file is part of prometheus-enhanced-snmp-exporte.
+#
+# prometheus-enhanced-snmp-exporte is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# prometheus-enhanced-snmp-exporte is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with prometheus-enhanced-snmp-exporte. If not, see <https://www.gnu.org/licenses/>.
+
+import logging
+import sys
+from typing import List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# host, module, metric or label table
+TableKey = Tuple[str, str, str]
+
+
+def storage_size(data) -> int:
+    '''
+        approximate memory of nested dicts of strings, python object overhead included
+    '''
+    size = sys.getsizeof(data)
+    if isinstance(data, dict):
+        for key, value in data.items():
+            size += sys.getsizeof(key) + storage_size(value)
+    return size
+
+
+class SeriesLimit(object):
+    '''
+        series admitted during a poll of a table, at most limit when it's not 0
+    '''
+    __slots__ = ('limit', 'series', 'dropped')
+
+    def __init__(self, limit: int) -> None:
+        self.limit = limit
+        self.series = 0
+        self.dropped = 0
+
+    def full(self) -> bool:
+        return self.limit > 0 and self.series >= self.limit
+
+    def drop(self) -> None:
+        self.dropped += 1
+
+    def admit(self) -> bool:
+        if self.full():
+            self.drop()
+            return False
+        self.series += 1
+        return True
+
+
+class SeriesAccounting(object):
+    '''
+        series kept by the last poll of each table (metric or label) of each module
+        of each host, and the tables truncated by their max_series limit
+    '''
+    def __init__(self) -> None:
+        # host -> (module, table) -> [series, truncated, dropped series total, is a metric]
+        self._tables = {}  # type: dict
+        # module polling each metric of each host, to attribute driver memory
+        self._metric_modules = {}  # type: dict
+
+    def record(self, hostname: str, module_name: str, table: str, limit: SeriesLimit, metric: bool = True) -> None:
+        tables = self._tables.setdefault(hostname, {})
+        entry = tables.get((module_name, table))
+        if entry is None:
+            entry = tables[(module_name, table)] = [0, False, 0, metric]
+        if metric:
+            self._metric_modules.setdefault(hostname, {})[table] = module_name
+        truncated = limit.dropped > 0
+        if truncated and not entry[1]:
+            logger.warning('%s of module %s on %s truncated to %s series, %s dropped',
+                           table, module_name, hostname, limit.limit, limit.dropped)
+        elif entry[1] and not truncated:
+            logger.info('%s of module %s on %s is back under its limit of %s series',
+                        table, module_name, hostname, limit.limit)
+        entry[0] = limit.series
+        entry[1] = truncated
+        entry[2] += limit.dropped
+
+    def module_of(self, hostname: str, metric_name: str) -> Optional[str]:
+        return self._metric_modules.get(hostname, {}).get(metric_name)
+
+    def forget(self, hostname: str, module_name: Optional[str] = None) -> None:
+        # tables of a host, or of a module of a host. Dropped counters go with them
+        if module_name is None:
+            self._tables.pop(hostname, None)
+            self._metric_modules.pop(hostname, None)
+            return
+        tables = self._tables.get(hostname, {})
+        for key in [key for key in list(tables) if key[0] == module_name]:
+            del tables[key]
+        metric_modules = self._metric_modules.get(hostname, {})
+        for metric_name in [name for name, module in list(metric_modules.items()) if module == module_name]:
+            del metric_modules[metric_name]
+
+    def tables(self) -> List[Tuple[TableKey, int, bool, int, bool]]:
+        '''
+            (host, module, table), series, truncated, dropped series total, is a metric
+        '''
+        return sorted(((hostname, module_name, table), series, truncated, dropped, metric)
+                      for hostname, tables in list(self._tables.items())
+                      for (module_name, table), (series, truncated, dropped, metric) in list(tables.items()))
@@ -50,6 +50,20 @@ def timerange_to_second(timerange: int):
         raise e
 
 
+def max_series_of(config, default: int) -> int:
+    '''
+        max_series of a configuration section, 0 for no limit
+    '''
+    try:
+        max_series = int(config.get('max_series', default))
+    except ValueError:
+        max_series = -1
+    if max_series < 0:
+        logger.error('max_series should be a positive integer, got %s', config.get('max_series'))
+        raise BadConfigurationException()
+    return max_series
+
+
 def parse_config(filename: str):
     try:
         with open(filename) as e:
@@ -58,7 +72,7 @@ def parse_config(filename: str):
     except IOError as e:
         logger.error("can't read config file %s %s", filename, e.strerror)
         raise BadConfigurationException()
-    except yaml.scanner.ScannerError as e:
+    except yaml.YAMLError as e:
         logger.error('bad YAML format %s', e)
         raise BadConfigurationException()
 
@@ -75,6 +89,14 @@ class HostConfiguration(object):
             raise BadConfigurationException()
         self.community = config.get('community', 'public')
         self.version = config.get('version', '1')
+        try:
+            self.max_concurrency = int(config.get('max_concurrency', 10))
+        except ValueError:
+            logger.error('max_concurrency should be an integer')
+            raise BadConfigurationException()
+        if self.max_concurrency < 1:
+            logger.error('max_concurrency should be greater than 0')
+            raise BadConfigurationException()
         static_labels = config.get('static_labels', {})
         self.static_labels = {}
         for key, val in static_labels.items():
@@ -139,8 +161,11 @@ class HostsConfiguration(object):
 
 
 class OIDConfiguration(object):
-    def __init__(self, name: str, config: Dict, default_every: str, query_type: str, action: str, template_name: str, community_template: str, store_method: str):
+    def __init__(self, name: str, config: Dict, default_every: str, query_type: str, action: str, template_name: str, community_template: str, store_method: str,
+                 max_series: int = 0):
         self.action = action
+        # series, or label rows, kept by a poll, 0 for no limit
+        self.max_series = max_series
         self.name = name
         self.type = query_type
         self.template_name = template_name
@@ -176,9 +201,9 @@ class OIDConfiguration(object):
 
 class MetricOIDConfiguration(OIDConfiguration):
     def __init__(self, name, config, default_every, query_type, action, template_name, community_template,
-                 store_method, labels):
+                 store_method, labels, max_series=0):
         OIDConfiguration.__init__(self, name, config, default_every, query_type, action, template_name, community_template,
-                                  store_method)
+                                  store_method, max_series)
         self.label_group = labels
 
 
@@ -196,11 +221,12 @@ class ModuleConfiguration(object):
             logger.error('type attribut absent')
             raise BadConfigurationException()
 
-    def __init__(self, config, module_name):
+    def __init__(self, config, module_name, max_series=0):
         self.labels_group = {}
         self.template_label = {}
         self.metrics = []
         every = config.get('every', '60s')
+        self.max_series = max_series_of(config, max_series)
         self._init_template_labels(config, module_name, every)
         self._init_labels(config, module_name, every)
         self._init_metrics(config, module_name, every)
@@ -218,7 +244,8 @@ class ModuleConfiguration(object):
                 self.template_label[template_label_name] = OIDConfiguration(template_label_name, template_label['mapping'],
                                                                             label_every, query_type, 'templated_label',
                                                                             template_name, community_template,
-                                                                            store_method)
+                                                                            store_method,
+                                                                            max_series_of(template_label, self.max_series))
         except ValueError:
             logger.error('templated_label attibute should be a dict')
             raise BadConfigurationException()
@@ -229,6 +256,7 @@ class ModuleConfiguration(object):
                 label_every = label_group.get('every', every)
                 store_method = label_group.get('store_method', 'value')
                 query_type = self._get_type(label_group)
+                max_series = max_series_of(label_group, self.max_series)
                 logger.debug('parse label list %s', label_group)
                 self.labels_group[label_group_name] = {}
 
@@ -241,7 +269,7 @@ class ModuleConfiguration(object):
                     self.labels_group[label_group_name][label_name] = OIDConfiguration(label_name, label_data,
                                                                                        label_every, query_type, 'label',
                                                                                        template_name, community_template,
-                                                                                       store_method)
+                                                                                       store_method, max_series)
         except ValueError:
             logger.error('label attribute should be a dict')
             raise BadConfigurationException()
@@ -252,6 +280,7 @@ class ModuleConfiguration(object):
                 metric_every = metric.get('every', every)
                 query_type = self._get_type(metric)
                 store_method = metric.get('store_method', 'value')
+                max_series = max_series_of(metric, self.max_series)
 
                 template_name = metric.get('template_label', "")
                 community_template = self.template_label.get(
@@ -262,7 +291,7 @@ class ModuleConfiguration(object):
                     metric_obj = MetricOIDConfiguration(metric_name, metric_data, metric_every,
                                                         query_type, 'metrics',
                                                         template_name, community_template,
-                                                        store_method, metric.get('append_tags', []))
+                                                        store_method, metric.get('append_tags', []), max_series)
                     self.metrics.append(metric_obj)
         except ValueError:
             logger.error('metric attribute should be a list')
@@ -270,12 +299,12 @@ class ModuleConfiguration(object):
 
 
 class ModulesConfiguration(object):
-    def __init__(self, config):
+    def __init__(self, config, max_series=0):
         self._modules = {}
         try:
             for module_name, module_data in config.items():
                 self._modules[module_name] = ModuleConfiguration(
-                    module_data, module_name)
+                    module_data, module_name, max_series)
         except TypeError:
             logger.error('modules key should be a dict')
             logger.exception('detail')
@@ -298,7 +327,12 @@ class PrometheusConfiguration(object):
     def __init__(self, config):
         self.listen = config.get('listen', ':9100')
         self.path = config.get('path', '/metrics')
-        pass
+        self.timestamps = str(config.get('timestamps', 'true')).lower() in ('true', 'yes', '1')
+        # /debug endpoints are only served with a token
+        self.debug_token = config.get('debug_token', None)
+        # series and memory of each table of each host in self metrics, off by
+        # default as they add a few series per metric and host
+        self.usage_metrics = str(config.get('usage_metrics', 'false')).lower() in ('true', 'yes', '1')
 
 
 class InfluxDBConfiguration(object):
@@ -307,24 +341,130 @@ class InfluxDBConfiguration(object):
         self.db = config['db']
         self.username = config['username']
         self.password = config['password']
+        try:
+            self.port = int(config.get('port', 8086))
+            self.ssl = str(config.get('ssl', 'false')).lower() in ('true', 'yes', '1')
+            self.batch_size = int(config.get('batch_size', 5000))
+            self.concurrency = int(config.get('concurrency', 4))
+            self.gzip = str(config.get('gzip', 'true')).lower() in ('true', 'yes', '1')
+            self.timeout = timerange_to_second(config.get('timeout', '30s'))
+            self.buffer_points = int(config.get('buffer_points', 500000))
+            self.spool_max_size = int(config.get('spool_max_size', 1024 ** 3))
+            self.flush_points = int(config.get('flush_points', self.batch_size))
+            self.flush_bytes = int(config.get('flush_bytes', 1024 ** 2))
+            self.flush_interval = timerange_to_second(config.get('flush_interval', '10s'))
+            self.dedup = str(config.get('dedup', 'false')).lower() in ('true', 'yes', '1')
+            self.heartbeat = timerange_to_second(config.get('heartbeat', '10m'))
+        except ValueError:
+            logger.error('bad influxdb driver configuration')
+            raise BadConfigurationException()
+        if self.batch_size < 1 or self.concurrency < 1:
+            logger.error('batch_size and concurrency of influxdb driver should be at least 1')
+            raise BadConfigurationException()
+        self.spool_dir = config.get('spool_dir', None)
+
+
+class RemoteWriteConfiguration(object):
+    def __init__(self, config):
+        try:
+            self.url = config['url']
+        except KeyError:
+            logger.error('url is required for remote_write driver')
+            raise BadConfigurationException()
+        try:
+            self.shards = int(config.get('shards', 4))
+            self.batch_size = int(config.get('batch_size', 500))
+            self.queue_size = int(config.get('queue_size', 100000))
+            self.max_retries = int(config.get('max_retries', 5))
+            self.max_backoff = timerange_to_second(config.get('max_backoff', '30s'))
+            self.flush_interval = timerange_to_second(config.get('flush_interval', '1s'))
+            self.timeout = timerange_to_second(config.get('timeout', '30s'))
+        except ValueError:
+            logger.error('bad remote_write driver configuration')
+            raise BadConfigurationException()
+        if self.shards < 1 or self.batch_size < 1 or self.queue_size < 1:
+            logger.error('shards, batch_size and queue_size of remote_write driver should be at least 1')
+            raise BadConfigurationException()
+        self.username = config.get('username', None)
+        self.password = config.get('password', None)
+
+
+class InventoryConfiguration(object):
+    def __init__(self, config):
+        try:
+            self.files = config['files']
+        except KeyError:
+            logger.error('files is required for inventory')
+            raise BadConfigurationException()
+        if not isinstance(self.files, list):
+            self.files = [self.files]
+        try:
+            self.refresh_interval = timerange_to_second(config.get('refresh_interval', '30s'))
+        except ValueError:
+            raise BadConfigurationException()
+        # modules assigned to targets by their labels
+        self.module_rules = []  # type: List[Tuple[Dict, List[str]]]
+        try:
+            for rule in config.get('modules', []):
+                match = {label_name: re.compile('(?:{})$'.format(pattern))
+                         for label_name, pattern in rule.get('match', {}).items()}
+                self.module_rules.append((match, list(rule['modules'])))
+        except (KeyError, TypeError, AttributeError, re.error):
+            logger.error('inventory modules should be a list of match and modules')
+            raise BadConfigurationException()
+
+    def modules_for(self, labels: Dict[str, str]) -> List[str]:
+        modules = []
+        for match, rule_modules in self.module_rules:
+            if all(label_name in labels and pattern.match(labels[label_name])
+                   for label_name, pattern in match.items()):
+                modules += [module for module in rule_modules if module not in modules]
+        return modules
+
+
+class DriverConfiguration(object):
+    def __init__(self, config):
+        self.name = config.get('name', 'prometheus')
+        if self.name == 'prometheus':
+            self.config = PrometheusConfiguration(config.get('config', {}))
+        elif self.name == 'remote_write':
+            self.config = RemoteWriteConfiguration(config.get('config', {}))
+        elif self.name == 'influxdb':
+            self.config = InfluxDBConfiguration(config.get('config', {}))
+        else:
+            logger.error('Driver should be "prometheus", "influxdb" or "remote_write", not %s', self.name)
+            raise BadConfigurationException()
+        try:
+            # with several drivers, maximum number of polls waiting for this driver
+            self.queue_size = int(config.get('queue_size', 1000))
+        except ValueError:
+            logger.error('bad queue_size for %s driver', self.name)
+            raise BadConfigurationException()
 
 
 class ParserConfiguration(object):
     def __init__(self, config):
         logger.debug(config)
         try:
-            self.hosts = HostsConfiguration(config['hosts'])
+            self.inventory = None
+            if 'inventory' in config:
+                self.inventory = InventoryConfiguration(config['inventory'])
+                # hosts could all come from inventory files
+                self.hosts = HostsConfiguration(config.get('hosts', []))
+            else:
+                self.hosts = HostsConfiguration(config['hosts'])
             logger.debug('hosts parsed')
-            self.modules = ModulesConfiguration(config['modules'])
-            self.driver = config.get('driver', {}).get('name', 'prometheus')
-            if self.driver not in ('prometheus', 'influxdb'):
-                raise ValueError('Driver should be "prometheus" or "inflxudb"')
-            if self.driver == 'prometheus':
-                self.driver_config = PrometheusConfiguration(
-                    config.get('driver', {}).get('config', {}))
+            # default limit of series kept by a poll of a metric, 0 for no limit
+            self.max_series = max_series_of(config, 0)
+            self.modules = ModulesConfiguration(config['modules'], self.max_series)
+            driver = config.get('driver', {})
+            if isinstance(driver, list):
+                self.drivers = [DriverConfiguration(item) for item in driver]
             else:
-                self.driver_config = InfluxDBConfiguration(
-                    config.get('driver', {}).get('config', {}))
+                self.drivers = [DriverConfiguration(driver)]
+            if not self.drivers:
+                logger.error('at least one driver is required')
+                raise BadConfigurationException()
 
             logger.debug('modules parsed')
             self.descriptions = config['description']  # type: Dict
@@ -333,5 +473,11 @@ class ParserConfiguration(object):
                 'section {} not present, config useless'.format(e.args[0]))
             raise BadConfigurationException()
 
+        try:
+            self.query_cache_ttl = timerange_to_second(
+                config.get('query_cache_ttl', '0s'))
+        except ValueError:
+            raise BadConfigurationException()
+
         for host in self.hosts:
             host._resolve_module(self.modules)
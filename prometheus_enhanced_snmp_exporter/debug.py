@@ -0,0 +1,213 @@
+# This file is part of prometheus-enhanced-snmp-exporte.
+#
+# prometheus-enhanced-snmp-exporte is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# prometheus-enhanced-snmp-exporte is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with prometheus-enhanced-snmp-exporte. If not, see <https://www.gnu.org/licenses/>.
+
+import asyncio
+import cProfile
+import hmac
+import json
+import logging
+import marshal
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+
+from .driver import OutputDriver
+from .server import ExporterRequestHandler, HTTPResponse
+
+logger = logging.getLogger(__name__)
+
+# longest profile allowed, the http thread serving it is busy meanwhile
+MAX_PROFILE_SECONDS = 300
+MAX_SAMPLING_RATE = 1000
+
+_current_task = getattr(asyncio, 'current_task', None) or asyncio.Task.current_task
+
+
+def _frame_name(frame) -> str:
+    code = frame.f_code
+    return '{} ({}:{})'.format(code.co_name, os.path.basename(code.co_filename), frame.f_lineno)
+
+
+def await_chain(task: asyncio.Task) -> List[str]:
+    '''
+        frames of the coroutines awaited by the task, down to the one waiting
+    '''
+    coro = task.get_coro() if hasattr(task, 'get_coro') else getattr(task, '_coro', None)
+    stack = []
+    while coro is not None:
+        # native coroutines, or generator based ones
+        frame = getattr(coro, 'cr_frame', None) or getattr(coro, 'gi_frame', None)
+        if frame is None:
+            break
+        stack.append(_frame_name(frame))
+        coro = getattr(coro, 'cr_await', None) or getattr(coro, 'gi_yieldfrom', None)
+    return stack
+
+
+class PollRegistry(object):
+    '''
+        polls and snmp requests in flight, updated by the event loop and read by
+        the http threads
+    '''
+    def __init__(self) -> None:
+        # poll id -> (hostname, module, kind, name, start time, task)
+        self._polls = {}  # type: Dict[int, tuple]
+        self._next_id = 0
+        self._requests = Counter()  # type: Counter
+
+    @contextmanager
+    def poll(self, hostname: str, module_name: str, kind: str, name: str):
+        poll_id = self._next_id
+        self._next_id += 1
+        self._polls[poll_id] = (hostname, module_name, kind, name, time.monotonic(), _current_task())
+        try:
+            yield
+        finally:
+            del self._polls[poll_id]
+
+    @contextmanager
+    def request(self, hostname: str):
+        self._requests[hostname] += 1
+        try:
+            yield
+        finally:
+            self._requests[hostname] -= 1
+            if not self._requests[hostname]:
+                del self._requests[hostname]
+
+    def snapshot(self) -> Dict[str, Dict]:
+        '''
+            polls in flight by host, oldest first, with the await chain of their task
+        '''
+        now = time.monotonic()
+        out = {}  # type: Dict[str, Dict]
+        for hostname, module_name, kind, name, started, task in sorted(list(self._polls.values()),
+                                                                      key=lambda poll: poll[4]):
+            host = out.setdefault(hostname, {'requests': 0, 'polls': []})
+            stack = []  # type: List[str]
+            if task is not None:
+                stack = await_chain(task)
+            host['polls'].append({'module': module_name, 'kind': kind, 'name': name,
+                                  'age': round(now - started, 3), 'stack': stack})
+        for hostname, requests in list(self._requests.items()):
+            out.setdefault(hostname, {'requests': 0, 'polls': []})['requests'] = requests
+        return out
+
+
+def sample_stacks(seconds: float, rate: int) -> Counter:
+    '''
+        sample the stack of every thread rate times per second, as collapsed stacks
+        (root first, frames separated by ;) counted by occurrence
+    '''
+    own_thread = threading.get_ident()
+    samples = Counter()  # type: Counter
+    interval = 1.0 / rate
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id == own_thread:
+                continue
+            stack = []
+            while frame is not None:
+                stack.append(_frame_name(frame))
+                frame = frame.f_back
+            stack.append(names.get(thread_id, str(thread_id)))
+            samples[';'.join(reversed(stack))] += 1
+        time.sleep(interval)
+    return samples
+
+
+def profile_loop(loop: asyncio.AbstractEventLoop, seconds: float) -> Optional[bytes]:
+    '''
+        cProfile the event loop thread, output is a pstats file, or None when the
+        loop is blocked for too long to stop the profiler
+    '''
+    profiler = cProfile.Profile()
+    stopped = threading.Event()
+
+    def stop() -> None:
+        profiler.disable()
+        stopped.set()
+
+    loop.call_soon_threadsafe(profiler.enable)
+    time.sleep(seconds)
+    loop.call_soon_threadsafe(stop)
+    if not stopped.wait(10):
+        return None
+    profiler.create_stats()
+    return marshal.dumps(profiler.stats)
+
+
+class DebugEndpoints(object):
+    '''
+        /debug/profile and /debug/tasks, served to requests with the bearer token
+    '''
+    def __init__(self, token: str, loop: asyncio.AbstractEventLoop, polls: PollRegistry) -> None:
+        self._token = token.encode()
+        self._loop = loop
+        self._polls = polls
+        # a single profile at once, cProfile can't run twice on the same thread
+        self._profiling = threading.Lock()
+
+    def install(self, metrics: OutputDriver) -> None:
+        metrics.add_route('/debug/profile', self._authenticated(self.profile))
+        metrics.add_route('/debug/tasks', self._authenticated(self.tasks))
+
+    def _authenticated(self, handler):
+        def authenticated_handler(request: ExporterRequestHandler) -> HTTPResponse:
+            authorization = request.headers.get('Authorization', '')
+            if not authorization.startswith('Bearer ') or \
+                    not hmac.compare_digest(authorization[len('Bearer '):].strip().encode(), self._token):
+                return HTTPResponse(b'authentication required\n', status=401,
+                                    headers={'WWW-Authenticate': 'Bearer realm="debug"'})
+            return handler(request)
+        return authenticated_handler
+
+    def profile(self, request: ExporterRequestHandler) -> HTTPResponse:
+        try:
+            seconds = float(request.query.get('seconds', ['30'])[-1])
+            rate = int(request.query.get('rate', ['100'])[-1])
+        except ValueError:
+            return HTTPResponse(b'seconds and rate should be numbers\n', status=400)
+        profile_format = request.query.get('format', ['collapsed'])[-1]
+        if not 0 < seconds <= MAX_PROFILE_SECONDS or not 0 < rate <= MAX_SAMPLING_RATE:
+            return HTTPResponse('seconds should be in ]0, {}] and rate in ]0, {}]\n'.format(
+                MAX_PROFILE_SECONDS, MAX_SAMPLING_RATE).encode(), status=400)
+        if profile_format not in ('collapsed', 'pstats'):
+            return HTTPResponse(b'format should be collapsed or pstats\n', status=400)
+        if not self._profiling.acquire(blocking=False):
+            return HTTPResponse(b'a profile is already running\n', status=409)
+        try:
+            logger.info('%s profile for %ss requested by %s', profile_format, seconds, request.address_string())
+            if profile_format == 'pstats':
+                stats = profile_loop(self._loop, seconds)
+                if stats is None:
+                    return HTTPResponse(b'event loop blocked, use format=collapsed\n', status=503)
+                return HTTPResponse(stats, 'application/octet-stream',
+                                    headers={'Content-Disposition': 'attachment; filename="exporter.pstats"'})
+            samples = sample_stacks(seconds, rate)
+        finally:
+            self._profiling.release()
+        out = ''.join('{} {}\n'.format(stack, count) for stack, count in samples.most_common())
+        return HTTPResponse(out.encode(), 'text/plain')
+
+    def tasks(self, request: ExporterRequestHandler) -> HTTPResponse:
+        return HTTPResponse((json.dumps(self._polls.snapshot(), indent=2, sort_keys=True) + '\n').encode(),
+                            'application/json')
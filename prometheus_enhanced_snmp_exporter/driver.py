@@ -13,16 +13,79 @@
 # You should have received a copy of the GNU General Public License
 # along with prometheus-enhanced-snmp-exporte. If not, see <https://www.gnu.org/licenses/>.
 
-from typing import Dict
+from typing import Dict, List, Tuple
+
+FINGERPRINT_MASK = 0xffffffffffffffff
+
+
+def escape_label_value(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
 
 
 def label_to_str(labels: Dict[str, str]):
     labels_str = []
     for label_name, label_value in sorted(labels.items()):
         label_str = '{}="{}"'.format(
-            label_name, label_value.replace('"', '\\"'))
+            label_name, escape_label_value(str(label_value)))
         labels_str.append(label_str)
-    return ', '.join(labels_str)
+    # no space after the comma, openmetrics don't allow it
+    return ','.join(labels_str)
+
+
+class LabelSetIndex(object):
+    '''
+        intern label sets behind a 64 bits fingerprint, to key series without
+        rendering their labels. A label set is rendered to text only once,
+        the first time it's exposed
+    '''
+    def __init__(self) -> None:
+        # fingerprint -> [label tuple, rendered labels or None]
+        self._sets = {}  # type: Dict[int, List]
+        # label sets probed away from their own fingerprint, still found once
+        # the label set on their own fingerprint is forgotten
+        self._moved = {}  # type: Dict[Tuple[Tuple[str, str], ...], int]
+        # size of the rendered labels kept
+        self.label_bytes = 0
+
+    def fingerprint(self, labels: Dict[str, str]) -> int:
+        label_tuple = tuple(sorted(labels.items()))
+        fingerprint = hash(label_tuple) & FINGERPRINT_MASK
+        entry = self._sets.get(fingerprint)
+        if entry is not None and entry[0] == label_tuple:
+            return fingerprint
+        if self._moved and label_tuple in self._moved:
+            return self._moved[label_tuple]
+        own_fingerprint = fingerprint
+        while entry is not None:
+            # collision with another label set, probe the next fingerprint
+            fingerprint = (fingerprint + 1) & FINGERPRINT_MASK
+            entry = self._sets.get(fingerprint)
+        self._sets[fingerprint] = [label_tuple, None]
+        if fingerprint != own_fingerprint:
+            self._moved[label_tuple] = fingerprint
+        return fingerprint
+
+    def labels(self, fingerprint: int) -> Tuple[Tuple[str, str], ...]:
+        return self._sets[fingerprint][0]
+
+    def label_str(self, fingerprint: int) -> str:
+        entry = self._sets[fingerprint]
+        if entry[1] is None:
+            entry[1] = label_to_str(dict(entry[0]))
+            self.label_bytes += len(entry[1])
+        return entry[1]
+
+    def retain(self, fingerprints) -> None:
+        # forget label sets not used anymore
+        for fingerprint in [fingerprint for fingerprint in self._sets if fingerprint not in fingerprints]:
+            label_tuple, label_str = self._sets.pop(fingerprint)
+            if self._moved.get(label_tuple) == fingerprint:
+                del self._moved[label_tuple]
+            if label_str is not None:
+                self.label_bytes -= len(label_str)
+
+    def __len__(self) -> int:
+        return len(self._sets)
 
 
 class OutputDriver(object):
@@ -32,11 +95,29 @@ class OutputDriver(object):
     def add_metric(self, name: str, metric_type: str, description: str) -> None:
         raise NotImplemented()
 
+    def add_module(self, module_name: str, metric_names: List[str]) -> None:
+        raise NotImplemented()
+
     def clear(self, hostname: str, metric_name: str) -> None:
         raise NotImplemented()
 
     def release_update_lock(self, hostname: str, metric_name: str) -> None:
         raise NotImplemented()
 
+    def discard_update(self, hostname: str, metric_name: str) -> None:
+        raise NotImplemented()
+
     def update_metric(self, hostname: str, metric_name: str, labels: str, value: str) -> None:
         raise NotImplemented()
+
+    def forget(self, hostname: str, metric_name: str) -> None:
+        raise NotImplemented()
+
+    def remove_metric(self, name: str) -> None:
+        # metric removed by a reload, its series are already forgotten, only
+        # drivers with a layout shared between metrics need to know
+        pass
+
+    def add_route(self, path: str, handler) -> None:
+        # only drivers with an http server expose extra routes
+        pass
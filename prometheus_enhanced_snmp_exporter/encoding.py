@@ -0,0 +1,137 @@
+# This file is part of prometheus-enhanced-snmp-exporte.
+#
+# prometheus-enhanced-snmp-exporte is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# prometheus-enhanced-snmp-exporte is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with prometheus-enhanced-snmp-exporte. If not, see <https://www.gnu.org/licenses/>.
+
+import struct
+import time
+import zlib
+from threading import Lock
+from typing import Optional
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+class GzipStream(object):
+    '''
+        single gzip stream made of blocks compressed independently : each block is a raw
+        deflate segment ending on a byte-aligned sync flush, so cached segments could be
+        concatenated as is. Only the crc and the size are computed while streaming
+    '''
+    name = 'gzip'
+    # magic, deflate, no flag, no mtime, no extra flag, unknown os
+    HEADER = b'\x1f\x8b\x08\x00\x00\x00\x00\x00\x00\xff'
+    # empty final block, with fixed huffman codes
+    FINAL_BLOCK = b'\x03\x00'
+
+    @staticmethod
+    def compress_block(data: bytes) -> bytes:
+        compressor = zlib.compressobj(6, zlib.DEFLATED, -15)
+        return compressor.compress(data) + compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def __init__(self) -> None:
+        self._crc = 0
+        self._size = 0
+
+    def start(self) -> bytes:
+        return self.HEADER
+
+    def add(self, data: bytes, compressed: bytes) -> bytes:
+        self._crc = zlib.crc32(data, self._crc)
+        self._size += len(data)
+        return compressed
+
+    def finish(self) -> bytes:
+        return self.FINAL_BLOCK + struct.pack('<II', self._crc & 0xffffffff, self._size & 0xffffffff)
+
+
+class ZstdStream(object):
+    '''
+        zstd frames could be concatenated, each block is a full frame
+    '''
+    name = 'zstd'
+
+    @staticmethod
+    def compress_block(data: bytes) -> bytes:
+        return zstandard.ZstdCompressor(level=3).compress(data)
+
+    def start(self) -> bytes:
+        return b''
+
+    def add(self, data: bytes, compressed: bytes) -> bytes:
+        return compressed
+
+    def finish(self) -> bytes:
+        return b''
+
+
+# stream class of each encoding
+STREAMS = {'gzip': GzipStream}  # type: dict
+if zstandard is not None:
+    STREAMS['zstd'] = ZstdStream
+
+# on equal quality, the first one is chosen
+ENCODING_PREFERENCE = ['zstd', 'gzip']
+
+
+def negotiate_encoding(accept_encoding: Optional[str]) -> Optional[str]:
+    '''
+        return the encoding to use for an Accept-Encoding header, None for identity
+    '''
+    if not accept_encoding:
+        return None
+    qualities = {}
+    for item in accept_encoding.split(','):
+        component = item.strip().split(';')
+        name = component[0].strip().lower()
+        quality = 1.0
+        for param in component[1:]:
+            param = param.strip()
+            if param.startswith('q='):
+                try:
+                    quality = float(param[2:])
+                except ValueError:
+                    quality = 0.0
+        qualities[name] = quality
+    best = None
+    best_quality = 0.0
+    for name in ENCODING_PREFERENCE:
+        if name not in STREAMS:
+            continue
+        quality = qualities.get(name, qualities.get('*', 0.0))
+        if quality > best_quality:
+            best = name
+            best_quality = quality
+    return best
+
+
+class CompressionStats(object):
+    def __init__(self) -> None:
+        self._lock = Lock()
+        # totals by encoding
+        self.input_bytes = {}  # type: dict
+        self.output_bytes = {}  # type: dict
+        self.seconds = {}  # type: dict
+
+    def compress(self, encoding: str, data: bytes) -> bytes:
+        start_time = time.perf_counter()
+        out = STREAMS[encoding].compress_block(data)
+        duration = time.perf_counter() - start_time
+        with self._lock:
+            self.input_bytes[encoding] = self.input_bytes.get(encoding, 0) + len(data)
+            self.output_bytes[encoding] = self.output_bytes.get(encoding, 0) + len(out)
+            self.seconds[encoding] = self.seconds.get(encoding, 0.0) + duration
+        return out
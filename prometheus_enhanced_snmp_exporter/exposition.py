@@ -0,0 +1,208 @@
+# This file is part of prometheus-enhanced-snmp-exporte.
+#
+# prometheus-enhanced-snmp-exporte is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# prometheus-enhanced-snmp-exporte is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with prometheus-enhanced-snmp-exporte. If not, see <https://www.gnu.org/licenses/>.
+
+from .protobuf import encode_varint, field_bytes, field_double, field_string, field_varint
+from typing import List, Optional, Tuple
+
+# a series is (rendered labels, label pairs, value, timestamp in ms or None)
+Series = Tuple[str, Tuple[Tuple[str, str], ...], object, Optional[int]]
+
+
+def escape_help(description: str) -> str:
+    return description.replace('\\', '\\\\').replace('\n', '\\n')
+
+
+def to_float(value) -> Optional[float]:
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+class TextFormat(object):
+    '''
+        prometheus text format 0.0.4
+    '''
+    name = 'text'
+    content_type = 'text/plain; version=0.0.4; charset=utf-8'
+    separator = b'\n'
+    footer = b''
+    # the blocks of a metric are written as is, without a size before them
+    framed = False
+
+    @staticmethod
+    def header(name: str, metric_type: str, description: str) -> bytes:
+        return "# TYPE {} {}\n# HELP {} {}\n".format(name, metric_type, name, escape_help(description)).encode()
+
+    @staticmethod
+    def series(name: str, metric_type: str, description: str, series: List[Series]) -> bytes:
+        lines = []
+        for label_str, _, value, timestamp in series:
+            if timestamp is None:
+                lines.append("{}{{{}}} {}\n".format(name, label_str, value))
+            else:
+                lines.append("{}{{{}}} {} {}\n".format(name, label_str, value, timestamp))
+        return ''.join(lines).encode()
+
+
+class OpenMetricsFormat(object):
+    '''
+        openmetrics text format 1.0.0
+    '''
+    name = 'openmetrics'
+    content_type = 'application/openmetrics-text; version=1.0.0; charset=utf-8'
+    separator = b''
+    footer = b'# EOF\n'
+    framed = False
+
+    @staticmethod
+    def family(name: str, metric_type: str) -> Tuple[str, str]:
+        # values are raw snmp values, only plain counter and gauge could be typed,
+        # counter without _total suffix stay unknown so series name don't change
+        if metric_type == 'gauge':
+            return name, 'gauge'
+        if metric_type == 'counter' and name.endswith('_total'):
+            return name[:-len('_total')], 'counter'
+        return name, 'unknown'
+
+    @staticmethod
+    def header(name: str, metric_type: str, description: str) -> bytes:
+        family, family_type = OpenMetricsFormat.family(name, metric_type)
+        return "# TYPE {} {}\n# HELP {} {}\n".format(family, family_type, family, escape_help(description)).encode()
+
+    @staticmethod
+    def series(name: str, metric_type: str, description: str, series: List[Series]) -> bytes:
+        lines = []
+        for label_str, _, value, timestamp in series:
+            if to_float(value) is None:
+                continue
+            if timestamp is None:
+                lines.append("{}{{{}}} {}\n".format(name, label_str, value))
+            else:
+                lines.append("{}{{{}}} {} {:.3f}\n".format(name, label_str, value, timestamp / 1000))
+        return ''.join(lines).encode()
+
+
+class ProtobufFormat(object):
+    '''
+        prometheus protobuf delimited format. A metric is a single MetricFamily : the
+        header holds its name, help and type, each host block a part of its repeated
+        metric field, and the size of the message is written before them at scrape time
+    '''
+    name = 'protobuf'
+    content_type = 'application/vnd.google.protobuf; proto=io.prometheus.client.MetricFamily; encoding=delimited'
+    separator = b''
+    footer = b''
+    framed = True
+
+    # io.prometheus.client.MetricType, with the field holding the value on Metric
+    TYPES = {
+        'counter': (0, 3),
+        'gauge': (1, 2),
+    }
+    UNTYPED = (3, 5)
+
+    @staticmethod
+    def frame(size: int) -> bytes:
+        return encode_varint(size)
+
+    @staticmethod
+    def header(name: str, metric_type: str, description: str) -> bytes:
+        type_id = ProtobufFormat.TYPES.get(metric_type, ProtobufFormat.UNTYPED)[0]
+        return field_string(1, name) + field_string(2, description) + field_varint(3, type_id)
+
+    @staticmethod
+    def series(name: str, metric_type: str, description: str, series: List[Series]) -> bytes:
+        value_field = ProtobufFormat.TYPES.get(metric_type, ProtobufFormat.UNTYPED)[1]
+        metrics = []
+        for _, label_pairs, value, timestamp in series:
+            value = to_float(value)
+            if value is None:
+                continue
+            metric = b''.join(field_bytes(1, field_string(1, label_name) + field_string(2, str(label_value)))
+                              for label_name, label_value in label_pairs)
+            metric += field_bytes(value_field, field_double(1, value))
+            if timestamp is not None:
+                metric += field_varint(6, timestamp)
+            metrics.append(field_bytes(4, metric))
+        return b''.join(metrics)
+
+
+def framed_family(exposition_format, header: bytes, series: bytes) -> bytes:
+    '''
+        a whole metric family rendered at once, empty families are left out of
+        framed formats
+    '''
+    if not exposition_format.framed:
+        return header + series
+    if not series:
+        return b''
+    return exposition_format.frame(len(header) + len(series)) + header + series
+
+
+FORMATS = {
+    TextFormat.name: TextFormat,
+    OpenMetricsFormat.name: OpenMetricsFormat,
+    ProtobufFormat.name: ProtobufFormat,
+}
+
+# on equal quality, the first one is chosen
+FORMAT_PREFERENCE = [ProtobufFormat, OpenMetricsFormat, TextFormat]
+
+
+def _media_format(media_type: str, params: dict):
+    if media_type == 'application/vnd.google.protobuf':
+        if params.get('proto') == 'io.prometheus.client.MetricFamily' and \
+           params.get('encoding') == 'delimited':
+            return ProtobufFormat
+        return None
+    if media_type == 'application/openmetrics-text':
+        return OpenMetricsFormat
+    if media_type in ('text/plain', 'text/*', '*/*'):
+        return TextFormat
+    return None
+
+
+def negotiate_format(accept: Optional[str]):
+    '''
+        return the exposition format to use for an Accept header
+    '''
+    if not accept:
+        return TextFormat
+    qualities = {}
+    for item in accept.split(','):
+        component = item.strip().split(';')
+        media_type = component[0].strip().lower()
+        params = {}
+        for param in component[1:]:
+            if '=' not in param:
+                continue
+            param_name, param_value = param.split('=', 1)
+            params[param_name.strip().lower()] = param_value.strip().strip('"')
+        try:
+            quality = float(params.get('q', 1.0))
+        except ValueError:
+            quality = 0.0
+        exposition_format = _media_format(media_type, params)
+        if exposition_format is not None:
+            qualities[exposition_format] = max(quality, qualities.get(exposition_format, 0.0))
+    best = TextFormat
+    best_quality = 0.0
+    for exposition_format in FORMAT_PREFERENCE:
+        quality = qualities.get(exposition_format, 0.0)
+        if quality > best_quality:
+            best = exposition_format
+            best_quality = quality
+    return best
@@ -0,0 +1,126 @@
+# This file is part of prometheus-enhanced-snmp-exporte.
+#
+# prometheus-enhanced-snmp-exporte is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# prometheus-enhanced-snmp-exporte is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with prometheus-enhanced-snmp-exporte. If not, see <https://www.gnu.org/licenses/>.
+
+import logging
+import queue
+import threading
+import time
+from typing import Dict, List, Tuple
+
+from .driver import OutputDriver
+
+logger = logging.getLogger(__name__)
+
+# a poll of a metric on a host : hostname, metric name and (labels, value) samples,
+# without samples the metric is forgotten for this host
+PollResult = Tuple[str, str, List[Tuple[Dict[str, str], str]]]
+
+
+class SinkWorker(threading.Thread):
+    '''
+        apply poll results to one driver, from its own queue, so a slow
+        driver only delays itself
+    '''
+    def __init__(self, name: str, driver: OutputDriver, queue_size: int) -> None:
+        threading.Thread.__init__(self, name='sink-{}'.format(name), daemon=True)
+        self.sink_name = name
+        self.driver = driver
+        self.queue = queue.Queue(queue_size)  # type: queue.Queue
+        self.dropped = 0
+        self._last_drop_warning = 0.0
+
+    def submit(self, result: PollResult) -> None:
+        try:
+            self.queue.put_nowait(result)
+        except queue.Full:
+            self.dropped += 1
+            now = time.monotonic()
+            if now - self._last_drop_warning > 60:
+                self._last_drop_warning = now
+                logger.warning('%s driver is late, poll results are dropped (%s so far)',
+                               self.sink_name, self.dropped)
+
+    def run(self) -> None:
+        while True:
+            hostname, metric_name, samples = self.queue.get()
+            if samples is None:
+                self.driver.forget(hostname, metric_name)
+                continue
+            self.driver.clear(hostname, metric_name)
+            try:
+                for labels, value in samples:
+                    self.driver.update_metric(hostname, metric_name, labels, value)
+            except Exception:
+                # the driver keeps the last complete poll
+                logger.exception('%s driver failed to update %s on %s', self.sink_name, metric_name, hostname)
+                self.driver.discard_update(hostname, metric_name)
+            else:
+                self.driver.release_update_lock(hostname, metric_name)
+
+
+class FanOutDriver(OutputDriver):
+    '''
+        send each poll to several drivers. Samples of a poll are collected once,
+        with their resolved labels, and the full poll is queued to every driver
+        when it's released
+    '''
+    def __init__(self, drivers: List[Tuple[str, OutputDriver, int]]) -> None:
+        self._workers = [SinkWorker(name, driver, queue_size) for name, driver, queue_size in drivers]
+        self._pending = {}  # type: Dict[Tuple[str, str], List[Tuple[Dict[str, str], str]]]
+        for worker in self._workers:
+            worker.start()
+
+    def start_serving(self) -> None:
+        for worker in self._workers:
+            worker.driver.start_serving()
+
+    def add_metric(self, name: str, metric_type: str, description: str) -> None:
+        for worker in self._workers:
+            worker.driver.add_metric(name, metric_type, description)
+
+    def remove_metric(self, name: str) -> None:
+        for worker in self._workers:
+            worker.driver.remove_metric(name)
+
+    def add_module(self, module_name: str, metric_names: List[str]) -> None:
+        for worker in self._workers:
+            worker.driver.add_module(module_name, metric_names)
+
+    def clear(self, hostname: str, metric_name: str) -> None:
+        self._pending[(hostname, metric_name)] = []
+
+    def update_metric(self, hostname: str, metric_name: str, labels: Dict[str, str], value: str) -> None:
+        self._pending[(hostname, metric_name)].append((labels, value))
+
+    def release_update_lock(self, hostname: str, metric_name: str) -> None:
+        samples = self._pending.pop((hostname, metric_name), None)
+        if samples is None:
+            return
+        for worker in self._workers:
+            worker.submit((hostname, metric_name, samples))
+
+    def discard_update(self, hostname: str, metric_name: str) -> None:
+        # drivers never see an incomplete poll
+        self._pending.pop((hostname, metric_name), None)
+
+    def forget(self, hostname: str, metric_name: str) -> None:
+        # queued, after the polls already waiting for each driver, never
+        # blocking the caller
+        for worker in self._workers:
+            worker.submit((hostname, metric_name, None))
+
+    def add_route(self, path: str, handler) -> None:
+        for worker in self._workers:
+            worker.driver.add_route(path, handler)
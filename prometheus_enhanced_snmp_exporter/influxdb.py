@@ -13,121 +13,403 @@
 # You should have received a copy of the GNU General Public License
 # along with prometheus-enhanced-snmp-exporte. If not, see <https://www.gnu.org/licenses/>.
 
-from .driver import OutputDriver, label_to_str
+from .driver import LabelSetIndex, OutputDriver
 from .scheduler import JobScheduler
-from datetime import datetime
+import asyncio
+from array import array
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlencode
+import base64
+import gzip
+import http.client
 import math
-from influxdb import InfluxDBClient
-from influxdb.exceptions import InfluxDBServerError, InfluxDBClientError
-from datetime import datetime
+import os
+import struct
 import threading
 from threading import Lock
 import logging
 import time
-from typing import Dict, List
+from typing import Dict, List, Optional, Tuple
 
 
 logger = logging.getLogger(__name__)
 
+# line protocol escaping, measurement and keys/tag values
+_MEASUREMENT_ESCAPE = str.maketrans({',': '\\,', ' ': '\\ '})
+_KEY_ESCAPE = str.maketrans({',': '\\,', '=': '\\=', ' ': '\\ '})
 
-def grouped(iterable, n):
-    iter_size = len(iterable)
-    for group in range(math.ceil(iter_size / n)):
-        min_index = group * n
-        max_index = (group+1) * n
-        if max_index > iter_size:
-            max_index = iter_size
-        yield iterable[min_index:max_index]
+# outcome of a write
+WRITE_OK = 0
+WRITE_REJECTED = 1
+WRITE_FAILED = 2
 
 
-class InfluxDbRow():
-    def __init__(self, labels: Dict[str, str], values_attr: List[str]) -> None:
-        self.labels = labels
-        self.values = {}
-        self.values_updated = {}
-        self.mapping = {}
-        self.time = None
-        for item in values_attr:
-            self.values_updated[item] = False
+def line_series_key(measurement: str, labels: Dict[str, str]) -> str:
+    '''
+        measurement and tags part of a line, computed once per row
+    '''
+    out = [measurement.translate(_MEASUREMENT_ESCAPE)]
+    for label_name, label_value in sorted(labels.items()):
+        label_value = str(label_value)
+        if label_value == '':
+            # empty tag values are refused by influx
+            continue
+        out.append('{}={}'.format(label_name.translate(_KEY_ESCAPE), label_value.translate(_KEY_ESCAPE)))
+    return ','.join(out)
 
-    def update(self, key: str, value: str) -> None:
-        if key not in self.values_updated:
-            raise ValueError(
-                "invalid expeded value {} for this measurement".format(key))
-        logger.debug('updated values {}'.format(value))
+
+class InfluxDbRow(object):
+    '''
+        one series of a measurement, values are stored at the field position given by the
+        measurement, and each bit of updated tells if the field got a value since the last point
+    '''
+    __slots__ = ('series_key', 'values', 'updated', 'time', 'written', 'written_time')
+
+    def __init__(self, series_key: str, fields_count: int) -> None:
+        self.series_key = series_key
+        # nan until the field get a value
+        self.values = array('d', [math.nan]) * fields_count
+        self.updated = 0
+        self.time = None  # type: Optional[int]
+        # with deduplication only, last values written and time of the last full point
+        self.written = None  # type: Optional[array]
+        self.written_time = 0
+
+    def update(self, position: int, value: str) -> None:
+        if self.updated == 0:
+            # the point is timestamped by its first field
+            self.time = int(time.time() * 1000)
         # we need to perform casting here to have the proper type in inflox
-        self.values[key] = float(value)
-        self.values_updated[key] = True
-        if not self.is_edited():
-            self.time = datetime.utcnow()
-
-    def is_edited(self) -> bool:
-        for i in self.values_updated.values():
-            if i:
-                return True
-        return False
-
-    def ready_to_sync(self) -> bool:
-        for i in self.values_updated.values():
-            if not i:
-                return False
-        return True
+        self.values[position] = float(value)
+        self.updated |= 1 << position
 
     def flush(self) -> None:
-        logger.debug('pre flush', self.values_updated)
-        for key, val in self.values_updated.items():
-            self.values_updated[key] = False
-        logger.debug('post flush', self.values_updated)
-
-    def push_to_influx(self, measurement: str, result: List[Dict[str, str]]) -> None:
-        if self.is_edited:
-            payload = {}
-            payload['tags'] = self.labels
-            payload['measurement'] = measurement.split('$')[0]
-            payload['fields'] = self.values
-            payload['time'] = self.time
-            result.append(payload)
+        self.updated = 0
+        self.time = None
+
+    def _changed_fields(self, heartbeat: int) -> List[int]:
+        if self.written is None:
+            self.written = array('d', [math.nan]) * len(self.values)
+        if self.time - self.written_time >= heartbeat:
+            # heartbeat, write every field even unchanged
+            self.written_time = self.time
+            positions = range(len(self.values))
+        else:
+            positions = [position for position, value in enumerate(self.values) if value != self.written[position]]
+        for position in positions:
+            self.written[position] = self.values[position]
+        return positions
+
+    def push_to_influx(self, buffer: bytearray, field_keys: List[str], heartbeat: Optional[int] = None) -> int:
+        '''
+            append the row as a line protocol point, return the number of points added.
+            With a heartbeat (in ms), only fields changed since the last write are written,
+            unless the last full point is older than the heartbeat
+        '''
+        points = 0
+        if self.updated:
+            values = self.values
+            if heartbeat is None:
+                positions = range(len(values))
+            else:
+                positions = self._changed_fields(heartbeat)
+            fields = ','.join('{}={}'.format(field_keys[position], repr(values[position]))
+                              for position in positions if math.isfinite(values[position]))
+            if fields:
+                line = self.series_key + ' ' + fields
+                if self.time is not None:
+                    line += ' ' + str(self.time)
+                buffer += line.encode()
+                buffer += b'\n'
+                points = 1
         self.flush()
+        return points
 
 
 class InfluxDBMeasurement(object):
-    def __init__(self, measurement: str) -> None:
-        self._data = {}
-        self._changes = []
-        self._attrs_row = []
+    def __init__(self, measurement: str, batch_size: int = 5000, heartbeat: Optional[float] = None) -> None:
+        self._data = {}  # type: Dict[str, Dict[int, InfluxDbRow]]
+        self._label_sets = {}  # type: Dict[str, LabelSetIndex]
+        # points are written as line protocol, by batches of batch_size points
+        self._batch_size = batch_size
+        self._batches = []  # type: List[Tuple[bytes, int]]
+        self._buffer = bytearray()
+        self._buffer_points = 0
+        # position of each field in the rows, and its escaped name
+        self._field_positions = {}  # type: Dict[str, int]
+        self._field_keys = []  # type: List[str]
+        self._complete = 0
+        # deduplication of unchanged values, when a heartbeat is set
+        self._heartbeat = int(heartbeat * 1000) if heartbeat is not None else None
         self._changeLock = Lock()
         self.measurement = measurement
 
     def add_metric(self, attr: str) -> None:
-        self._attrs_row.append(attr)
+        if attr in self._field_positions:
+            return
+        self._field_positions[attr] = len(self._field_keys)
+        self._field_keys.append(attr.translate(_KEY_ESCAPE))
+        self._complete = (1 << len(self._field_keys)) - 1
 
-    def update(self, hostname: str, labels: Dict[str, str], key: str, value: float) -> None:
-        label_canonicalized = label_to_str(labels)
+    def has_field(self, attr: str) -> bool:
+        return attr in self._field_positions
+
+    def update(self, hostname: str, labels: Dict[str, str], key: str, value: float) -> int:
+        '''
+            return the size of the point written when the row is complete, 0 otherwise
+        '''
+        size = 0
+        try:
+            position = self._field_positions[key]
+        except KeyError:
+            raise ValueError(
+                "invalid expeded value {} for this measurement".format(key))
         if hostname not in self._data:
             self._data[hostname] = {}
-        if label_canonicalized not in self._data[hostname]:
-            self._data[hostname][label_canonicalized] = InfluxDbRow(
-                labels, self._attrs_row)
-        self._data[hostname][label_canonicalized].update(key, value)
-        if self._data[hostname][label_canonicalized].ready_to_sync():
+            self._label_sets[hostname] = LabelSetIndex()
+        fingerprint = self._label_sets[hostname].fingerprint(labels)
+        row = self._data[hostname].get(fingerprint)
+        if row is None:
+            row = InfluxDbRow(line_series_key(self.measurement.split('$')[0], labels), len(self._field_keys))
+            self._data[hostname][fingerprint] = row
+        row.update(position, value)
+        if row.updated == self._complete:
             with self._changeLock:
-                self._data[hostname][label_canonicalized].push_to_influx(
-                    self.measurement, self._changes)
-            self._data[hostname][label_canonicalized].flush()
+                size = len(self._buffer)
+                self._buffer_points += row.push_to_influx(self._buffer, self._field_keys, self._heartbeat)
+                size = len(self._buffer) - size
+                if self._buffer_points >= self._batch_size:
+                    self._batches.append((bytes(self._buffer), self._buffer_points))
+                    self._buffer.clear()
+                    self._buffer_points = 0
+        return size
 
-    def push_to_influx(self):
+    def forget(self, hostname: str) -> None:
+        self._data.pop(hostname, None)
+        self._label_sets.pop(hostname, None)
+
+    def push_to_influx(self) -> List[Tuple[bytes, int]]:
+        '''
+            return pending batches, as (line protocol payload, number of points)
+        '''
         with self._changeLock:
-            result = self._changes.copy()
-            self._changes = []
+            result = self._batches
+            self._batches = []
+            if self._buffer_points > 0:
+                result.append((bytes(self._buffer), self._buffer_points))
+                self._buffer.clear()
+                self._buffer_points = 0
         return result
 
 
-class InfluxDBDriver(OutputDriver, threading.Thread):
-    def __init__(self, scheduler: JobScheduler, host: str, db: str, username: str, password: str) -> None:
-        threading.Thread.__init__(self)
-        self._influx = InfluxDBClient(
-            host=host, username=username, password=password, database=db)
+class InfluxDBWriter(object):
+    '''
+        send line protocol batches with several writes in flight, each worker
+        thread keeping its own connection open
+    '''
+    def __init__(self, host: str, port: int, db: str, username: str, password: str, ssl: bool = False,
+                 concurrency: int = 4, compress: bool = True, timeout: float = 30) -> None:
+        self._host = host
+        self._port = port
+        self._ssl = ssl
+        self._timeout = timeout
+        self._compress = compress
+        self._path = '/write?' + urlencode({'db': db, 'precision': 'ms'})
+        self._headers = {'Content-Type': 'text/plain; charset=utf-8'}
+        if username:
+            credentials = '{}:{}'.format(username, password or '').encode()
+            self._headers['Authorization'] = 'Basic ' + base64.b64encode(credentials).decode()
+        if compress:
+            self._headers['Content-Encoding'] = 'gzip'
+        self._executor = ThreadPoolExecutor(max_workers=concurrency)
+        self._local = threading.local()
+
+    def _connection(self) -> http.client.HTTPConnection:
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            if self._ssl:
+                connection = http.client.HTTPSConnection(self._host, self._port, timeout=self._timeout)
+            else:
+                connection = http.client.HTTPConnection(self._host, self._port, timeout=self._timeout)
+            self._local.connection = connection
+        return connection
+
+    def _post(self, body: bytes) -> Tuple[int, bytes]:
+        connection = self._connection()
+        try:
+            connection.request('POST', self._path, body, self._headers)
+            response = connection.getresponse()
+            return response.status, response.read()
+        except (OSError, http.client.HTTPException):
+            connection.close()
+            self._local.connection = None
+            raise
+
+    def write(self, payload: bytes, points: int) -> int:
+        '''
+            single write attempt, failed batches are kept by the driver and sent again later
+        '''
+        if self._compress:
+            payload = gzip.compress(payload, 5)
+        # second try only for a keep-alive connection closed by the server
+        for i in range(2):
+            try:
+                status, content = self._post(payload)
+            except (OSError, http.client.HTTPException) as e:
+                error = e
+                continue
+            if status < 300:
+                return WRITE_OK
+            if status < 500:
+                # bad points, influx won't accept them on retry
+                logger.error('influx refused %s points: %s %s', points, status, content[:200])
+                return WRITE_REJECTED
+            logger.warning('influx write failed: %s %s', status, content[:200])
+            return WRITE_FAILED
+        logger.warning('influx write failed: %s', error)
+        return WRITE_FAILED
+
+    def write_many(self, batches: List[Tuple[bytes, int]]) -> List[int]:
+        futures = [self._executor.submit(self.write, payload, points) for payload, points in batches]
+        return [future.result() for future in futures]
+
+
+class InfluxDBSpool(object):
+    '''
+        append only files holding batches that don't fit in memory, read back in
+        the write order. A record is its number of points, its size and the payload
+    '''
+    RECORD_HEADER = struct.Struct('<II')
+    SEGMENT_SIZE = 64 * 1024 * 1024
+
+    def __init__(self, directory: str, max_size: int) -> None:
+        self._directory = directory
+        self._max_size = max_size
+        os.makedirs(directory, exist_ok=True)
+        self._segments = sorted(int(name[:-len('.spool')]) for name in os.listdir(directory)
+                                if name.endswith('.spool'))
+        self._read_position = (self._segments[0] if self._segments else 0, 0)
+        try:
+            with open(os.path.join(directory, 'position'), 'r') as position_file:
+                segment, offset = position_file.read().split()
+                if int(segment) in self._segments:
+                    self._read_position = (int(segment), int(offset))
+        except (OSError, ValueError):
+            pass
+        self.pending_points = 0
+        self.size = 0
+        for segment in self._segments:
+            offset = self._read_position[1] if segment == self._read_position[0] else 0
+            for points, payload, offset in self._records(segment, offset):
+                self.pending_points += points
+                self.size += self.RECORD_HEADER.size + len(payload)
+        if self.pending_points:
+            logger.info('%s points to replay from %s', self.pending_points, directory)
+
+    def _path(self, segment: int) -> str:
+        return os.path.join(self._directory, '{:012d}.spool'.format(segment))
+
+    def _records(self, segment: int, offset: int, count: int = None):
+        with open(self._path(segment), 'rb') as segment_file:
+            segment_file.seek(offset)
+            while count is None or count > 0:
+                header = segment_file.read(self.RECORD_HEADER.size)
+                if len(header) < self.RECORD_HEADER.size:
+                    # end of the segment, or a record truncated by a crash
+                    return
+                points, size = self.RECORD_HEADER.unpack(header)
+                payload = segment_file.read(size)
+                if len(payload) < size:
+                    return
+                offset += self.RECORD_HEADER.size + size
+                yield points, payload, offset
+                if count is not None:
+                    count -= 1
+
+    def append(self, payload: bytes, points: int) -> bool:
+        if self.size + len(payload) > self._max_size:
+            return False
+        if not self._segments or os.path.getsize(self._path(self._segments[-1])) > self.SEGMENT_SIZE:
+            self._segments.append(self._segments[-1] + 1 if self._segments else 0)
+        with open(self._path(self._segments[-1]), 'ab') as segment_file:
+            segment_file.write(self.RECORD_HEADER.pack(points, len(payload)))
+            segment_file.write(payload)
+        self.pending_points += points
+        self.size += self.RECORD_HEADER.size + len(payload)
+        return True
+
+    def read(self, count: int) -> Tuple[List[Tuple[bytes, int]], Tuple[int, int]]:
+        '''
+            return the next count batches, and the position to commit once they are written
+        '''
+        segment, offset = self._read_position
+        batches = []
+        while len(batches) < count and segment in self._segments:
+            for points, payload, offset in self._records(segment, offset, count - len(batches)):
+                batches.append((payload, points))
+            if len(batches) < count and segment != self._segments[-1]:
+                segment, offset = segment + 1, 0
+            else:
+                break
+        return batches, (segment, offset)
+
+    def commit(self, batches: List[Tuple[bytes, int]], position: Tuple[int, int]) -> None:
+        for segment in [segment for segment in self._segments if segment < position[0]]:
+            os.remove(self._path(segment))
+            self._segments.remove(segment)
+        self._read_position = position
+        for payload, points in batches:
+            self.pending_points -= points
+            self.size -= self.RECORD_HEADER.size + len(payload)
+        if self.pending_points == 0:
+            # everything is replayed, start again from an empty segment
+            for segment in self._segments:
+                os.remove(self._path(segment))
+            self._segments = []
+            self._read_position = (0, 0)
+        with open(os.path.join(self._directory, 'position'), 'w') as position_file:
+            position_file.write('{} {}'.format(*self._read_position))
+
+
+class InfluxDBDriver(OutputDriver):
+    '''
+        points are flushed when flush_points points or flush_bytes bytes are pending,
+        or when the oldest pending point is flush_interval old. The flush is triggered
+        from the asyncio loop, writes are done by a single thread so they stay ordered
+    '''
+    def __init__(self, scheduler: JobScheduler, host: str, db: str, username: str, password: str,
+                 port: int = 8086, ssl: bool = False, batch_size: int = 5000, concurrency: int = 4,
+                 compress: bool = True, timeout: float = 30, buffer_points: int = 500000,
+                 spool_dir: Optional[str] = None, spool_max_size: int = 1024 ** 3, flush_points: int = 5000,
+                 flush_bytes: int = 1024 ** 2, flush_interval: float = 10, dedup: bool = False,
+                 heartbeat: float = 600) -> None:
+        self._writer = InfluxDBWriter(host, port, db, username, password, ssl, concurrency, compress, timeout)
+        self._batch_size = batch_size
+        self._heartbeat = heartbeat if dedup else None
+        self._concurrency = concurrency
+        # batches waiting to be written, at most buffer_points points are kept in memory,
+        # the next ones go to the spool until it's fully replayed, to keep the write order
+        self._queue = deque()  # type: deque
+        self._queued_points = 0
+        self._buffer_points = buffer_points
+        self._spool = InfluxDBSpool(spool_dir, spool_max_size) if spool_dir else None
+        self._dropped_points = 0
+        self._rejected_points = 0
+        self._last_drop_warning = 0.0
+        self._flush_points = flush_points
+        self._flush_bytes = flush_bytes
+        self._flush_interval = flush_interval
+        self._pending_points = 0
+        self._pending_bytes = 0
+        self._loop = None  # type: Optional[asyncio.AbstractEventLoop]
+        self._loop_thread = None  # type: Optional[int]
+        self._flush_timer = None  # type: Optional[asyncio.TimerHandle]
+        self._flush_running = False
+        self._flush_executor = ThreadPoolExecutor(max_workers=1)
         self._storage = {} #type: Dict[str, InfluxDBMeasurement]
+        # measurements replaced by a reload, their pending points are sent by the next flush
+        self._retired = []  # type: List[InfluxDBMeasurement]
         self._metric_to_mesurment = {}
         self._scheduler = scheduler
 
@@ -142,58 +424,186 @@ class InfluxDBDriver(OutputDriver, threading.Thread):
             'field': description
         }
         if metric_type not in self._storage:
-            self._storage[metric_type] = InfluxDBMeasurement(metric_type)
-        self._storage[metric_type].add_metric(description)
+            self._storage[metric_type] = InfluxDBMeasurement(metric_type, self._batch_size, self._heartbeat)
+            self._storage[metric_type].add_metric(description)
+        elif not self._storage[metric_type].has_field(description):
+            self._rebuild(metric_type)
+
+    def remove_metric(self, name: str) -> None:
+        mapping = self._metric_to_mesurment.pop(name, None)
+        if mapping is not None:
+            self._rebuild(mapping['measurement'])
+
+    def _rebuild(self, measurement: str) -> None:
+        '''
+            rows are sized for the fields of their measurement, when they change
+            the measurement starts again with fresh rows
+        '''
+        fields = []
+        for mapping in self._metric_to_mesurment.values():
+            if mapping['measurement'] == measurement and mapping['field'] not in fields:
+                fields.append(mapping['field'])
+        previous = self._storage.get(measurement)
+        if fields:
+            # replaced at once, the sink thread may be updating it
+            store = InfluxDBMeasurement(measurement, self._batch_size, self._heartbeat)
+            for field in fields:
+                store.add_metric(field)
+            self._storage[measurement] = store
+        else:
+            self._storage.pop(measurement, None)
+        if previous is not None:
+            self._retired.append(previous)
+
+    def add_module(self, module_name: str, metric_names: List[str]) -> None:
+        # no filtered exposition for influx
+        pass
 
     def clear(self, hostname: str, metric_name: str) -> None:
         # nothing to do, we clear entry recently
         pass
 
     def release_update_lock(self, hostname: str, metric_name: str) -> None:
-        # no lock here, do nothing
+        # rows are already buffered, check if enough points are pending for a flush
+        if self._loop is None:
+            return
+        if threading.get_ident() == self._loop_thread:
+            self._schedule_flush()
+        else:
+            self._loop.call_soon_threadsafe(self._schedule_flush)
+
+    def discard_update(self, hostname: str, metric_name: str) -> None:
+        # rows are pushed as soon as they are complete, nothing to roll back
         pass
 
+    def forget(self, hostname: str, metric_name: str) -> None:
+        # rows of the host are shared by the fields of the measurement, the
+        # ones still polled are created again on their next update
+        mapping = self._metric_to_mesurment.get(metric_name)
+        if mapping is None:
+            # removed by a reload, its rows went with the previous measurement
+            return
+        self._storage[mapping['measurement']].forget(hostname)
+
     def update_metric(self, hostname: str, metric_name: str, labels: str, value: str) -> None:
         # get the corresponding mesurement
-        measurement = self._metric_to_mesurment[metric_name]['measurement']
-        field_name = self._metric_to_mesurment[metric_name]['field']
-        self._storage[measurement].update(hostname, labels, field_name, value)
+        mapping = self._metric_to_mesurment.get(metric_name)
+        if mapping is None:
+            # poll queued before the metric was removed by a reload
+            return
+        size = self._storage[mapping['measurement']].update(hostname, labels, mapping['field'], value)
+        if size:
+            self._pending_points += 1
+            self._pending_bytes += size
 
     def start_serving(self) -> None:
-        logger.info('start influx loop')
-        self.start()
+        logger.info('start influx flush, every %ss or %s points or %s bytes',
+                    self._flush_interval, self._flush_points, self._flush_bytes)
+        self._loop = asyncio.get_event_loop()
+        self._loop_thread = threading.get_ident()
+        # points of the warmup are pending since the start
+        self._loop.call_soon(self._flush)
 
-    def run(self) -> None:
-        while True:
-            try:
-                start_time = datetime.now()
-                logger.info('start push to influx')
-                self._push_entry()
-                end_time = datetime.now()
-                logger.info('end push to influx')
-                delta = (end_time - start_time)
-                sleep_time = 10 - delta.total_seconds()
-                if sleep_time < 0:
-                    continue
-                logger.info('next loop on {}'.format(sleep_time))
-                time.sleep(sleep_time)
-            except Exception as e:
-                logger.error(e)
-
-    def _push_entry(self) -> None:
-        data = []
-        for measurement, store in self._storage.items():
-            data += store.push_to_influx()
-        for chunck in grouped(data, 1000):
-            for i in range(3):
-                try:
-                    self._influx.write_points(chunck)
-                except InfluxDBServerError:
-                    pass
-                except InfluxDBClientError:
-                    pass
-                else:
-                    break
-                time.sleep(5)
+    def _schedule_flush(self) -> None:
+        if self._loop is None or self._flush_running:
+            # not started yet, or the running flush will check again once done
+            return
+        if self._pending_points >= self._flush_points or self._pending_bytes >= self._flush_bytes:
+            self._flush()
+        elif self._flush_timer is None:
+            self._flush_timer = self._loop.call_later(self._flush_interval, self._flush)
+
+    def _flush(self) -> None:
+        if self._flush_timer is not None:
+            self._flush_timer.cancel()
+            self._flush_timer = None
+        if self._flush_running:
+            return
+        batches = []
+        retired, self._retired = self._retired, []
+        for store in retired + list(self._storage.values()):
+            batches += store.push_to_influx()
+        logger.debug('flush %s points to influx', self._pending_points)
+        self._pending_points = 0
+        self._pending_bytes = 0
+        self._flush_running = True
+        future = self._loop.run_in_executor(self._flush_executor, self._push_entry, batches)
+        future.add_done_callback(self._flush_done)
+
+    def _flush_done(self, future: asyncio.Future) -> None:
+        self._flush_running = False
+        try:
+            backlog = future.result()
+        except Exception:
+            logger.exception('error while pushing to influx')
+            backlog = False
+        if self._pending_points >= self._flush_points or self._pending_bytes >= self._flush_bytes:
+            self._flush()
+        elif self._flush_timer is None and (self._pending_points or backlog):
+            # retry of the backlog doesn't wait for new points
+            self._flush_timer = self._loop.call_later(self._flush_interval, self._flush)
+
+    def _push_entry(self, batches: List[Tuple[bytes, int]]) -> bool:
+        '''
+            return True if some points are still waiting to be written
+        '''
+        for payload, points in batches:
+            self._enqueue(payload, points)
+        self._enqueue(*self._stats_batch())
+        self._send_queued()
+        return bool(self._queue) or (self._spool is not None and self._spool.pending_points > 0)
+
+    def _stats_batch(self) -> Tuple[bytes, int]:
+        line = 'enhanced_snmp_exporter_influxdb queued_points={}i,spooled_points={}i,' \
+               'dropped_points_total={}i,rejected_points_total={}i {}\n'.format(
+                   self._queued_points, self._spool.pending_points if self._spool is not None else 0,
+                   self._dropped_points, self._rejected_points, int(time.time() * 1000))
+        return line.encode(), 1
+
+    def _enqueue(self, payload: bytes, points: int) -> None:
+        if self._spool is not None and self._spool.pending_points > 0:
+            if not self._spool.append(payload, points):
+                self._drop(points)
+        elif self._queued_points + points <= self._buffer_points:
+            self._queue.append((payload, points))
+            self._queued_points += points
+        elif self._spool is not None:
+            logger.info('influx write buffer full, spool points to disk')
+            if not self._spool.append(payload, points):
+                self._drop(points)
+        else:
+            self._drop(points)
 
+    def _drop(self, points: int) -> None:
+        self._dropped_points += points
+        now = time.monotonic()
+        if now - self._last_drop_warning > 60:
+            self._last_drop_warning = now
+            logger.warning('influx write buffer full, points are dropped (%s so far)', self._dropped_points)
+
+    def _write(self, batches: List[Tuple[bytes, int]]) -> bool:
+        '''
+            write the batches, return False if some of them should be sent again
+        '''
+        success = True
+        for (payload, points), result in zip(batches, self._writer.write_many(batches)):
+            if result == WRITE_REJECTED:
+                self._rejected_points += points
+            elif result == WRITE_FAILED:
+                success = False
+        return success
 
+    def _send_queued(self) -> None:
+        while self._queue:
+            batches = [self._queue.popleft() for i in range(min(self._concurrency, len(self._queue)))]
+            if not self._write(batches):
+                # influx is unavailable, keep everything for the next push, some
+                # batches may be written twice, which influx handles as an overwrite
+                self._queue.extendleft(reversed(batches))
+                return
+            self._queued_points -= sum(points for payload, points in batches)
+        while self._spool is not None and self._spool.pending_points > 0:
+            batches, position = self._spool.read(self._concurrency)
+            if not self._write(batches):
+                return
+            self._spool.commit(batches, position)
@@ -0,0 +1,132 @@
+# This file is part of prometheus-enhanced-snmp-exporte.
+#
+# prometheus-enhanced-snmp-exporte is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# prometheus-enhanced-snmp-exporte is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with prometheus-enhanced-snmp-exporte. If not, see <https://www.gnu.org/licenses/>.
+
+import glob
+import json
+import logging
+import os
+import yaml
+from typing import Dict, List, Tuple
+
+from .config import BadConfigurationException, HostConfiguration, InventoryConfiguration, ModulesConfiguration
+
+logger = logging.getLogger(__name__)
+
+# a group of targets sharing the same labels, as in prometheus file_sd
+TargetGroup = Tuple[List[str], Dict[str, str]]
+
+
+def parse_inventory_file(path: str) -> List[TargetGroup]:
+    with open(path) as inventory_file:
+        if path.endswith('.json'):
+            content = json.load(inventory_file)
+        else:
+            content = yaml.load(inventory_file, Loader=yaml.BaseLoader)
+    if content is None:
+        return []
+    if not isinstance(content, list):
+        raise ValueError('inventory should be a list of target groups')
+    groups = []
+    for group in content:
+        targets = [str(target) for target in group['targets']]
+        labels = {str(label_name): str(label_value) for label_name, label_value in group.get('labels', {}).items()}
+        groups.append((targets, labels))
+    return groups
+
+
+class Inventory(object):
+    '''
+        hosts listed in inventory files. Files are polled and only the ones
+        modified since the previous scan are parsed again
+    '''
+    def __init__(self, config: InventoryConfiguration) -> None:
+        self._config = config
+        # path -> ((mtime, size), target groups)
+        self._files = {}  # type: Dict[str, Tuple[Tuple[float, int], List[TargetGroup]]]
+        # version of unreadable files, so they are reported once
+        self._broken = {}  # type: Dict[str, Tuple[float, int]]
+
+    def configure(self, config: InventoryConfiguration) -> None:
+        self._config = config
+
+    def scan(self) -> bool:
+        '''
+            read new and modified files, return True if the inventory changed
+        '''
+        paths = set()
+        for pattern in self._config.files:
+            paths.update(glob.glob(pattern))
+        changed = False
+        for path in list(self._files):
+            if path not in paths:
+                logger.info('inventory file %s removed', path)
+                del self._files[path]
+                changed = True
+        for path in [path for path in self._broken if path not in paths]:
+            del self._broken[path]
+        for path in sorted(paths):
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            version = (stat.st_mtime, stat.st_size)
+            known = self._files.get(path)
+            if (known is not None and known[0] == version) or self._broken.get(path) == version:
+                continue
+            try:
+                groups = parse_inventory_file(path)
+            except (OSError, ValueError, KeyError, TypeError, AttributeError, yaml.YAMLError) as e:
+                # keep the previous content of a file being written or broken
+                logger.error("can't read inventory file %s: %s", path, e)
+                self._broken[path] = version
+                continue
+            self._broken.pop(path, None)
+            logger.info('inventory file %s loaded, %s target groups', path, len(groups))
+            self._files[path] = (version, groups)
+            changed = True
+        return changed
+
+    def hosts(self, modules: ModulesConfiguration, excluded: List[str]) -> List[HostConfiguration]:
+        '''
+            host configurations of the inventory targets, modules are given by the __modules
+            label and by the inventory rules. Targets in excluded are already configured
+        '''
+        hosts = []
+        seen = set(excluded)
+        for path in sorted(self._files):
+            for targets, labels in self._files[path][1]:
+                host_modules = [module for module in labels.get('__modules', '').split(',') if module]
+                host_modules += [module for module in self._config.modules_for(labels) if module not in host_modules]
+                host_config = {
+                    'community': labels.get('__community', 'public'),
+                    'version': labels.get('__version', '1'),
+                    'max_concurrency': labels.get('__max_concurrency', 10),
+                    'static_labels': {label_name: label_value for label_name, label_value in labels.items()
+                                      if not label_name.startswith('__')},
+                    'modules': host_modules,
+                }
+                for target in targets:
+                    if target in seen:
+                        logger.warning('%s is already configured, ignore it from %s', target, path)
+                        continue
+                    seen.add(target)
+                    try:
+                        host = HostConfiguration(dict(host_config, hostname=target))
+                    except BadConfigurationException:
+                        logger.error('bad inventory entry for %s in %s, ignore it', target, path)
+                        continue
+                    host._resolve_module(modules)
+                    hosts.append(host)
+        return hosts
@@ -0,0 +1,108 @@
+# This file is part of prometheus-enhanced-snmp-exporte.
+#
+# prometheus-enhanced-snmp-exporte is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# prometheus-enhanced-snmp-exporte is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with prometheus-enhanced-snmp-exporte. If not, see <https://www.gnu.org/licenses/>.
+
+import logging
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class MibResolver(object):
+    '''
+        resolve oids written with mib names. pysnmp is only imported here, the
+        network part of it is not needed to resolve oids
+    '''
+    def __init__(self, mib_builder=None) -> None:
+        from pysnmp.smi.builder import MibBuilder
+        from pysnmp.smi.view import MibViewController
+        if mib_builder is None:
+            mib_builder = MibBuilder()
+        self.mib_controller = MibViewController(mib_builder)
+        self._cache = {}
+
+    def object_identity(self, mib: str):
+        if mib in self._cache:
+            return self._cache[mib]
+        from pysnmp.smi.rfc1902 import ObjectIdentity
+        try:
+            logger.debug('mib to check : %s', mib)
+            if '::' in mib:
+                data = mib.split('::')
+                out = []
+                logger.debug('mib component : %s', data)
+                for component in data:
+                    out += component.split('.')
+                for i in range(0, len(out)):
+                    try:
+                        out[i] = int(out[i])
+                    except ValueError:
+                        pass
+
+                logger.debug('mib component : %s', out)
+                mib_obj = ObjectIdentity(*out)
+            else:
+                mib_obj = ObjectIdentity(mib)
+            mib_obj.addAsn1MibSource('file:///usr/share/snmp/mibs')
+            mib_obj.addAsn1MibSource('file://~/.snmp/mibs')
+            mib_obj.resolveWithMib(self.mib_controller)
+            self._cache[mib] = mib_obj
+            return mib_obj
+        except Exception as e:
+            logger.error("can't resolv oid into object: %s", mib)
+            logger.exception('detail')
+            raise e
+
+    def resolve(self, mib: str) -> str:
+        return str(self.object_identity(mib).getOid())
+
+
+# resolver of a worker process of resolve_many
+_worker_resolver = None  # type: Optional[MibResolver]
+
+
+def _resolve_chunk(oids: List[str]) -> List[Tuple[str, Optional[str]]]:
+    global _worker_resolver
+    if _worker_resolver is None:
+        _worker_resolver = MibResolver()
+    resolved = []
+    for oid in oids:
+        try:
+            resolved.append((oid, _worker_resolver.resolve(oid)))
+        except Exception:
+            resolved.append((oid, None))
+    return resolved
+
+
+def resolve_many(oids: List[str], workers: int) -> Dict[str, Optional[str]]:
+    '''
+        resolve oids in worker processes, oids of the same mib go to the same worker
+        so each mib is loaded once. Unresolved oids are mapped to None
+    '''
+    by_mib = {}  # type: Dict[str, List[str]]
+    for oid in oids:
+        by_mib.setdefault(oid.split('::')[0] if '::' in oid else '', []).append(oid)
+    chunks = [[] for _ in range(max(1, min(workers, len(by_mib))))]  # type: List[List[str]]
+    # biggest mibs first, each one to the least loaded worker
+    for mib_oids in sorted(by_mib.values(), key=len, reverse=True):
+        min(chunks, key=len).extend(mib_oids)
+    resolved = {}  # type: Dict[str, Optional[str]]
+    if len(chunks) == 1:
+        resolved.update(_resolve_chunk(chunks[0]))
+        return resolved
+    with ProcessPoolExecutor(len(chunks)) as executor:
+        for chunk_result in executor.map(_resolve_chunk, chunks):
+            resolved.update(chunk_result)
+    return resolved
@@ -0,0 +1,240 @@
+# This file is part of prometheus-enhanced-snmp-exporte.
+#
+# prometheus-enhanced-snmp-exporte is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# prometheus-enhanced-snmp-exporte is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with prometheus-enhanced-snmp-exporte. If not, see <https://www.gnu.org/licenses/>.
+
+import hashlib
+import logging
+import os
+import pickle
+import sys
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from .config import HostConfiguration, ModuleConfiguration, OIDConfiguration, ParserConfiguration
+
+logger = logging.getLogger(__name__)
+
+# bumped when the plan classes change, so an old cache is not loaded
+PLAN_FORMAT = 4
+
+# maximum varbinds in a single GET request
+MAX_GET_VARBINDS = 16
+
+
+class PollTask(object):
+    '''
+        a query of a compiled module, with its oid resolved to numeric form.
+        It has the attributes of OIDConfiguration used by the querier
+    '''
+    __slots__ = ('name', 'oid', 'type', 'store_method', 'oid_suffix', 'filter_expr', 'template_name',
+                 'community_template', 'every', 'label_group', 'max_series')
+
+    def __init__(self, oid_config: OIDConfiguration, oid: str) -> None:
+        self.name = oid_config.name
+        self.oid = oid
+        self.type = oid_config.type
+        self.store_method = oid_config.store_method
+        self.oid_suffix = oid_config.oid_suffix
+        self.filter_expr = oid_config.filter_expr
+        self.template_name = oid_config.template_name
+        self.community_template = oid_config.community_template
+        self.every = oid_config.every
+        self.label_group = getattr(oid_config, 'label_group', None)
+        self.max_series = oid_config.max_series
+
+    def key(self) -> Tuple:
+        filter_pattern = self.filter_expr.pattern if self.filter_expr is not None else None
+        label_group = tuple(self.label_group) if isinstance(self.label_group, list) else self.label_group
+        return (self.name, self.oid, self.type, self.store_method, self.oid_suffix, filter_pattern,
+                self.template_name, self.community_template, self.every, label_group, self.max_series)
+
+    def __repr__(self) -> str:
+        return '{}->{} [{}s]'.format(self.name, self.oid, self.every)
+
+
+class ModulePlan(object):
+    '''
+        queries of a module, shared by every host using it
+    '''
+    __slots__ = ('name', 'templates', 'labels', 'joins', 'metrics', 'metric_batches', 'signature')
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self.templates = []  # type: List[Tuple[str, PollTask]]
+        self.labels = []  # type: List[Tuple[str, str, PollTask]]
+        # label group, left label group, right label group, left join key, right join key
+        self.joins = []  # type: List[Tuple[str, str, str, str, str]]
+        # metrics polled alone, and get metrics sharing their interval and community polled in one request
+        self.metrics = []  # type: List[PollTask]
+        self.metric_batches = []  # type: List[List[PollTask]]
+        # everything polled by the module, to detect changes on reload
+        self.signature = None  # type: Optional[Tuple]
+
+    def metric_names(self) -> List[str]:
+        return [task.name for task in self.metrics] + [task.name for batch in self.metric_batches for task in batch]
+
+    def compute_signature(self) -> None:
+        self.signature = (
+            tuple((group, task.key()) for group, task in self.templates),
+            tuple((group, label_name, task.key()) for group, label_name, task in self.labels),
+            tuple(self.joins),
+            tuple(task.key() for task in self.metrics),
+            tuple(tuple(task.key() for task in batch) for batch in self.metric_batches),
+        )
+
+
+class HostPlan(object):
+    __slots__ = ('hostname', 'community', 'version', 'max_concurrency', 'static_labels', 'modules')
+
+    def __init__(self, hostname: str, community: str, version: str, max_concurrency: int,
+                 static_labels: Dict[str, str], modules: List[ModulePlan]) -> None:
+        self.hostname = hostname
+        self.community = community
+        self.version = version
+        self.max_concurrency = max_concurrency
+        self.static_labels = static_labels
+        self.modules = modules
+
+    def signature(self) -> Tuple:
+        # host parameters used by every query, a change restarts all the modules of the host
+        return (self.community, self.version, self.max_concurrency, tuple(sorted(self.static_labels.items())))
+
+    def batch_get(self) -> bool:
+        # with snmp v1, a missing oid fails the whole request
+        return self.version not in ('1', 'v1')
+
+    def __repr__(self) -> str:
+        return 'host:' + self.hostname
+
+
+def _compile_module(module_name: str, module: ModuleConfiguration, resolve_oid: Callable[[str], str]) -> ModulePlan:
+    plan = ModulePlan(module_name)
+    for template_group_name, template_group in module.template_label.items():
+        plan.templates.append((template_group_name, PollTask(template_group, resolve_oid(template_group.oid))))
+    for label_group_name, label_group in module.labels_group.items():
+        label_names = list(label_group.keys())
+        if label_group[label_names[0]].type == 'join':
+            # join mappings hold label names, not oids
+            plan.joins.append((label_group_name, label_names[0], label_names[1],
+                               label_group[label_names[0]].oid, label_group[label_names[1]].oid))
+            continue
+        for label_name, label in label_group.items():
+            if label.type == 'join':
+                continue
+            plan.labels.append((label_group_name, label_name, PollTask(label, resolve_oid(label.oid))))
+    batches = {}  # type: Dict[Tuple, List[PollTask]]
+    for metric in module.metrics:
+        task = PollTask(metric, resolve_oid(metric.oid))
+        if task.type != 'get':
+            plan.metrics.append(task)
+            continue
+        key = (task.every, task.template_name, task.community_template)
+        batches.setdefault(key, []).append(task)
+    for tasks in batches.values():
+        for offset in range(0, len(tasks), MAX_GET_VARBINDS):
+            batch = tasks[offset:offset + MAX_GET_VARBINDS]
+            if len(batch) == 1:
+                plan.metrics.append(batch[0])
+            else:
+                plan.metric_batches.append(batch)
+    plan.compute_signature()
+    return plan
+
+
+def compile_modules(config: ParserConfiguration, resolve_oid: Callable[[str], str]) -> Dict[str, ModulePlan]:
+    '''
+        compile every module of the configuration, hosts added later
+        by the inventory could use any of them
+    '''
+    return {module_name: _compile_module(module_name, module, resolve_oid)
+            for module_name, module in config.modules.items()}
+
+
+def compile_hosts(hosts: Iterable[HostConfiguration], modules: Dict[str, ModulePlan]) -> List[HostPlan]:
+    plans = []
+    for host_config in hosts:
+        host_modules = [modules[module_name] for module_name, _ in host_config.items()]
+        plans.append(HostPlan(host_config.hostname, host_config.community, host_config.version,
+                              host_config.max_concurrency, host_config.static_labels, host_modules))
+    return plans
+
+
+def compile_plans(config: ParserConfiguration,
+                  resolve_oid: Callable[[str], str]) -> Tuple[Dict[str, ModulePlan], List[HostPlan]]:
+    '''
+        flatten the parsed configuration into per host poll plans, each module is
+        compiled once, with its oids resolved
+    '''
+    modules = compile_modules(config, resolve_oid)
+    return modules, compile_hosts(config.hosts, modules)
+
+
+# a module polled on a host
+PollUnit = Tuple[HostPlan, ModulePlan]
+
+
+def diff_plans(old_plans: List[HostPlan], new_plans: List[HostPlan]) -> Tuple[List[PollUnit], List[PollUnit]]:
+    '''
+        units to stop and units to start to go from old plans to new ones,
+        a changed module is stopped then started again
+    '''
+    def units(plans: List[HostPlan]) -> Dict[Tuple[str, str], PollUnit]:
+        return {(host_plan.hostname, module_plan.name): (host_plan, module_plan)
+                for host_plan in plans for module_plan in host_plan.modules}
+
+    def unit_signature(unit: PollUnit) -> Tuple:
+        return unit[0].signature(), unit[1].signature
+
+    old_units = units(old_plans)
+    new_units = units(new_plans)
+    removed = [unit for key, unit in old_units.items()
+               if key not in new_units or unit_signature(new_units[key]) != unit_signature(unit)]
+    added = [unit for key, unit in new_units.items()
+             if key not in old_units or unit_signature(old_units[key]) != unit_signature(unit)]
+    return removed, added
+
+
+def plan_cache_key(filename: str) -> str:
+    digest = hashlib.sha256()
+    digest.update('{} {}'.format(PLAN_FORMAT, sys.version).encode())
+    with open(filename, 'rb') as config_file:
+        digest.update(config_file.read())
+    return digest.hexdigest()
+
+
+def load_plan_cache(cache_file: str,
+                    key: str) -> Optional[Tuple[ParserConfiguration, Dict[str, ModulePlan], List[HostPlan]]]:
+    try:
+        with open(cache_file, 'rb') as cache:
+            content = pickle.load(cache)
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        logger.warning('ignore unreadable plan cache %s: %s', cache_file, e)
+        return None
+    if content.get('key') != key:
+        logger.info('configuration changed since the plan cache was written')
+        return None
+    return content['config'], content['modules'], content['plans']
+
+
+def save_plan_cache(cache_file: str, key: str, config: ParserConfiguration, modules: Dict[str, ModulePlan],
+                    plans: List[HostPlan]) -> None:
+    # written aside then renamed, a concurrent start never reads a partial cache
+    tmp_file = '{}.{}'.format(cache_file, os.getpid())
+    try:
+        with open(tmp_file, 'wb') as cache:
+            pickle.dump({'key': key, 'config': config, 'modules': modules, 'plans': plans}, cache, pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_file, cache_file)
+    except OSError as e:
+        logger.warning("can't write plan cache %s: %s", cache_file, e)
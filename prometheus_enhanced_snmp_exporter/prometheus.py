@@ -15,68 +15,146 @@
 
 import time
 import ipaddress
-from .driver import OutputDriver, label_to_str
+from functools import partial
+from operator import itemgetter
+from .accounting import SeriesAccounting
+from .driver import LabelSetIndex, OutputDriver, label_to_str
 from .storage import LabelStorage, TemplateStorage
-from wsgiref.simple_server import make_server, WSGIServer
-from pyramid.config import Configurator
-from pyramid.response import Response
-from threading import Lock
-import socket
+from .server import ExporterHTTPServer, ExporterRequestHandler, HTTPResponse
+from .encoding import CompressionStats, STREAMS, negotiate_encoding
+from .exposition import Series, TextFormat, framed_family, negotiate_format
 import threading
 import logging
-from typing import Dict, List
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
 
 logger = logging.getLogger(__name__)
 
 
+class ExpositionBlock(object):
+    '''
+        part of the exposition, rendered once per exposition format and compressed
+        once per format and encoding. The text format is rendered right away,
+        the others on the first scrape requesting them
+    '''
+    __slots__ = ('_render', '_rendered', '_encoded')
+
+    def __init__(self, render: Callable[[type], bytes]) -> None:
+        self._render = render
+        self._rendered = {}  # type: Dict[str, bytes]
+        self._encoded = {}  # type: Dict[Tuple[str, str], bytes]
+        self.render(TextFormat)
+
+    def render(self, exposition_format) -> bytes:
+        data = self._rendered.get(exposition_format.name)
+        if data is None:
+            data = self._render(exposition_format)
+            self._rendered[exposition_format.name] = data
+        return data
+
+    def size(self) -> int:
+        # bytes of the rendered and compressed forms kept
+        return sum(len(data) for data in list(self._rendered.values())) + \
+            sum(len(data) for data in list(self._encoded.values()))
+
+    def encode(self, exposition_format, stream, stats: CompressionStats) -> bytes:
+        data = self.render(exposition_format)
+        if stream is None or not data:
+            return data
+        key = (exposition_format.name, stream.name)
+        compressed = self._encoded.get(key)
+        if compressed is None:
+            compressed = stats.compress(stream.name, data)
+            self._encoded[key] = compressed
+        return stream.add(data, compressed)
+
+
+METRIC_SEPARATOR = ExpositionBlock(lambda exposition_format: exposition_format.separator)
+EXPOSITION_FOOTER = ExpositionBlock(lambda exposition_format: exposition_format.footer)
+
+
 class PrometheusMetric():
-    def __init__(self, name: str, metric_type: str, description: str) -> None:
+    def __init__(self, name: str, metric_type: str, description: str, timestamps: bool = True) -> None:
         self._name = name
         self._type = metric_type
         self._description = description
-        self._labels = {}  # type: Dict[str, Dict[str, Dict[str, Dict]]]
-        self._locks = {}  # type: Dict[str, Lock]
-        self._hostname_check_lock = Lock()
+        self._timestamps = timestamps
+        # series of the running poll, built aside from the exposed blocks
+        self._pending = {}  # type: Dict[str, Dict[int, Tuple]]
+        # label sets of each host, series are keyed by label set fingerprint
+        self._label_sets = {}  # type: Dict[str, LabelSetIndex]
+        # exposition is rendered once per poll, scrapes only join theses blocks
+        self._header = ExpositionBlock(
+            lambda exposition_format: exposition_format.header(self._name, self._type, self._description))
+        self._blocks = {}  # type: Dict[str, ExpositionBlock]
 
     def clear(self, hostname: str) -> None:
-        with self._hostname_check_lock:
-            if hostname not in self._locks:
-                self._locks[hostname] = Lock()
-        self._locks[hostname].acquire()
-        if hostname in self._labels:
-            del self._labels[hostname]
+        # start a new series set, the exposed one stay untouched until the publication
+        self._pending[hostname] = {}
+        if hostname not in self._label_sets:
+            self._label_sets[hostname] = LabelSetIndex()
 
     def update_metric(self, hostname: str, labels: Dict[str, str], values: float) -> None:
-        label_str = label_to_str(labels)
-        if hostname not in self._labels:
-            self._labels[hostname] = {}
-        if label_str not in self._labels[hostname]:
-            self._labels[hostname][label_str] = {}
-        self._labels[hostname][label_str]['metric'] = values
-        self._labels[hostname][label_str]['timestamp'] = int(
-            time.time() * 1000)
+        fingerprint = self._label_sets[hostname].fingerprint(labels)
+        timestamp = None
+        if self._timestamps:
+            timestamp = int(time.time() * 1000)
+        self._pending[hostname][fingerprint] = (values, timestamp)
 
     def release_update_lock(self, hostname: str) -> None:
-        self._locks[hostname].release()
-
-    def metric_print(self) -> str:
-        # first print header information
-        out = "#TYPE {} {}\n#HELP {} {}\n".format(
-            self._name, self._type, self._name, self._description)
-
-        # next print metric lines
-        # to deal with thread safety we will avoid generator
-        for hostname in list(self._labels.keys()):
-            with self._locks[hostname]:
-                for label_str in list(sorted(self._labels[hostname].keys())):
-                    label_data = self._labels[hostname][label_str]
-                    out += "{}{{{}}} {} {}\n".format(
-                        self._name, label_str, label_data['metric'], label_data['timestamp'])
+        # publish the new series set, replacing the block reference is atomic
+        # so scrapes see either the previous set or this one
+        pending = self._pending.pop(hostname, {})
+        label_sets = self._label_sets[hostname]
+        label_sets.retain(pending)
+        if pending:
+            # labels are rendered only for series unseen on previous polls
+            series = sorted(((label_sets.label_str(fingerprint), label_sets.labels(fingerprint), value, timestamp)
+                             for fingerprint, (value, timestamp) in pending.items()), key=itemgetter(0))
+            self._blocks[hostname] = ExpositionBlock(partial(self._render_series, series))
+        else:
+            self._blocks.pop(hostname, None)
+
+    def discard_update(self, hostname: str) -> None:
+        # poll failed, keep exposing the last complete set
+        self._pending.pop(hostname, None)
+
+    def forget(self, hostname: str) -> None:
+        self._pending.pop(hostname, None)
+        self._label_sets.pop(hostname, None)
+        self._blocks.pop(hostname, None)
+
+    def _render_series(self, series: List[Series], exposition_format) -> bytes:
+        return exposition_format.series(self._name, self._type, self._description, series)
+
+    def has_host(self, hostname: str) -> bool:
+        return hostname in self._blocks
+
+    def usage(self) -> List[Tuple[str, int]]:
+        '''
+            approximate memory of the series of each host : exposition blocks and rendered labels
+        '''
+        out = []
+        for hostname, block in list(self._blocks.items()):
+            label_sets = self._label_sets.get(hostname)
+            out.append((hostname, block.size() + (label_sets.label_bytes if label_sets is not None else 0)))
         return out
 
+    def metric_blocks(self, hostnames: Optional[List[str]] = None) -> List[ExpositionBlock]:
+        # header first, next one pre-rendered block per host
+        # blocks are replaced as a whole, no lock needed to read them
+        if hostnames is None:
+            return [self._header] + list(self._blocks.values())
+        blocks = [self._header]
+        for hostname in hostnames:
+            block = self._blocks.get(hostname)
+            if block is not None:
+                blocks.append(block)
+        return blocks
 
-class WSGIServer_IPv6(WSGIServer):
-    address_family = socket.AF_INET6
+    def metric_print(self, exposition_format=TextFormat) -> bytes:
+        blocks = self.metric_blocks()
+        return framed_family(exposition_format, blocks[0].render(exposition_format),
+                             b''.join(block.render(exposition_format) for block in blocks[1:]))
 
 
 # Here we do our own class, we can't really rely on
@@ -84,49 +162,230 @@ class WSGIServer_IPv6(WSGIServer):
 # on source code and not external metrics like this exporter
 # provides
 class PrometheusMetricStorage(threading.Thread, OutputDriver):
-    def __init__(self, hostname: str, uri: str, storage: LabelStorage, template_storage: TemplateStorage) -> None:
+    def __init__(self, hostname: str, uri: str, storage: LabelStorage, template_storage: TemplateStorage,
+                 timestamps: bool = True, accounting: Optional[SeriesAccounting] = None,
+                 usage_metrics: bool = False) -> None:
         threading.Thread.__init__(self)
         self._metrics = {}  # type:  Dict[str, PrometheusMetric]
+        # index of exposed metrics per host, and of metric names per module, for filtered scrapes
+        self._host_index = {}  # type: Dict[str, Dict[str, PrometheusMetric]]
+        self._module_index = {}  # type: Dict[str, List[str]]
         self._hostname = hostname
         self._storage = storage
         self._template_storage = template_storage
         self._uri = uri
+        self._timestamps = timestamps
+        self._accounting = accounting
+        self._usage_metrics = usage_metrics
+        self._compression_stats = CompressionStats()
+        self._routes = {}  # type: Dict[str, Callable[[ExporterRequestHandler], HTTPResponse]]
 
     def add_metric(self, name: str, metric_type: str, description: str) -> None:
-        self._metrics[name] = PrometheusMetric(name, metric_type, description)
+        self._metrics[name] = PrometheusMetric(name, metric_type, description, self._timestamps)
+
+    def add_module(self, module_name: str, metric_names: List[str]) -> None:
+        self._module_index[module_name] = list(metric_names)
 
     def clear(self, hostname: str, metric_name: str) -> None:
         self._metrics[metric_name].clear(hostname)
 
     def release_update_lock(self, hostname: str, metric_name: str) -> None:
-        self._metrics[metric_name].release_update_lock(hostname)
+        metric = self._metrics[metric_name]
+        metric.release_update_lock(hostname)
+        if metric.has_host(hostname):
+            self._host_index.setdefault(hostname, {})[metric_name] = metric
+        else:
+            self._host_index.get(hostname, {}).pop(metric_name, None)
+
+    def discard_update(self, hostname: str, metric_name: str) -> None:
+        self._metrics[metric_name].discard_update(hostname)
 
     def update_metric(self, hostname: str, metric_name: str, labels: Dict[str, str], value: str) -> None:
-        logger.info('update metric %s = %s, with labels %s',
-                    metric_name, value, labels)
+        logger.debug('update metric %s = %s, with labels %s',
+                     metric_name, value, labels)
         self._metrics[metric_name].update_metric(hostname, labels, value)
 
-    def metric_print(self) -> str:
-        out = ""
-        for metric_name, metric_value in self._metrics.items():
-            out += metric_value.metric_print()
-            out += "\n"
+    def forget(self, hostname: str, metric_name: str) -> None:
+        self._metrics[metric_name].forget(hostname)
+        host_metrics = self._host_index.get(hostname, {})
+        host_metrics.pop(metric_name, None)
+        if not host_metrics:
+            self._host_index.pop(hostname, None)
+
+    def add_route(self, path: str, handler) -> None:
+        self._routes[path] = handler
+
+    def _selected_metrics(self, targets: Optional[List[str]], metric_names: Optional[List[str]]) \
+            -> List[PrometheusMetric]:
+        if targets is None:
+            if metric_names is None:
+                return list(self._metrics.values())
+            candidates = set(metric_names)
+        else:
+            # only look at metrics exposed for the requested targets
+            candidates = set()
+            for target in targets:
+                candidates.update(list(self._host_index.get(target, {}).keys()))
+            if metric_names is not None:
+                candidates.intersection_update(metric_names)
+        # keep the usual metric order
+        return [metric for name, metric in list(self._metrics.items()) if name in candidates]
+
+    def metric_chunks(self, exposition_format=TextFormat, encoding: Optional[str] = None,
+                      targets: Optional[List[str]] = None, metric_names: Optional[List[str]] = None,
+                      with_self_metrics: bool = True) -> Iterator[bytes]:
+        stats = self._compression_stats
+        stream = None
+        if encoding is not None:
+            stream = STREAMS[encoding]()
+            yield stream.start()
+        for metric_value in self._selected_metrics(targets, metric_names):
+            blocks = metric_value.metric_blocks(targets)
+            if exposition_format.framed:
+                # one message per metric, its size depends on the selected host blocks
+                series_size = sum(len(block.render(exposition_format)) for block in blocks[1:])
+                if not series_size:
+                    continue
+                frame = exposition_format.frame(len(blocks[0].render(exposition_format)) + series_size)
+                yield ExpositionBlock(lambda _, frame=frame: frame).encode(exposition_format, stream, stats)
+            for block in blocks:
+                yield block.encode(exposition_format, stream, stats)
+            yield METRIC_SEPARATOR.encode(exposition_format, stream, stats)
+        if with_self_metrics:
+            # self metrics change on every scrape, they are not cached
+            yield ExpositionBlock(self._render_self_metrics).encode(exposition_format, stream, stats)
+        yield EXPOSITION_FOOTER.encode(exposition_format, stream, stats)
+        if stream is not None:
+            yield stream.finish()
+
+    def metric_print(self, exposition_format=TextFormat) -> bytes:
+        return b''.join(self.metric_chunks(exposition_format))
+
+    def self_metrics(self) -> List[Tuple[str, str, str, List[Series]]]:
+        stats = self._compression_stats
+        out = []
+        for name, metric_type, description, values in [
+            ('enhanced_snmp_exporter_compression_seconds_total', 'counter',
+             'time spent compressing exposition blocks', stats.seconds),
+            ('enhanced_snmp_exporter_compression_input_bytes_total', 'counter',
+             'uncompressed size of compressed exposition blocks', stats.input_bytes),
+            ('enhanced_snmp_exporter_compression_output_bytes_total', 'counter',
+             'compressed size of compressed exposition blocks', stats.output_bytes),
+        ]:
+            out.append((name, metric_type, description, [
+                ('encoding="{}"'.format(encoding), (('encoding', encoding),), value, None)
+                for encoding, value in sorted(values.items())
+            ]))
+        out.append(('enhanced_snmp_exporter_compression_ratio', 'gauge', 'uncompressed to compressed size ratio', [
+            ('encoding="{}"'.format(encoding), (('encoding', encoding),), stats.input_bytes[encoding] / value, None)
+            for encoding, value in sorted(stats.output_bytes.items()) if value > 0
+        ]))
+        if self._accounting is not None:
+            out += self._limit_metrics()
+        if self._usage_metrics:
+            out += self._usage_self_metrics()
+        return out
+
+    @staticmethod
+    def _series(labels: Tuple[Tuple[str, str], ...], value) -> Series:
+        labels = tuple(sorted(labels))
+        return (label_to_str(dict(labels)), labels, value, None)
+
+    def _limit_metrics(self) -> List[Tuple[str, str, str, List[Series]]]:
+        # only tables truncated at least once, not to double the series of every host
+        truncated = []
+        dropped = []
+        for (hostname, module_name, table), _, is_truncated, dropped_series, _ in self._accounting.tables():
+            if dropped_series:
+                labels = (('host', hostname), ('module', module_name), ('table', table))
+                truncated.append(self._series(labels, int(is_truncated)))
+                dropped.append(self._series(labels, dropped_series))
+        return [
+            ('enhanced_snmp_exporter_series_truncated', 'gauge',
+             'whether the last poll of the table reached its max_series limit', truncated),
+            ('enhanced_snmp_exporter_series_dropped_total', 'counter',
+             'series, or label rows, dropped by the max_series limit of the table', dropped),
+        ]
+
+    def _usage_self_metrics(self) -> List[Tuple[str, str, str, List[Series]]]:
+        accounting = self._accounting
+        series = []
+        if accounting is not None:
+            series = [self._series((('host', hostname), ('module', module_name), ('metric', table)), count)
+                      for (hostname, module_name, table), count, _, _, metric in accounting.tables() if metric]
+        series_bytes = []
+        for metric_name, metric in list(self._metrics.items()):
+            for hostname, size in metric.usage():
+                module_name = accounting.module_of(hostname, metric_name) if accounting is not None else None
+                series_bytes.append(self._series((('host', hostname), ('module', module_name or ''),
+                                                  ('metric', metric_name)), size))
+        storage_values = []
+        storage_bytes = []
+        for storage_name, storage in (('label', self._storage), ('template', self._template_storage)):
+            for (hostname, module_name, label_group), values, size in storage.usage():
+                labels = (('host', hostname), ('label_group', label_group), ('module', module_name),
+                          ('storage', storage_name))
+                storage_values.append(self._series(labels, values))
+                storage_bytes.append(self._series(labels, size))
+        return [
+            ('enhanced_snmp_exporter_series', 'gauge', 'series kept by the last poll of the metric', series),
+            ('enhanced_snmp_exporter_series_bytes', 'gauge',
+             'approximate memory of the exposed series of the metric', series_bytes),
+            ('enhanced_snmp_exporter_label_storage_values', 'gauge', 'label values kept for the label group',
+             storage_values),
+            ('enhanced_snmp_exporter_label_storage_bytes', 'gauge',
+             'approximate memory of the label values kept for the label group', storage_bytes),
+        ]
+
+    def _render_self_metrics(self, exposition_format) -> bytes:
+        out = []
+        for name, metric_type, description, series in self.self_metrics():
+            out.append(framed_family(exposition_format, exposition_format.header(name, metric_type, description),
+                                     exposition_format.series(name, metric_type, description, series)))
+        return b''.join(out)
+
+    @staticmethod
+    def _query_list(request: ExporterRequestHandler, name: str) -> Optional[List[str]]:
+        if name not in request.query:
+            return None
+        out = []
+        for value in request.query[name]:
+            out += [item for item in value.split(',') if item]
         return out
 
-    def _print_metrics_http(self, context, request) -> Response:
-        res = Response()
-        res.content_type = 'text/plain; version=0.0.4'
-        res.text = self.metric_print()
-        return res
-
-    def _dump_cache(self, context, request) -> Response:
-        res = Response()
-        res.content_type = 'text/plain'
-        res.text = "# template_storage"
-        res.text += self._template_storage.dump()
-        res.text += "# storage"
-        res.text += self._storage.dump()
-        return res
+    def _print_metrics_http(self, request: ExporterRequestHandler) -> HTTPResponse:
+        exposition_format = negotiate_format(request.headers.get('Accept'))
+        encoding = negotiate_encoding(request.headers.get('Accept-Encoding'))
+        headers = {'Vary': 'Accept, Accept-Encoding'}
+        if encoding is not None:
+            headers['Content-Encoding'] = encoding
+
+        # optional selectors, ?target=<host>&module=<module>&metric=<metric>
+        targets = self._query_list(request, 'target')
+        modules = self._query_list(request, 'module')
+        metric_names = self._query_list(request, 'metric')
+        if modules is not None:
+            # repeated values of a selector add up, different selectors narrow each other
+            module_metrics = [name for module in modules for name in self._module_index.get(module, [])]
+            if metric_names is None:
+                metric_names = module_metrics
+            else:
+                metric_names = [name for name in metric_names if name in module_metrics]
+        with_self_metrics = targets is None and metric_names is None
+        self_metrics = self._query_list(request, 'self_metrics')
+        if self_metrics is not None:
+            with_self_metrics = self_metrics[-1:] in (['true'], ['1'])
+
+        # streamed, the first bytes are sent before the last metric is read
+        return HTTPResponse(self.metric_chunks(exposition_format, encoding, targets, metric_names, with_self_metrics),
+                            exposition_format.content_type, headers=headers)
+
+    def _dump_cache(self, request: ExporterRequestHandler) -> HTTPResponse:
+        out = "# template_storage"
+        out += self._template_storage.dump()
+        out += "# storage"
+        out += self._storage.dump()
+        return HTTPResponse(out.encode(), 'text/plain')
 
     def run(self) -> None:
         self._server.serve_forever()
@@ -139,12 +398,9 @@ class PrometheusMetricStorage(threading.Thread, OutputDriver):
             return False
 
     def start_serving(self) -> None:
-        with Configurator() as config:
-            config.add_route('metric', self._uri)
-            config.add_route('dump_cache', '/dump')
-            config.add_view(self._print_metrics_http, route_name='metric')
-            config.add_view(self._dump_cache, route_name='dump_cache')
-            app = config.make_wsgi_app()
+        routes = dict(self._routes)
+        routes[self._uri] = self._print_metrics_http
+        routes['/dump'] = self._dump_cache
         hostname_component = self._hostname.split(':')
         hostname = hostname_component[0]
         port = int(hostname_component[1])
@@ -154,5 +410,5 @@ class PrometheusMetricStorage(threading.Thread, OutputDriver):
             hostname = '::FFFF:' + hostname
 
         logger.info('bind to %s %s', hostname, port)
-        self._server = make_server(hostname, port, app, WSGIServer_IPv6)
+        self._server = ExporterHTTPServer((hostname, port), routes)
         self.start()
@@ -0,0 +1,55 @@
+# This file is part of prometheus-enhanced-snmp-exporte.
+#
+# prometheus-enhanced-snmp-exporte is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# prometheus-enhanced-snmp-exporte is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with prometheus-enhanced-snmp-exporte. If not, see <https://www.gnu.org/licenses/>.
+
+# minimal protobuf wire format encoder, enough for the few prometheus
+# messages we produce without requiring the protobuf runtime
+
+import struct
+
+WIRE_VARINT = 0
+WIRE_FIXED64 = 1
+WIRE_LENGTH_DELIMITED = 2
+
+
+def encode_varint(value: int) -> bytes:
+    if value < 0:
+        # negative int64 are encoded on 10 bytes, as two's complement
+        value += 1 << 64
+    out = bytearray()
+    while value > 0x7f:
+        out.append((value & 0x7f) | 0x80)
+        value >>= 7
+    out.append(value)
+    return bytes(out)
+
+
+def field_varint(field: int, value: int) -> bytes:
+    return encode_varint(field << 3 | WIRE_VARINT) + encode_varint(value)
+
+
+def field_double(field: int, value: float) -> bytes:
+    return encode_varint(field << 3 | WIRE_FIXED64) + struct.pack('<d', value)
+
+
+def field_bytes(field: int, value: bytes) -> bytes:
+    return encode_varint(field << 3 | WIRE_LENGTH_DELIMITED) + encode_varint(len(value)) + value
+
+
+def field_string(field: int, value: str) -> bytes:
+    return field_bytes(field, value.encode())
+
+
+def delimited(message: bytes) -> bytes:
+    return encode_varint(len(message)) + message
@@ -0,0 +1,175 @@
+# This file is part of prometheus-enhanced-snmp-exporte.
+#
+# prometheus-enhanced-snmp-exporte is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# prometheus-enhanced-snmp-exporte is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with prometheus-enhanced-snmp-exporte. If not, see <https://www.gnu.org/licenses/>.
+
+import asyncio
+import concurrent.futures
+import logging
+import signal
+from typing import Dict, List, Optional
+
+from .config import BadConfigurationException, ParserConfiguration, parse_config
+from .driver import OutputDriver
+from .inventory import Inventory
+from .plan import HostPlan, ModulePlan, compile_hosts, compile_plans, diff_plans, plan_cache_key, save_plan_cache
+from .scheduler import JobScheduler
+from .server import ExporterRequestHandler, HTTPResponse
+from .snmp import SNMPQuerier
+
+logger = logging.getLogger(__name__)
+
+
+class ConfigReloader(object):
+    '''
+        apply a new configuration without restarting : only modules of hosts whose
+        plan changed are stopped and started, labels and series of the others are kept.
+        Inventory files are watched the same way, without parsing the configuration again
+    '''
+    def __init__(self, filename: str, config: ParserConfiguration, modules: Dict[str, ModulePlan],
+                 static_plans: List[HostPlan], querier: SNMPQuerier, metrics: OutputDriver,
+                 scheduler: JobScheduler, max_threads: int, plan_cache: Optional[str] = None,
+                 inventory: Optional[Inventory] = None) -> None:
+        self._filename = filename
+        self._config = config
+        self._modules = modules
+        # plans of the hosts of the configuration file, inventory hosts are added to them
+        self._static_plans = static_plans
+        self._querier = querier
+        self._metrics = metrics
+        self._scheduler = scheduler
+        self._max_threads = max_threads
+        self._plan_cache = plan_cache
+        self._inventory = inventory
+        self._loop = asyncio.get_event_loop()
+        # one change at a time, including the warmup of started modules
+        self._lock = asyncio.Lock()
+        self._watch_task = None  # type: Optional[asyncio.Task]
+
+    def install(self) -> None:
+        try:
+            self._loop.add_signal_handler(signal.SIGHUP, self.trigger)
+        except (NotImplementedError, AttributeError):
+            logger.warning('no SIGHUP on this platform, reload is only available over http')
+        self._metrics.add_route('/-/reload', self.http_reload)
+        self._watch_inventory()
+
+    def _watch_inventory(self) -> None:
+        if self._inventory is not None and self._watch_task is None:
+            self._watch_task = self._loop.create_task(self._watch())
+        elif self._inventory is None and self._watch_task is not None:
+            self._watch_task.cancel()
+            self._watch_task = None
+
+    def _inventory_plans(self) -> List[HostPlan]:
+        if self._inventory is None:
+            return []
+        hosts = self._inventory.hosts(self._config.modules, [host_plan.hostname for host_plan in self._static_plans])
+        return compile_hosts(hosts, self._modules)
+
+    async def _watch(self) -> None:
+        while True:
+            await asyncio.sleep(self._config.inventory.refresh_interval)
+            async with self._lock:
+                if self._inventory is None:
+                    return
+                try:
+                    changed = await self._loop.run_in_executor(None, self._inventory.scan)
+                    if not changed:
+                        continue
+                    plans = self._static_plans + self._inventory_plans()
+                    await self._apply(plans, 'inventory changed')
+                except Exception:
+                    logger.exception('failed to apply inventory changes')
+
+    async def _apply(self, plans: List[HostPlan], reason: str,
+                     applied: Optional[concurrent.futures.Future] = None) -> None:
+        removed, added = diff_plans(self._querier.plans, plans)
+        hostnames = set(host_plan.hostname for host_plan in plans)
+        for host_plan, module_plan in removed:
+            self._querier.stop_unit(self._scheduler, host_plan, module_plan, host_plan.hostname not in hostnames)
+        self._querier.set_plans(plans)
+        summary = '{}, {} host modules stopped, {} started'.format(reason, len(removed), len(added))
+        logger.info(summary)
+        if applied is not None:
+            applied.set_result(summary)
+        if added:
+            await self._querier.start_units(self._max_threads, self._scheduler, added)
+            logger.info('warmup of %s host modules done', len(added))
+
+    def trigger(self) -> None:
+        logger.info('reload requested')
+        self._loop.create_task(self.reload())
+
+    async def reload(self, applied: Optional[concurrent.futures.Future] = None) -> None:
+        '''
+            applied get the reload summary once the configuration is applied,
+            before the warmup of the started modules
+        '''
+        async with self._lock:
+            try:
+                await self._reload(applied)
+            except Exception as e:
+                logger.exception('failed to reload the configuration')
+                # the http request waiting for the reload is answered anyway
+                if applied is not None and not applied.done():
+                    applied.set_exception(e)
+
+    async def _reload(self, applied: Optional[concurrent.futures.Future]) -> None:
+        try:
+            config = await self._loop.run_in_executor(None, parse_config, self._filename)
+            modules, static_plans = compile_plans(config, self._querier.resolve_oid)
+        except BadConfigurationException as e:
+            logger.error('bad configuration, keep the current one')
+            if applied is not None:
+                applied.set_exception(e)
+            return
+        for metric_name, metric_data in config.descriptions.items():
+            # existing metrics keep their series, and their type and description
+            if metric_name not in self._config.descriptions:
+                self._metrics.add_metric(metric_name, metric_data['type'], metric_data['description'])
+        for metric_name in self._config.descriptions:
+            if metric_name not in config.descriptions:
+                self._metrics.remove_metric(metric_name)
+        for module_name, module_data in config.modules.items():
+            self._metrics.add_module(module_name, [metric.name for metric in module_data.metrics])
+        if self._plan_cache is not None:
+            save_plan_cache(self._plan_cache, plan_cache_key(self._filename), config, modules, static_plans)
+        self._config = config
+        self._modules = modules
+        self._static_plans = static_plans
+        if config.inventory is None:
+            self._inventory = None
+        else:
+            if self._inventory is None:
+                self._inventory = Inventory(config.inventory)
+            else:
+                self._inventory.configure(config.inventory)
+            await self._loop.run_in_executor(None, self._inventory.scan)
+        self._watch_inventory()
+        await self._apply(static_plans + self._inventory_plans(), 'configuration reloaded', applied)
+
+    def http_reload(self, request: ExporterRequestHandler) -> HTTPResponse:
+        if request.command != 'POST':
+            return HTTPResponse(b'reload should be requested with POST\n', status=405, headers={'Allow': 'POST'})
+        applied = concurrent.futures.Future()  # type: concurrent.futures.Future
+        asyncio.run_coroutine_threadsafe(self.reload(applied), self._loop)
+        try:
+            summary = applied.result(timeout=300)
+        except BadConfigurationException:
+            return HTTPResponse(b'bad configuration, keep the current one\n', status=400)
+        except concurrent.futures.TimeoutError:
+            return HTTPResponse(b'reload still running\n', status=503)
+        except Exception:
+            return HTTPResponse(b'reload failed, see the exporter logs\n', status=500)
+        return HTTPResponse('{}\n'.format(summary).encode())
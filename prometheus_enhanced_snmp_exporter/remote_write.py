@@ -0,0 +1,254 @@
+# This file is part of prometheus-enhanced-snmp-exporte.
+#
+# prometheus-enhanced-snmp-exporte is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# prometheus-enhanced-snmp-exporte is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with prometheus-enhanced-snmp-exporte. If not, see <https://www.gnu.org/licenses/>.
+
+import base64
+import http.client
+import logging
+import queue
+import threading
+import time
+from urllib.parse import urlsplit
+from typing import Dict, List, Optional
+
+from .driver import LabelSetIndex, OutputDriver
+from .exposition import to_float
+from .protobuf import encode_varint, field_bytes, field_double, field_string, field_varint
+
+try:
+    import snappy
+except ImportError:
+    snappy = None
+
+logger = logging.getLogger(__name__)
+
+
+def _snappy_literal(data: bytes) -> bytes:
+    length = len(data) - 1
+    if length < 60:
+        return bytes([length << 2]) + data
+    for tag, size in ((60, 1), (61, 2), (62, 3), (63, 4)):
+        if length < 1 << (8 * size):
+            return bytes([tag << 2]) + length.to_bytes(size, 'little') + data
+    raise ValueError('literal too long')
+
+
+def snappy_compress(data: bytes) -> bytes:
+    '''
+        snappy block format, as expected by remote write. Without the snappy
+        module the block is made of literals only : valid, but not compressed
+    '''
+    if snappy is not None:
+        return snappy.compress(data)
+    out = [encode_varint(len(data))]
+    for offset in range(0, len(data), 65536):
+        out.append(_snappy_literal(data[offset:offset + 65536]))
+    return b''.join(out)
+
+
+def encode_labels(label_pairs) -> bytes:
+    # prometheus.Label, repeated on TimeSeries field 1
+    return b''.join(field_bytes(1, field_string(1, label_name) + field_string(2, str(label_value)))
+                    for label_name, label_value in label_pairs)
+
+
+def encode_timeseries(encoded_labels: bytes, value: float, timestamp: int) -> bytes:
+    # prometheus.TimeSeries with a single prometheus.Sample
+    return encoded_labels + field_bytes(2, field_double(1, value) + field_varint(2, timestamp))
+
+
+class RemoteWriteSeries(object):
+    '''
+        encoded labels of the series of a metric and a host, kept across polls
+    '''
+    __slots__ = ('label_sets', 'encoded', 'seen')
+
+    def __init__(self) -> None:
+        self.label_sets = LabelSetIndex()
+        self.encoded = {}  # type: Dict[int, bytes]
+        self.seen = set()
+
+
+class RemoteWriteShard(threading.Thread):
+    '''
+        one queue and one connection per shard, a series always use the same shard
+        so its samples are sent in order
+    '''
+    def __init__(self, driver: 'RemoteWriteDriver', shard_id: int) -> None:
+        threading.Thread.__init__(self, name='remote-write-{}'.format(shard_id), daemon=True)
+        self._driver = driver
+        self.queue = queue.Queue(driver.queue_size)  # type: queue.Queue
+        self._connection = None  # type: Optional[http.client.HTTPConnection]
+
+    def _connect(self) -> http.client.HTTPConnection:
+        if self._connection is None:
+            url = self._driver.url
+            if url.scheme == 'https':
+                self._connection = http.client.HTTPSConnection(url.netloc, timeout=self._driver.timeout)
+            else:
+                self._connection = http.client.HTTPConnection(url.netloc, timeout=self._driver.timeout)
+        return self._connection
+
+    def _post(self, body: bytes) -> int:
+        connection = self._connect()
+        try:
+            connection.request('POST', self._driver.path, body, self._driver.headers)
+            response = connection.getresponse()
+            response.read()
+            return response.status
+        except (OSError, http.client.HTTPException):
+            connection.close()
+            self._connection = None
+            raise
+
+    def _send(self, samples: List[bytes]) -> None:
+        body = snappy_compress(b''.join(field_bytes(1, sample) for sample in samples))
+        backoff = self._driver.min_backoff
+        for attempt in range(self._driver.max_retries + 1):
+            try:
+                status = self._post(body)
+            except (OSError, http.client.HTTPException) as e:
+                logger.warning('remote write failed: %s', e)
+            else:
+                if status < 300:
+                    self._driver.count('sent', len(samples))
+                    return
+                if status < 500 and status != 429:
+                    # the receiver refuse theses samples, retrying won't help
+                    logger.error('remote write rejected with status %s, drop %s samples', status, len(samples))
+                    self._driver.count('rejected', len(samples))
+                    return
+                logger.warning('remote write failed with status %s', status)
+            if attempt < self._driver.max_retries:
+                self._driver.count('retries', 1)
+                time.sleep(backoff)
+                backoff = min(backoff * 2, self._driver.max_backoff)
+        logger.error('remote write failed %s times, drop %s samples', self._driver.max_retries + 1, len(samples))
+        self._driver.count('failed', len(samples))
+
+    def run(self) -> None:
+        batch_size = self._driver.batch_size
+        while True:
+            samples = [self.queue.get()]
+            deadline = time.monotonic() + self._driver.flush_interval
+            while len(samples) < batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    samples.append(self.queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            try:
+                self._send(samples)
+            except Exception:
+                logger.exception('unexpected error on remote write')
+
+
+class RemoteWriteDriver(OutputDriver):
+    '''
+        push samples with the prometheus remote write protocol, instead of exposing them
+    '''
+    def __init__(self, url: str, shards: int = 4, batch_size: int = 500, queue_size: int = 100000,
+                 max_retries: int = 5, min_backoff: float = 0.5, max_backoff: float = 30, flush_interval: float = 1,
+                 timeout: float = 30, username: Optional[str] = None, password: Optional[str] = None) -> None:
+        self.url = urlsplit(url)
+        self.path = self.url.path or '/'
+        if self.url.query:
+            self.path += '?' + self.url.query
+        self.batch_size = batch_size
+        self.queue_size = queue_size
+        self.max_retries = max_retries
+        self.min_backoff = min_backoff
+        self.max_backoff = max_backoff
+        self.flush_interval = flush_interval
+        self.timeout = timeout
+        self.headers = {
+            'Content-Encoding': 'snappy',
+            'Content-Type': 'application/x-protobuf',
+            'User-Agent': 'prometheus-enhanced-snmp-exporter',
+            'X-Prometheus-Remote-Write-Version': '0.1.0',
+        }
+        if username is not None:
+            credentials = '{}:{}'.format(username, password or '').encode()
+            self.headers['Authorization'] = 'Basic ' + base64.b64encode(credentials).decode()
+        self._shards = [RemoteWriteShard(self, shard_id) for shard_id in range(shards)]
+        # series of each metric and host
+        self._series = {}  # type: Dict[tuple, RemoteWriteSeries]
+        self._counters = {'sent': 0, 'rejected': 0, 'failed': 0, 'dropped': 0, 'retries': 0}
+        self._counters_lock = threading.Lock()
+        self._last_drop_warning = 0.0
+
+    def count(self, counter: str, value: int) -> None:
+        with self._counters_lock:
+            self._counters[counter] += value
+
+    def counters(self) -> Dict[str, int]:
+        with self._counters_lock:
+            return dict(self._counters)
+
+    def start_serving(self) -> None:
+        logger.info('start remote write to %s with %s shards', self.url.geturl(), len(self._shards))
+        for shard in self._shards:
+            shard.start()
+
+    def add_metric(self, name: str, metric_type: str, description: str) -> None:
+        # metadata are not sent
+        pass
+
+    def add_module(self, module_name: str, metric_names: List[str]) -> None:
+        pass
+
+    def clear(self, hostname: str, metric_name: str) -> None:
+        key = (metric_name, hostname)
+        if key not in self._series:
+            self._series[key] = RemoteWriteSeries()
+        self._series[key].seen = set()
+
+    def update_metric(self, hostname: str, metric_name: str, labels: Dict[str, str], value: str) -> None:
+        value = to_float(value)
+        if value is None:
+            return
+        series = self._series[(metric_name, hostname)]
+        fingerprint = series.label_sets.fingerprint(labels)
+        encoded_labels = series.encoded.get(fingerprint)
+        if encoded_labels is None:
+            label_pairs = sorted(list(series.label_sets.labels(fingerprint)) + [('__name__', metric_name)])
+            encoded_labels = encode_labels(label_pairs)
+            series.encoded[fingerprint] = encoded_labels
+        series.seen.add(fingerprint)
+        sample = encode_timeseries(encoded_labels, value, int(time.time() * 1000))
+        shard = self._shards[hash((metric_name, fingerprint)) % len(self._shards)]
+        try:
+            shard.queue.put_nowait(sample)
+        except queue.Full:
+            self.count('dropped', 1)
+            now = time.monotonic()
+            if now - self._last_drop_warning > 60:
+                self._last_drop_warning = now
+                logger.warning('remote write queue full, samples are dropped (%s so far)', self.counters()['dropped'])
+
+    def release_update_lock(self, hostname: str, metric_name: str) -> None:
+        # forget encoded labels of series gone since the previous poll
+        series = self._series[(metric_name, hostname)]
+        series.label_sets.retain(series.seen)
+        for fingerprint in [fingerprint for fingerprint in series.encoded if fingerprint not in series.seen]:
+            del series.encoded[fingerprint]
+
+    def discard_update(self, hostname: str, metric_name: str) -> None:
+        # samples already queued are sent anyway
+        pass
+
+    def forget(self, hostname: str, metric_name: str) -> None:
+        self._series.pop((metric_name, hostname), None)
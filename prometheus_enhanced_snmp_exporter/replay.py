@@ -0,0 +1,177 @@
+# This file is part of prometheus-enhanced-snmp-exporte.
+#
+# prometheus-enhanced-snmp-exporte is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# prometheus-enhanced-snmp-exporte is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with prometheus-enhanced-snmp-exporte. If not, see <https://www.gnu.org/licenses/>.
+
+import glob
+import json
+import logging
+import os
+import time
+from typing import List, Optional, Tuple
+from urllib.parse import quote, unquote
+
+from pyasn1.type import univ
+from pysnmp.proto import rfc1902, rfc1905
+
+logger = logging.getLogger(__name__)
+
+VALUE_TYPES = {cls.__name__: cls for cls in (
+    rfc1902.Integer, rfc1902.Integer32, rfc1902.OctetString, rfc1902.IpAddress, rfc1902.Counter32,
+    rfc1902.Gauge32, rfc1902.Unsigned32, rfc1902.TimeTicks, rfc1902.Opaque, rfc1902.Counter64,
+    rfc1902.Bits, rfc1902.ObjectName, rfc1902.ObjectIdentifier)}
+
+# values without content
+EMPTY_VALUES = {
+    'Null': univ.Null(''),
+    'NoSuchObject': rfc1905.noSuchObject,
+    'NoSuchInstance': rfc1905.noSuchInstance,
+    'EndOfMibView': rfc1905.endOfMibView,
+}
+
+# a request is identified by its type, community and requested oids
+RequestKey = Tuple[str, str, Tuple[str, ...]]
+
+
+def encode_varbind(varbind) -> List:
+    name, value = varbind[0], varbind[1]
+    if hasattr(name, 'getOid'):
+        name = name.getOid()
+    type_name = type(value).__name__
+    if type_name in EMPTY_VALUES:
+        encoded = None
+    elif isinstance(value, univ.Integer):
+        encoded = int(value)
+    elif isinstance(value, univ.ObjectIdentifier):
+        encoded = str(value)
+    else:
+        encoded = value.asOctets().hex()
+    return [str(name), type_name, encoded]
+
+
+def decode_varbind(encoded: List) -> Tuple:
+    name, type_name, value = encoded
+    if type_name in EMPTY_VALUES:
+        return rfc1902.ObjectName(name), EMPTY_VALUES[type_name]
+    value_type = VALUE_TYPES[type_name]
+    if issubclass(value_type, (univ.Integer, univ.ObjectIdentifier)):
+        return rfc1902.ObjectName(name), value_type(value)
+    return rfc1902.ObjectName(name), value_type(hexValue=value)
+
+
+def capture_file(directory: str, hostname: str) -> str:
+    return os.path.join(directory, quote(hostname, safe='') + '.jsonl')
+
+
+class Recorder(object):
+    '''
+        write the responses of the agents, a json line by request on a file by host
+    '''
+    def __init__(self, directory: str) -> None:
+        os.makedirs(directory, exist_ok=True)
+        self._directory = directory
+        # open capture of each host
+        self._files = {}  # type: dict
+
+    def record(self, hostname: str, query_type: str, community: str, oids: List[str], output) -> None:
+        capture = self._files.get(hostname)
+        if capture is None:
+            # line buffered, a killed exporter keeps its capture
+            capture = open(capture_file(self._directory, hostname), 'a', buffering=1)
+            self._files[hostname] = capture
+        rows = None
+        if output is not None:
+            rows = [[encode_varbind(varbind) for varbind in row] for row in output]
+        capture.write(json.dumps({'time': round(time.time(), 3), 'type': query_type, 'community': community,
+                                  'oids': oids, 'rows': rows}) + '\n')
+
+
+class HostCapture(object):
+    '''
+        responses of a host, read along the replay clock
+    '''
+    def __init__(self, path: str) -> None:
+        self._file = open(path)
+        self._next = None  # type: Optional[dict]
+        # rows of the last response read for each request key
+        self._latest = {}  # type: dict
+        self._read()
+        self.start = self._next['time'] if self._next is not None else None
+
+    def _read(self) -> None:
+        for line in self._file:
+            try:
+                self._next = json.loads(line)
+                return
+            except ValueError:
+                # last line of a capture interrupted while writing
+                continue
+        self._next = None
+        self._file.close()
+
+    @property
+    def exhausted(self) -> bool:
+        return self._next is None
+
+    def response(self, key: RequestKey, until: float) -> Optional[List]:
+        '''
+            the last response recorded before until, None for a request not recorded
+            yet, which fails like an unanswered one
+        '''
+        while self._next is not None and self._next['time'] <= until:
+            record = self._next
+            self._latest[(record['type'], record['community'], tuple(record['oids']))] = record['rows']
+            self._read()
+        return self._latest.get(key)
+
+
+class Replayer(object):
+    '''
+        answer the queries from the captures of Recorder, without network. The
+        capture clock runs speed times faster than the real one
+    '''
+    def __init__(self, directory: str, speed: float = 1) -> None:
+        self._speed = speed
+        # capture of each host
+        self._hosts = {}  # type: dict
+        for path in glob.glob(os.path.join(directory, '*.jsonl')):
+            hostname = unquote(os.path.basename(path)[:-len('.jsonl')])
+            self._hosts[hostname] = HostCapture(path)
+        starts = [host.start for host in self._hosts.values() if host.start is not None]
+        if not starts:
+            logger.warning('no capture found in %s', directory)
+        self._capture_start = min(starts) if starts else 0
+        self._real_start = None  # type: Optional[float]
+        # hosts whose capture is not fully read
+        self._reading = sum(1 for host in self._hosts.values() if not host.exhausted)
+        logger.info('replay %s hosts, %s times faster', len(self._hosts), speed)
+
+    def now(self) -> float:
+        if self._real_start is None:
+            self._real_start = time.monotonic()
+        return self._capture_start + (time.monotonic() - self._real_start) * self._speed
+
+    def response(self, hostname: str, query_type: str, community: str, oids: List[str]):
+        host = self._hosts.get(hostname)
+        if host is None:
+            logger.debug('no capture for %s', hostname)
+            return None
+        was_exhausted = host.exhausted
+        rows = host.response((query_type, community, tuple(oids)), self.now())
+        if host.exhausted and not was_exhausted:
+            self._reading -= 1
+            if self._reading == 0:
+                logger.info('end of the captures reached, the last responses are replayed')
+        if rows is None:
+            return None
+        return [[decode_varbind(varbind) for varbind in row] for row in rows]
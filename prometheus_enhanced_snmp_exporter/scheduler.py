@@ -18,10 +18,13 @@ from apscheduler.schedulers.background import BackgroundScheduler
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from apscheduler.executors.asyncio import AsyncIOExecutor
 from apscheduler.executors.pool import ThreadPoolExecutor
+from apscheduler.jobstores.base import JobLookupError
 
 
 class JobScheduler(object):
-    def __init__(self, max_threads=1):
+    def __init__(self, max_threads=1, speed: float = 1):
+        # intervals are divided by speed, to replay captures on an accelerated clock
+        self._speed = speed
         executors = {
             'default': AsyncIOExecutor()
         }
@@ -32,11 +35,19 @@ class JobScheduler(object):
         self.scheduler = AsyncIOScheduler(
             executors=executors, job_defaults=job_defaults)
 
-    def add_job(self, func, interval: int, *args, **kwargs):
-        misfire_grace_time = interval - 1
+    def add_job(self, func, interval: int, *args, **kwargs) -> str:
+        interval = interval / self._speed
+        misfire_grace_time = max(int(interval) - 1, 1)
         job_name = '{}({}, {})'.format(func.__name__, str(args), str(kwargs))
         self.scheduler.add_job(func, 'interval', seconds=interval,
                                args=args, kwargs=kwargs, misfire_grace_time=misfire_grace_time, id=job_name, name=job_name)
+        return job_name
+
+    def remove_job(self, job_name: str) -> None:
+        try:
+            self.scheduler.remove_job(job_name)
+        except JobLookupError:
+            pass
 
     def start_scheduler(self) -> None:
         self.scheduler.start()
@@ -0,0 +1,118 @@
+# This file is part of prometheus-enhanced-snmp-exporte.
+#
+# prometheus-enhanced-snmp-exporte is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# prometheus-enhanced-snmp-exporte is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with prometheus-enhanced-snmp-exporte. If not, see <https://www.gnu.org/licenses/>.
+
+import socket
+import logging
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from socketserver import ThreadingMixIn
+from urllib.parse import urlsplit, parse_qs
+from typing import Callable, Dict, Iterable, Union
+
+logger = logging.getLogger(__name__)
+
+# small blocks are merged up to this size before being sent as one chunk
+CHUNK_SIZE = 65536
+
+
+class HTTPResponse(object):
+    '''
+        body could be bytes (sent with a Content-Length) or an iterable of bytes
+        (streamed with chunked transfer encoding while it's consumed)
+    '''
+    def __init__(self, body: Union[bytes, Iterable[bytes]], content_type: str = 'text/plain', status: int = 200,
+                 headers: Dict[str, str] = None) -> None:
+        self.body = body
+        self.content_type = content_type
+        self.status = status
+        self.headers = headers or {}
+
+
+class ExporterRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # idle keep-alive connections are closed after this delay
+    timeout = 60
+
+    def do_GET(self) -> None:
+        self._dispatch()
+
+    def do_POST(self) -> None:
+        # request bodies are not used, but read to keep the connection usable
+        length = int(self.headers.get('Content-Length', 0) or 0)
+        if length > 0:
+            self.rfile.read(length)
+        self._dispatch()
+
+    def _dispatch(self) -> None:
+        url = urlsplit(self.path)
+        self.url_path = url.path
+        self.query = parse_qs(url.query)
+        route = self.server.routes.get(url.path)
+        if route is None:
+            self.send_error(404)
+            return
+        try:
+            response = route(self)
+        except Exception:
+            logger.exception('error while serving %s', self.path)
+            self.send_error(500)
+            return
+        self._send_response(response)
+
+    def _send_response(self, response: HTTPResponse) -> None:
+        self.send_response(response.status)
+        self.send_header('Content-Type', response.content_type)
+        for header_name, header_value in response.headers.items():
+            self.send_header(header_name, header_value)
+        if isinstance(response.body, bytes):
+            self.send_header('Content-Length', str(len(response.body)))
+            self.end_headers()
+            self.wfile.write(response.body)
+            return
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        pending = []
+        pending_size = 0
+        for block in response.body:
+            if not block:
+                continue
+            pending.append(block)
+            pending_size += len(block)
+            if pending_size >= CHUNK_SIZE:
+                self._write_chunk(b''.join(pending))
+                pending = []
+                pending_size = 0
+        if pending:
+            self._write_chunk(b''.join(pending))
+        self.wfile.write(b'0\r\n\r\n')
+
+    def _write_chunk(self, data: bytes) -> None:
+        self.wfile.write(b'%x\r\n' % len(data))
+        self.wfile.write(data)
+        self.wfile.write(b'\r\n')
+
+    def log_message(self, format: str, *args) -> None:
+        logger.debug('%s - %s', self.address_string(), format % args)
+
+
+class ExporterHTTPServer(ThreadingMixIn, HTTPServer):
+    '''
+        one thread per connection, so a slow scrape doesn't delay the others
+    '''
+    address_family = socket.AF_INET6
+    daemon_threads = True
+
+    def __init__(self, server_address, routes: Dict[str, Callable[[ExporterRequestHandler], HTTPResponse]]) -> None:
+        self.routes = routes
+        HTTPServer.__init__(self, server_address, ExporterRequestHandler)
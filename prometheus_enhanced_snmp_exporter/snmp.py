@@ -18,22 +18,43 @@ from .driver import OutputDriver
 from .scheduler import JobScheduler
 from .storage import LabelStorage, TemplateStorage
 from .config import HostConfiguration, OIDConfiguration, ParserConfiguration
+from .debug import PollRegistry
+from .accounting import SeriesAccounting, SeriesLimit
+from .mib import MibResolver
+from .plan import HostPlan, ModulePlan, PollTask, PollUnit
+from .replay import Recorder, Replayer
 from pysnmp.hlapi.asyncio import SnmpEngine, CommunityData, UdpTransportTarget, ObjectType, getCmd, bulkCmd, ContextData, isEndOfMib
 from pysnmp.error import PySnmpError
-from pysnmp.smi.view import MibViewController
 from pysnmp.smi.rfc1902 import ObjectIdentity
 from pysnmp.proto.rfc1902 import Integer32, Integer, Counter32, Gauge32, Unsigned32, TimeTicks, Counter64, \
     OctetString, Opaque, IpAddress, Bits
 from pysnmp.proto.rfc1905 import endOfMibView
 from pyasn1.type.univ import Null
 from concurrent.futures import ThreadPoolExecutor, as_completed
-from typing import Tuple
+from functools import wraps
+from typing import List, Optional, Tuple
 
 import logging
 
 logger = logging.getLogger(__name__)
 
 
+def transport_address(hostname: str) -> Tuple[str, int]:
+    '''
+        a hostname could hold the agent port, as host:port or [ipv6]:port
+    '''
+    if hostname.startswith('['):
+        host, _, port = hostname[1:].partition(']')
+        if port.startswith(':') and port[1:].isdigit():
+            return host, int(port[1:])
+        return host, 161
+    if hostname.count(':') == 1:
+        host, port = hostname.split(':')
+        if port.isdigit():
+            return host, int(port)
+    return hostname, 161
+
+
 def filter_attr(filter_expr, val: str) -> Tuple[bool, str]:
     if not filter_expr:
         return (True, val)
@@ -45,6 +66,7 @@ def filter_attr(filter_expr, val: str) -> Tuple[bool, str]:
         return (True, grp_attr[0])
     return (True, val)
 
+
 class SNMPConverter(object):
     def __init__(self, mib_controller):
         self.mib_controller = mib_controller
@@ -154,65 +176,170 @@ class SNMPConverter(object):
             return str(data)
 
 
+def tracked_poll(kind: str):
+    '''
+        register the poll in SNMPQuerier.polls while it runs, the polled metric or
+        batch is the last argument
+    '''
+    def decorator(func):
+        @wraps(func)
+        async def tracked(self, host_config: HostConfiguration, module_name: str, *args):
+            polled = args[-1]
+            name = ','.join(task.name for task in polled) if isinstance(polled, list) else polled.name
+            with self.polls.poll(host_config.hostname, module_name, kind, name):
+                return await func(self, host_config, module_name, *args)
+        return tracked
+    return decorator
+
+
+class QueryCoalescer(object):
+    '''
+        single-flight of identical snmp requests : concurrent callers sharing the same key
+        await the same in-flight query. When ttl is set, the result is reused for ttl seconds.
+        results are shared between callers and should be considered as read only
+    '''
+    def __init__(self, ttl: int = 0):
+        self._ttl = ttl
+        # query task of each key, and (expiry, result) of the finished ones
+        self._inflight = {}  # type: dict
+        self._results = {}  # type: dict
+        self._next_purge = 0
+
+    def _purge(self, now: float) -> None:
+        if now < self._next_purge:
+            return
+        self._next_purge = now + self._ttl
+        for key in [key for key, (expire, _) in self._results.items() if expire <= now]:
+            del self._results[key]
+
+    def _done(self, key: Tuple, task: asyncio.Task) -> None:
+        del self._inflight[key]
+        if self._ttl <= 0 or task.cancelled() or task.exception() is not None:
+            return
+        result = task.result()
+        if result is None:
+            # query failed, don't keep the failure around
+            return
+        now = asyncio.get_event_loop().time()
+        self._purge(now)
+        self._results[key] = (now + self._ttl, result)
+
+    async def run(self, key: Tuple, query_factory):
+        if self._ttl > 0:
+            cached = self._results.get(key)
+            if cached is not None:
+                expire, result = cached
+                if expire > asyncio.get_event_loop().time():
+                    logger.debug('reuse result for %s', key)
+                    return result
+                del self._results[key]
+
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.get_event_loop().create_task(query_factory())
+            self._inflight[key] = task
+            task.add_done_callback(lambda done_task: self._done(key, done_task))
+        else:
+            logger.debug('join in-flight query for %s', key)
+        # shield : a cancelled caller must not cancel the query of the others
+        return await asyncio.shield(task)
+
+
 class SNMPQuerier(object):
-    def __init__(self, config: ParserConfiguration, storage: LabelStorage, template_storage: TemplateStorage, metrics: OutputDriver):
+    def __init__(self, config: ParserConfiguration, storage: LabelStorage, template_storage: TemplateStorage, metrics: OutputDriver,
+                 recorder: Optional[Recorder] = None, replay: Optional[Replayer] = None,
+                 accounting: Optional[SeriesAccounting] = None):
         self._config = config
         self._storage = storage
         self._template_storage = template_storage
         self._metrics = metrics
 
         self._engine = SnmpEngine()
-        self.mib_controller = MibViewController(self._engine.getMibBuilder())
+        self._resolver = MibResolver(self._engine.getMibBuilder())
+        self.mib_controller = self._resolver.mib_controller
         self.converter = SNMPConverter(self.mib_controller)
-        self.mib_cache = {}
-
-    def _mibobj_resolution(self, mib_obj):
-        mib_obj.addAsn1MibSource('file:///usr/share/snmp/mibs')
-        mib_obj.addAsn1MibSource('file://~/.snmp/mibs')
-        mib_obj.resolveWithMib(self.mib_controller)
-
-        return mib_obj
+        # semaphore limiting the requests in flight to each host
+        self._host_semaphores = {}  # type: dict
+        self._coalescer = QueryCoalescer(config.query_cache_ttl)
+        self._plans = []  # type: List[HostPlan]
+        # scheduled jobs of each module of each host
+        self._jobs = {}  # type: dict
+        # responses are written to a capture, or read from one instead of the network
+        self._recorder = recorder
+        self._replay = replay
+        # polls and requests in flight, for /debug/tasks
+        self.polls = PollRegistry()
+        # series kept by each table, max_series limits are applied while polling
+        self.accounting = accounting if accounting is not None else SeriesAccounting()
+
+    @property
+    def plans(self) -> List[HostPlan]:
+        return self._plans
+
+    def set_plans(self, plans: List[HostPlan]) -> None:
+        self._plans = plans
+
+    def _units(self, units: Optional[List[PollUnit]]) -> List[PollUnit]:
+        if units is not None:
+            return units
+        return [(host_plan, module_plan) for host_plan in self._plans for module_plan in host_plan.modules]
+
+    def _add_job(self, scheduler: JobScheduler, host_plan: HostPlan, module_plan: ModulePlan, func, every: int,
+                 *args) -> None:
+        job_name = scheduler.add_job(func, every, *args)
+        self._jobs.setdefault((host_plan.hostname, module_plan.name), []).append(job_name)
+
+    def stop_unit(self, scheduler: JobScheduler, host_plan: HostPlan, module_plan: ModulePlan,
+                  host_removed: bool) -> None:
+        '''
+            stop polling a module of a host, and free its labels and series
+        '''
+        for job_name in self._jobs.pop((host_plan.hostname, module_plan.name), []):
+            scheduler.remove_job(job_name)
+        for metric_name in module_plan.metric_names():
+            self._metrics.forget(host_plan.hostname, metric_name)
+        if host_removed:
+            self._storage.forget(host_plan.hostname)
+            self._template_storage.forget(host_plan.hostname)
+            self.accounting.forget(host_plan.hostname)
+            self._host_semaphores.pop(host_plan.hostname, None)
+        else:
+            self._storage.forget(host_plan.hostname, module_plan.name)
+            self._template_storage.forget(host_plan.hostname, module_plan.name)
+            self.accounting.forget(host_plan.hostname, module_plan.name)
+
+    async def start_units(self, max_threads: int, scheduler: JobScheduler, units: List[PollUnit]) -> None:
+        await self.warmup_template_cache(max_threads, scheduler, units)
+        await self.warmup_label_cache(max_threads, scheduler, units)
+        self.warmup_join_cache(units)
+        await self.warmup_metrics(max_threads, scheduler, units)
+
+    def resolve_oid(self, oid: str) -> str:
+        '''
+            numeric form of an oid, so it's resolved without loading its mib
+        '''
+        try:
+            return self._resolver.resolve(oid)
+        except Exception:
+            logger.error("can't resolve %s, keep it as is", oid)
+            return oid
 
     def _mibstr_to_objstr(self, mib):
-        if mib in self.mib_cache:
-            return self.mib_cache[mib]
-        try:
-            logger.debug('mib to check : %s', mib)
-            if '::' in mib:
-                data = mib.split('::')
-                out = []
-                logger.debug('mib component : %s', data)
-                for component in data:
-                    out += component.split('.')
-                for i in range(0, len(out)):
-                    try:
-                        out[i] = int(out[i])
-                    except ValueError:
-                        pass
-
-                logger.debug('mib component : %s', out)
-                mib_obj = ObjectIdentity(*out)
-            else:
-                mib_obj = ObjectIdentity(mib)
-            self.mib_cache[mib] = self._mibobj_resolution(mib_obj)
-            return self.mib_cache[mib]
-        except Exception as e:
-            logger.error("can't resolv oid into object: %s", mib)
-            logger.exception('detail ', e)
-            raise e
+        return self._resolver.object_identity(mib)
 
     @asyncio.coroutine
     def query_asyncio(self, method, func, engine, community, hostname, context, oids, args):
         data = []
         orig_oid = oids
+        # a get could hold several oids
+        varbinds = oids if isinstance(oids, list) else [oids]
         while 1:
             (error_indicator, error_status, error_index, output) = yield from func(
                 engine,
                 community,
                 hostname,
                 context,
-                *args,
-                oids,
+                *(list(args) + varbinds),
                 lookupMib=False)
 
             if error_indicator:
@@ -239,7 +366,55 @@ class SNMPQuerier(object):
                 return data
             oids = output[-1][0]
 
+    async def _exchange(self, query_type: str, hostname: str, community: str, oids: List[str], request):
+        '''
+            rows of varbinds answered to a request, or None on error. request build the
+            query coroutine, it's not called when the response come from a capture
+        '''
+        if self._replay is not None:
+            return self._replay.response(hostname, query_type, community, oids)
+        with self.polls.request(hostname):
+            output = await request()
+        if self._recorder is not None:
+            self._recorder.record(hostname, query_type, community, oids, output)
+        return output
+
     async def query(self, oid: str, hostname: str, community: str, version: str, store_method: str, oid_suffix: str, query_type: str = 'get'):
+        # storage options only apply to the response, polls storing it differently share the request
+        key = (hostname, community, version, oid, query_type)
+        response = await self._coalescer.run(
+            key, lambda: self._query(oid, hostname, community, version, query_type))
+        if response is None:
+            return None
+        oid_obj, output = response
+        try:
+            out_dict = {}
+            for output_elem in output:
+                obj = output_elem[0]
+                logger.debug('query_result: %s', str(obj))
+                key, val = self.converter.convert(
+                    store_method, obj, oid_obj, oid_suffix)
+                if key is None:
+                    continue
+                out_dict[key] = val
+        except PySnmpError as e:
+            logger.debug('hostname: %s, oid: %s', hostname, oid)
+            logger.exception('errer when converting oid: %s', e)
+            return None
+
+        logger.debug('output data: %s', out_dict)
+        if query_type == 'walk':
+            return out_dict
+        else:
+            try:
+                return list(out_dict.values())[0]
+            except IndexError:
+                return None
+
+    async def _query(self, oid: str, hostname: str, community: str, version: str, query_type: str = 'get'):
+        '''
+            the requested oid object and the rows answered, or None when the request failed
+        '''
         logger.debug('check for OID  %s(%s) on %s with %s',
                      oid, query_type, hostname, community)
         if version == 'v2c' or version == '2':
@@ -247,8 +422,7 @@ class SNMPQuerier(object):
         else:
             mpmodel = 9
         try:
-            community = CommunityData(community, mpModel=mpmodel)
-            hostname_obj = UdpTransportTarget((hostname, 161), timeout=10)
+            community_data = CommunityData(community, mpModel=mpmodel)
             oid_obj = ObjectType(self._mibstr_to_objstr(oid))
             if query_type == 'get':
                 snmp_method = getCmd
@@ -260,33 +434,106 @@ class SNMPQuerier(object):
                 logger.error(
                     'unknow method %s, should be get or walk', query_type)
                 raise ValueError('unknow method, should be get or walk')
-            out_dict = {}
             logger.debug('start loop')
-            for output_elem in await self.query_asyncio(query_type, snmp_method, self._engine, community, hostname_obj,
-                                                        ContextData(), oid_obj, positionals_args
-                                                        ):
-                obj = output_elem[0]
-                logger.debug('query_result: %s', str(obj))
-                key, val = self.converter.convert(
-                    store_method, obj, oid_obj, oid_suffix)
-                if key is None:
-                    continue
-                out_dict[key] = val
-
-            logger.debug('output data: %s', out_dict)
-            if query_type == 'walk':
-                return out_dict
-            else:
-                try:
-                    return list(out_dict.values())[0]
-                except KeyError:
-                    return None
+            output = await self._exchange(
+                query_type, hostname, community, [oid],
+                lambda: self.query_asyncio(query_type, snmp_method, self._engine, community_data,
+                                           UdpTransportTarget(transport_address(hostname), timeout=10),
+                                           ContextData(), oid_obj, positionals_args))
+            if output is None:
+                return None
+            if self._replay is not None:
+                # resolved by the request when it's sent, needed by the conversion
+                oid_obj.resolveWithMib(self.mib_controller)
+            return oid_obj, output
 
         except PySnmpError as e:
             logger.debug('hostname: %s, oid: %s', hostname, oid)
             logger.exception('errer when fetching oid: %s', e)
             return None
 
+    async def query_many(self, oids: Tuple[str, ...], hostname: str, community: str, version: str,
+                         store_methods: Tuple[str, ...], oid_suffixes: Tuple[str, ...]):
+        '''
+            get several oids in a single request, output is the list of values in the
+            order of oids, or None when the request failed
+        '''
+        key = (hostname, community, version, oids, 'get_many')
+        response = await self._coalescer.run(
+            key, lambda: self._query_many(oids, hostname, community, version))
+        if response is None:
+            return None
+        oid_objs, row = response
+        try:
+            values = []
+            for obj, oid_obj, store_method, oid_suffix in zip(row, oid_objs, store_methods, oid_suffixes):
+                key, val = self.converter.convert(store_method, obj, oid_obj, oid_suffix)
+                values.append(val)
+            return values
+        except PySnmpError as e:
+            logger.debug('hostname: %s, oids: %s', hostname, oids)
+            logger.exception('errer when converting oids: %s', e)
+            return None
+
+    async def _query_many(self, oids: Tuple[str, ...], hostname: str, community: str, version: str):
+        '''
+            the requested oid objects and the row answered, or None when the request failed
+        '''
+        logger.debug('check for OIDs %s on %s with %s', oids, hostname, community)
+        if version == 'v2c' or version == '2':
+            mpmodel = 1
+        else:
+            mpmodel = 9
+        try:
+            community_data = CommunityData(community, mpModel=mpmodel)
+            oid_objs = [ObjectType(self._mibstr_to_objstr(oid)) for oid in oids]
+            output = await self._exchange(
+                'get', hostname, community, list(oids),
+                lambda: self.query_asyncio('get', getCmd, self._engine, community_data,
+                                           UdpTransportTarget(transport_address(hostname), timeout=10),
+                                           ContextData(), oid_objs, []))
+            if output is None:
+                return None
+            if self._replay is not None:
+                for oid_obj in oid_objs:
+                    oid_obj.resolveWithMib(self.mib_controller)
+            return oid_objs, output[0]
+        except PySnmpError as e:
+            logger.debug('hostname: %s, oids: %s', hostname, oids)
+            logger.exception('errer when fetching oids: %s', e)
+            return None
+
+    def _host_semaphore(self, host_config: HostConfiguration) -> asyncio.Semaphore:
+        semaphore = self._host_semaphores.get(host_config.hostname)
+        if semaphore is None:
+            semaphore = asyncio.Semaphore(host_config.max_concurrency)
+            self._host_semaphores[host_config.hostname] = semaphore
+        return semaphore
+
+    async def _limited_query(self, semaphore: asyncio.Semaphore, *args):
+        async with semaphore:
+            return await self.query(*args)
+
+    async def _limited_query_many(self, semaphore: asyncio.Semaphore, *args):
+        async with semaphore:
+            return await self.query_many(*args)
+
+    async def query_templated(self, host_config: HostConfiguration, communities: List[Tuple[str, str, str]], oid: str,
+                              store_method: str, oid_suffix: str, query_type: str):
+        '''
+            query the same oid for every templated community (one per vlan/vrf) concurrently,
+            at most host_config.max_concurrency at once for this host.
+            output is a list of (community_tuple, output), in the order of communities
+        '''
+        semaphore = self._host_semaphore(host_config)
+        outputs = await asyncio.gather(*[
+            self._limited_query(semaphore, oid, host_config.hostname, community, host_config.version,
+                                store_method, oid_suffix, query_type)
+            for community, _, _ in communities
+        ])
+        return list(zip(communities, outputs))
+
+    @tracked_poll('template')
     async def _update_template_label(self, host_config: HostConfiguration, module_name: str, template_group_name: str, metric: OIDConfiguration):
         # host_name
         community = host_config.community
@@ -302,19 +549,29 @@ class SNMPQuerier(object):
         logger.info('update template label for %s: %s', hostname, metric_name)
         output = await self.query(oid, hostname, community, version, store_method, oid_suffix, metric_type)
         logger.debug(output)
+        if output is None:
+            # the previous template labels are kept until a poll succeeds
+            logger.warning('poll of template label %s on %s failed, keep the previous labels', metric_name, hostname)
+            return
+        limit = SeriesLimit(metric.max_series)
         if metric_type == 'get':
+            limit.admit()
             self._template_storage.set_label(
                 hostname, module_name, template_group_name, output)
         else:
             for key, val in output.items():
+                if not limit.admit():
+                    continue
                 logger.debug('set label %s = %s', key, val)
                 self._template_storage.set_label(
                     hostname, module_name, template_group_name, val, key)
+        self._template_storage.account(hostname, module_name, template_group_name)
+        self.accounting.record(hostname, module_name, template_group_name, limit, metric=False)
 
+    @tracked_poll('label')
     async def _update_label(self, host_config: HostConfiguration, module_name: str, label_group_name: str, label_name: str, metric: OIDConfiguration):
         # host_name
         community = host_config.community
-        version = host_config.version
         hostname = host_config.hostname
         # metrics
         metric_name = metric.name
@@ -330,16 +587,23 @@ class SNMPQuerier(object):
         logger.debug('template_name %s and template %s',
                      template_name, template)
         # resolve community
-        for community, template_label_name, template_label_value in \
-                self._template_storage.resolve_community(hostname, module_name, template_name, template, community):
-            logger.info('update label for %s: %s', hostname, metric_name)
-            output = await self.query(oid, hostname, community, version, store_method, oid_suffix, metric_type)
+        communities = self._template_storage.resolve_community(
+            hostname, module_name, template_name, template, community)
+        logger.info('update label for %s: %s', hostname, metric_name)
+        outputs = await self.query_templated(host_config, communities, oid, store_method, oid_suffix, metric_type)
+        limit = SeriesLimit(metric.max_series)
+        for (community, template_label_name, template_label_value), output in outputs:
             logger.info('update label for %s: %s %s',
                         hostname, metric_name, metric_type)
             logger.debug(output)
+            if output is None:
+                # labels of this community are kept until a poll succeeds
+                logger.warning('poll of label %s on %s with %s failed, keep the previous labels',
+                               metric_name, hostname, community)
+                continue
             if metric_type == 'get':
-                (filter_result, val) = filter_attr(filter_expr, val)
-                if filter_result:
+                (filter_result, val) = filter_attr(filter_expr, output)
+                if filter_result and limit.admit():
                     self._storage.set_label(hostname, module_name, label_group_name, label_name, template_label_name,
                                             template_label_value, output)
             else:
@@ -347,15 +611,18 @@ class SNMPQuerier(object):
                     hostname, module_name, label_group_name, template_label_name, template_label_value, output)
                 for key, val in output.items():
                     (filter_result, val) = filter_attr(filter_expr, val)
-                    if not filter_result:
+                    if not filter_result or not limit.admit():
                         continue
                     self._storage.set_label(hostname, module_name, label_group_name, label_name, val,
                                             template_label_name, template_label_value, key)
+        self._storage.account(hostname, module_name, label_group_name, label_name)
+        self.accounting.record(hostname, module_name, '{}.{}'.format(label_group_name, label_name), limit,
+                               metric=False)
 
+    @tracked_poll('metric')
     async def _update_metric(self, host_config: HostConfiguration, module_name: str, metric: OIDConfiguration):
         # host_name
         community = host_config.community
-        version = host_config.version
         hostname = host_config.hostname
         # metrics
         metric_name = metric.name
@@ -367,72 +634,139 @@ class SNMPQuerier(object):
         template_name = metric.template_name
         template = metric.community_template
 
+        communities = self._template_storage.resolve_community(
+            hostname, module_name, template_name, template, community)
+        outputs = await self.query_templated(host_config, communities, oid, store_method, oid_suffix, metric_type)
+
         # now we need to resolve labels
-        for community, template_label_name, template_label_value in self._template_storage.resolve_community(hostname,
-                                                                                                             module_name,
-                                                                                                             template_name,
-                                                                                                             template,
-                                                                                                             community):
-            output = await self.query(oid, hostname, community, version, store_method, oid_suffix, metric_type)
-            logger.debug(output)
-            self._metrics.clear(hostname, metric_name)
-            if metric_type == 'get':
-                labels = self._storage.resolve_label(hostname, module_name, metric.label_group, template_label_name,
-                                                     template_label_value)
-                labels = {**host_config.static_labels, **labels}
-                if output == "":
-                    logger.warning('no output for {}, skip it'.format(labels))
-                else:
-                    self._metrics.update_metric(
-                        hostname, metric_name, labels, output)
-            else:
-                for output_index, output_value in output.items():
-                    labels = self._storage.resolve_label(
-                        hostname, module_name, metric.label_group, template_label_name, template_label_value, output_index)
-                    if labels == {}:
-                        # labels are filtered, just skip the update
-                        continue
-                    if output_value == "":
-                        logger.warning(
-                            'no output for {}, skip it'.format(labels))
-                        continue
+        # no await between clear and release, the new series set is built aside
+        # and published at once, scrapes keep the previous set meanwhile
+        limit = SeriesLimit(metric.max_series)
+        failed = False
+        self._metrics.clear(hostname, metric_name)
+        try:
+            for (community, template_label_name, template_label_value), output in outputs:
+                logger.debug(output)
+                if output is None:
+                    failed = True
+                    break
+                if metric_type == 'get':
+                    labels = self._storage.resolve_label(hostname, module_name, metric.label_group, template_label_name,
+                                                         template_label_value)
                     labels = {**host_config.static_labels, **labels}
-                    self._metrics.update_metric(
-                        hostname, metric_name, labels, output_value)
+                    if output == "":
+                        logger.warning('no output for {}, skip it'.format(labels))
+                    elif limit.admit():
+                        self._metrics.update_metric(
+                            hostname, metric_name, labels, output)
+                else:
+                    for output_index, output_value in output.items():
+                        if limit.full():
+                            # beyond the limit, labels are not even resolved
+                            limit.drop()
+                            continue
+                        labels = self._storage.resolve_label(
+                            hostname, module_name, metric.label_group, template_label_name, template_label_value, output_index)
+                        if labels == {}:
+                            # labels are filtered, just skip the update
+                            continue
+                        if output_value == "":
+                            logger.warning(
+                                'no output for {}, skip it'.format(labels))
+                            continue
+                        if not limit.admit():
+                            continue
+                        labels = {**host_config.static_labels, **labels}
+                        self._metrics.update_metric(
+                            hostname, metric_name, labels, output_value)
+        except Exception:
+            self._metrics.discard_update(hostname, metric_name)
+            raise
+        if failed:
+            # the previous series are kept until a poll succeeds
+            self._metrics.discard_update(hostname, metric_name)
+            logger.warning('poll of %s on %s failed, keep the previous series', metric_name, hostname)
+            return
+        self._metrics.release_update_lock(hostname, metric_name)
+        self.accounting.record(hostname, module_name, metric_name, limit)
+
+    @tracked_poll('metric')
+    async def _update_metric_batch(self, host_plan: HostPlan, module_name: str, tasks: List[PollTask]):
+        '''
+            poll several get metrics with the same community template in one request per community
+        '''
+        hostname = host_plan.hostname
+        communities = self._template_storage.resolve_community(
+            hostname, module_name, tasks[0].template_name, tasks[0].community_template, host_plan.community)
+        oids = tuple(task.oid for task in tasks)
+        store_methods = tuple(task.store_method for task in tasks)
+        oid_suffixes = tuple(task.oid_suffix for task in tasks)
+        semaphore = self._host_semaphore(host_plan)
+        outputs = await asyncio.gather(*[
+            self._limited_query_many(semaphore, oids, hostname, community, host_plan.version,
+                                     store_methods, oid_suffixes)
+            for community, _, _ in communities
+        ])
+
+        for position, task in enumerate(tasks):
+            metric_name = task.name
+            limit = SeriesLimit(task.max_series)
+            failed = False
+            self._metrics.clear(hostname, metric_name)
+            try:
+                for (community, template_label_name, template_label_value), values in zip(communities, outputs):
+                    output = values[position] if values is not None else None
+                    if output is None:
+                        failed = True
+                        break
+                    labels = self._storage.resolve_label(hostname, module_name, task.label_group, template_label_name,
+                                                         template_label_value)
+                    labels = {**host_plan.static_labels, **labels}
+                    if output == "":
+                        logger.warning('no output for {}, skip it'.format(labels))
+                    elif limit.admit():
+                        self._metrics.update_metric(
+                            hostname, metric_name, labels, output)
+            except Exception:
+                self._metrics.discard_update(hostname, metric_name)
+                raise
+            if failed:
+                # the previous series are kept until a poll succeeds
+                self._metrics.discard_update(hostname, metric_name)
+                logger.warning('poll of %s on %s failed, keep the previous series', metric_name, hostname)
+                continue
             self._metrics.release_update_lock(hostname, metric_name)
+            self.accounting.record(hostname, module_name, metric_name, limit)
 
-    async def warmup_template_cache(self, max_threads: int, scheduler: JobScheduler) -> None:
+    async def warmup_template_cache(self, max_threads: int, scheduler: JobScheduler,
+                                    units: Optional[List[PollUnit]] = None) -> None:
         loop = asyncio.get_event_loop()
         futurs = []
-        for host_config in self._config.hosts:
-            for module_name, module_data in host_config.items():
-                for template_group_name, template_group_data in module_data.template_label.items():
-                    futur = loop.create_task(self._update_template_label(host_config, module_name,
-                                                                         template_group_name, template_group_data))
-                    futurs.append(futur)
-                    scheduler.add_job(self._update_template_label, template_group_data.every, host_config, module_name,
-                                      template_group_name, template_group_data)
-            for futur in asyncio.as_completed(futurs):
-                try:
-                    await futur
-                except Exception as e:
-                    logger.error('error on template warmup')
-                    logger.exception("details", e)
-
-    async def warmup_label_cache(self, max_threads: int, scheduler: JobScheduler) -> None:
+        for host_plan, module_plan in self._units(units):
+            for template_group_name, task in module_plan.templates:
+                futur = loop.create_task(self._update_template_label(host_plan, module_plan.name,
+                                                                     template_group_name, task))
+                futurs.append(futur)
+                self._add_job(scheduler, host_plan, module_plan, self._update_template_label, task.every,
+                              host_plan, module_plan.name, template_group_name, task)
+        for futur in asyncio.as_completed(futurs):
+            try:
+                await futur
+            except Exception as e:
+                logger.error('error on template warmup')
+                logger.exception("details", e)
+
+    async def warmup_label_cache(self, max_threads: int, scheduler: JobScheduler,
+                                 units: Optional[List[PollUnit]] = None) -> None:
         loop = asyncio.get_event_loop()
         futurs = []
-        for host_config in self._config.hosts:
-            for module_name, module_data in host_config.items():
-                for label_group_name, label_group_data in module_data.labels_group.items():
-                    for label_name, label_data in label_group_data.items():
-                        if label_data.type == 'join':
-                            continue
-                        futur = loop.create_task(self._update_label(host_config, module_name,
-                                                                    label_group_name, label_name, label_data))
-                        futurs.append(futur)
-                        scheduler.add_job(self._update_label, label_data.every, host_config, module_name,
-                                          label_group_name, label_name, label_data)
+        for host_plan, module_plan in self._units(units):
+            for label_group_name, label_name, task in module_plan.labels:
+                futur = loop.create_task(self._update_label(host_plan, module_plan.name,
+                                                            label_group_name, label_name, task))
+                futurs.append(futur)
+                self._add_job(scheduler, host_plan, module_plan, self._update_label, task.every,
+                              host_plan, module_plan.name, label_group_name, label_name, task)
         for futur in asyncio.as_completed(futurs):
             try:
                 await futur
@@ -440,32 +774,34 @@ class SNMPQuerier(object):
                 logger.error('error on template warmup')
                 logger.exception("details", e)
 
-    def warmup_join_cache(self) -> None:
-        for host_config in self._config.hosts:
-            for module_name, module_data in host_config.items():
-                for label_group_name, label_group_data in module_data.labels_group.items():
-                    key_elem = list(label_group_data.keys())
-                    left_label_group = key_elem[0]
-                    if label_group_data[left_label_group].type != 'join':
-                        continue
-                    left_join_key = label_group_data[left_label_group].oid
-                    right_label_group = key_elem[1]
+    def warmup_join_cache(self, units: Optional[List[PollUnit]] = None) -> None:
+        for host_plan, module_plan in self._units(units):
+            for label_group_name, left_label_group, right_label_group, left_join_key, right_join_key \
+                    in module_plan.joins:
+                self._storage.set_join(host_plan.hostname, module_plan.name, label_group_name,
+                                       left_label_group, right_label_group, left_join_key, right_join_key)
 
-                    right_join_key = label_group_data[right_label_group].oid
-                    self._storage.set_join(host_config.hostname,
-                                           module_name, label_group_name, left_label_group, right_label_group, left_join_key, right_join_key)
-
-    async def warmup_metrics(self, max_threads: int, scheduler: JobScheduler) -> None:
+    async def warmup_metrics(self, max_threads: int, scheduler: JobScheduler,
+                             units: Optional[List[PollUnit]] = None) -> None:
         loop = asyncio.get_event_loop()
         futurs = []
-        for host_config in self._config.hosts:
-            for module_name, module_data in host_config.items():
-                for metric in module_data.metrics:
-                    futur = loop.create_task(self._update_metric(
-                        host_config, module_name, metric))
+        for host_plan, module_plan in self._units(units):
+            tasks = list(module_plan.metrics)
+            if host_plan.batch_get():
+                for batch in module_plan.metric_batches:
+                    futur = loop.create_task(self._update_metric_batch(host_plan, module_plan.name, batch))
                     futurs.append(futur)
-                    scheduler.add_job(
-                        self._update_metric, metric.every, host_config, module_name, metric)
+                    self._add_job(scheduler, host_plan, module_plan, self._update_metric_batch, batch[0].every,
+                                  host_plan, module_plan.name, batch)
+            else:
+                for batch in module_plan.metric_batches:
+                    tasks += batch
+            for task in tasks:
+                futur = loop.create_task(self._update_metric(
+                    host_plan, module_plan.name, task))
+                futurs.append(futur)
+                self._add_job(scheduler, host_plan, module_plan, self._update_metric, task.every,
+                              host_plan, module_plan.name, task)
         for futur in asyncio.as_completed(futurs):
             try:
                 await futur
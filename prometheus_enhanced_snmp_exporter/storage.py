@@ -16,13 +16,59 @@
 import logging
 import yaml
 from threading import Lock
-from typing import Dict, List, Union
+from typing import Dict, List, Optional, Tuple, Union
+from .accounting import storage_size
 
 logger = logging.getLogger(__name__)
 
 
-class TemplateStorage(object):
-    def __init__(self):
+def _count_values(data) -> int:
+    if not isinstance(data, dict):
+        return 1
+    return sum(_count_values(value) for value in data.values())
+
+
+class StorageUsage(object):
+    '''
+        values and approximate bytes of each label group of each module of each host,
+        updated after each poll of a label of the group. Measuring walks the whole
+        group, so it's only done when usage is set
+    '''
+    def __init__(self, usage: bool = False):
+        self.usage_enabled = usage
+        # host -> (module, label group, label) -> (values, bytes)
+        self._usage = {}  # type: Dict[str, Dict[Tuple[str, str, Optional[str]], Tuple[int, int]]]
+
+    def _account(self, hostname: str, module: str, label_group: str, label_name: Optional[str], data) -> None:
+        if not self.usage_enabled:
+            return
+        self._usage.setdefault(hostname, {})[(module, label_group, label_name)] = \
+            (_count_values(data), storage_size(data))
+
+    def _forget_usage(self, hostname: str, module: Optional[str] = None) -> None:
+        if module is None:
+            self._usage.pop(hostname, None)
+            return
+        usage = self._usage.get(hostname, {})
+        for key in [key for key in list(usage) if key[0] == module]:
+            del usage[key]
+
+    def usage(self) -> List[Tuple[Tuple[str, str, str], int, int]]:
+        '''
+            (host, module, label group), values, bytes
+        '''
+        groups = {}  # type: Dict[Tuple[str, str, str], List[int]]
+        for hostname, usage in list(self._usage.items()):
+            for (module, label_group, _), (values, size) in list(usage.items()):
+                group = groups.setdefault((hostname, module, label_group), [0, 0])
+                group[0] += values
+                group[1] += size
+        return sorted((key, values, size) for key, (values, size) in groups.items())
+
+
+class TemplateStorage(StorageUsage):
+    def __init__(self, usage: bool = False):
+        StorageUsage.__init__(self, usage)
         self._labels = {} # type: Dict[str, Dict[str, Dict[str, Union[Dict, str]]]]
         self._lock_init = Lock()
 
@@ -74,12 +120,26 @@ class TemplateStorage(object):
         logger.debug('out : %s', out)
         return out
 
+    def account(self, hostname: str, module: str, label_group: str) -> None:
+        self._account(hostname, module, label_group, None,
+                      self._labels.get(hostname, {}).get(module, {}).get(label_group, {}))
+
+    def forget(self, hostname: str, module: Optional[str] = None) -> None:
+        # drop the labels of a host, or of a module of a host
+        with self._lock_init:
+            if module is None:
+                self._labels.pop(hostname, None)
+            else:
+                self._labels.get(hostname, {}).pop(module, None)
+            self._forget_usage(hostname, module)
+
     def dump(self):
         return yaml.dump(self._labels)
 
 
-class LabelStorage(object):
-    def __init__(self):
+class LabelStorage(StorageUsage):
+    def __init__(self, usage: bool = False):
+        StorageUsage.__init__(self, usage)
         self._labels = {} # type: Dict[str, Dict[str, Dict[str, Dict[str, Dict[str, Union[Dict, str]]]]]]
         self._join = {} # type: Dict[str, Dict[str, Dict[str, Dict[str, str]]]]
         self._lock_init = Lock()
@@ -241,5 +301,20 @@ class LabelStorage(object):
             for item_to_delete in stored_key - candidate_key:
                 del labels_storage[item_to_delete]
 
+    def account(self, hostname: str, module: str, label_group: str, label_name: str) -> None:
+        self._account(hostname, module, label_group, label_name,
+                      self._labels.get(hostname, {}).get(module, {}).get(label_group, {}).get(label_name, {}))
+
+    def forget(self, hostname: str, module: Optional[str] = None) -> None:
+        # drop the labels and joins of a host, or of a module of a host
+        with self._lock_init:
+            if module is None:
+                self._labels.pop(hostname, None)
+                self._join.pop(hostname, None)
+            else:
+                self._labels.get(hostname, {}).pop(module, None)
+                self._join.get(hostname, {}).pop(module, None)
+            self._forget_usage(hostname, module)
+
     def dump(self):
         return yaml.dump(self._labels)
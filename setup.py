@@ -40,12 +40,14 @@ setup(
     ],
     python_requires='>=3.5',
     install_requires=[
-        "pyramid >= 1.5",
         "pysnmp >= 4.2",
         "APScheduler >= 3.5",
-        "PyYAML >= 3.11",
-        "influxdb >= 5.0.2"
+        "PyYAML >= 3.11"
     ],
+    extras_require={
+        "snappy": ["python-snappy"],
+        "zstd": ["zstandard"],
+    },
     data_files=[
       ('/etc/prometheus-enhanced-snmp-exporter/', ['config/config.yaml']),
       ('/etc/default/', ['config/prometheus-enhanced-snmp-exporter']),
@@ -0,0 +1,55 @@
+# This file is part of prometheus-enhanced-snmp-exporte.
+#
+# prometheus-enhanced-snmp-exporte is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# prometheus-enhanced-snmp-exporte is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with prometheus-enhanced-snmp-exporte. If not, see <https://www.gnu.org/licenses/>.
+
+import pytest
+
+from prometheus_enhanced_snmp_exporter import storage
+from prometheus_enhanced_snmp_exporter.accounting import SeriesAccounting, SeriesLimit
+from prometheus_enhanced_snmp_exporter.storage import TemplateStorage
+
+
+def test_series_limit():
+    limit = SeriesLimit(2)
+    assert [limit.admit() for i in range(3)] == [True, True, False]
+    assert limit.full()
+    limit.drop()
+    assert (limit.series, limit.dropped) == (2, 2)
+    accounting = SeriesAccounting()
+    accounting.record('h1', 'interfaces', 'ifInOctets', limit)
+    assert accounting.tables() == [(('h1', 'interfaces', 'ifInOctets'), 2, True, 2, True)]
+
+
+def test_unlimited_series():
+    limit = SeriesLimit(0)
+    assert all(limit.admit() for i in range(1000))
+    assert not limit.full()
+    assert limit.dropped == 0
+
+
+@pytest.mark.parametrize('usage', [False, True])
+def test_storage_usage_is_measured_when_enabled(monkeypatch, usage):
+    walks = []
+
+    def storage_size(data):
+        walks.append(data)
+        return 100
+
+    monkeypatch.setattr(storage, 'storage_size', storage_size)
+    templates = TemplateStorage(usage)
+    for index, vlan in enumerate(['10', '20']):
+        templates.set_label('h1', 'vlans', 'vlan', vlan, str(index))
+    templates.account('h1', 'vlans', 'vlan')
+    assert len(walks) == (1 if usage else 0)
+    assert templates.usage() == ([(('h1', 'vlans', 'vlan'), 2, 100)] if usage else [])
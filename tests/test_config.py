@@ -0,0 +1,44 @@
+# This file is part of prometheus-enhanced-snmp-exporte.
+#
+# prometheus-enhanced-snmp-exporte is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# prometheus-enhanced-snmp-exporte is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with prometheus-enhanced-snmp-exporte. If not, see <https://www.gnu.org/licenses/>.
+
+import pytest
+
+from prometheus_enhanced_snmp_exporter.config import BadConfigurationException, DriverConfiguration
+
+
+def test_remote_write_defaults():
+    # values are strings, the configuration is read with the yaml base loader
+    config = DriverConfiguration({'name': 'remote_write', 'config': {'url': 'http://prometheus/api/v1/write',
+                                                                     'timeout': '5s'}}).config
+    assert (config.shards, config.batch_size, config.queue_size) == (4, 500, 100000)
+    assert config.timeout == 5
+
+
+@pytest.mark.parametrize('option', ['shards', 'batch_size', 'queue_size'])
+@pytest.mark.parametrize('value', ['0', '-1', 'many'])
+def test_remote_write_rejects_bad_sizes(option, value):
+    with pytest.raises(BadConfigurationException):
+        DriverConfiguration({'name': 'remote_write', 'config': {'url': 'http://prometheus/api/v1/write',
+                                                                option: value}})
+
+
+def test_remote_write_requires_url():
+    with pytest.raises(BadConfigurationException):
+        DriverConfiguration({'name': 'remote_write', 'config': {}})
+
+
+@pytest.mark.parametrize('config, usage_metrics', [({}, False), ({'usage_metrics': 'true'}, True)])
+def test_prometheus_usage_metrics(config, usage_metrics):
+    assert DriverConfiguration({'name': 'prometheus', 'config': config}).config.usage_metrics is usage_metrics
@@ -0,0 +1,79 @@
+# This file is part of prometheus-enhanced-snmp-exporte.
+#
+# prometheus-enhanced-snmp-exporte is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# prometheus-enhanced-snmp-exporte is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with prometheus-enhanced-snmp-exporte. If not, see <https://www.gnu.org/licenses/>.
+
+import pytest
+
+from prometheus_enhanced_snmp_exporter import driver
+from prometheus_enhanced_snmp_exporter.driver import FINGERPRINT_MASK, LabelSetIndex, label_to_str
+
+
+@pytest.fixture
+def colliding(monkeypatch):
+    # every label set on the same fingerprint, the last one to wrap around
+    monkeypatch.setattr(driver, 'hash', lambda value: FINGERPRINT_MASK, raising=False)
+
+
+def test_label_to_str():
+    assert label_to_str({'b': '2', 'a': 'x"y\\z\n'}) == 'a="x\\"y\\\\z\\n",b="2"'
+    assert label_to_str({}) == ''
+
+
+def test_fingerprint_is_stable():
+    index = LabelSetIndex()
+    fingerprint = index.fingerprint({'host': 'h1', 'port': '1'})
+    assert index.fingerprint({'port': '1', 'host': 'h1'}) == fingerprint
+    assert index.fingerprint({'host': 'h1', 'port': '2'}) != fingerprint
+    assert 0 <= fingerprint <= FINGERPRINT_MASK
+    assert len(index) == 2
+    assert index.labels(fingerprint) == (('host', 'h1'), ('port', '1'))
+
+
+def test_label_str_rendered_once():
+    index = LabelSetIndex()
+    fingerprint = index.fingerprint({'host': 'h1', 'port': '1'})
+    assert index.label_bytes == 0
+    assert index.label_str(fingerprint) == 'host="h1",port="1"'
+    assert index.label_str(fingerprint) is index.label_str(fingerprint)
+    assert index.label_bytes == len('host="h1",port="1"')
+
+
+def test_collisions_are_probed(colliding):
+    index = LabelSetIndex()
+    first = index.fingerprint({'port': '1'})
+    second = index.fingerprint({'port': '2'})
+    third = index.fingerprint({'port': '3'})
+    assert first == FINGERPRINT_MASK
+    assert (second, third) == (0, 1)
+    assert [index.fingerprint({'port': port}) for port in '123'] == [first, second, third]
+    assert [index.label_str(fingerprint) for fingerprint in (first, second, third)] == \
+        ['port="1"', 'port="2"', 'port="3"']
+
+
+def test_retain(colliding):
+    index = LabelSetIndex()
+    fingerprints = [index.fingerprint({'port': str(port)}) for port in range(3)]
+    for fingerprint in fingerprints:
+        index.label_str(fingerprint)
+    index.retain({fingerprints[1], fingerprints[2]})
+    assert len(index) == 2
+    assert index.label_bytes == 2 * len('port="1"')
+    # probed label sets keep their fingerprint once the one before them is forgotten
+    assert index.fingerprint({'port': '2'}) == fingerprints[2]
+    assert index.fingerprint({'port': '1'}) == fingerprints[1]
+    assert len(index) == 2
+    index.retain(set())
+    assert len(index) == 0
+    assert index.label_bytes == 0
+    assert index.fingerprint({'port': '2'}) == FINGERPRINT_MASK
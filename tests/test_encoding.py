@@ -0,0 +1,85 @@
+# This file is part of prometheus-enhanced-snmp-exporte.
+#
+# prometheus-enhanced-snmp-exporte is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# prometheus-enhanced-snmp-exporte is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with prometheus-enhanced-snmp-exporte. If not, see <https://www.gnu.org/licenses/>.
+
+import gzip
+import zlib
+
+import pytest
+
+from prometheus_enhanced_snmp_exporter.encoding import CompressionStats, GzipStream, STREAMS, negotiate_encoding
+
+
+def gzip_stream(blocks):
+    stream = GzipStream()
+    out = [stream.start()]
+    for block in blocks:
+        out.append(stream.add(block, GzipStream.compress_block(block)))
+    out.append(stream.finish())
+    return b''.join(out)
+
+
+def test_gzip_segments_concatenate_into_one_stream():
+    blocks = [b'# TYPE a gauge\n', b'a{host="h1"} 1\n' * 1000, b'', b'a{host="h2"} 2\n']
+    assert gzip.decompress(gzip_stream(blocks)) == b''.join(blocks)
+
+
+def test_gzip_segment_reused_in_another_stream():
+    # cached segments are shared by scrapes selecting different blocks
+    shared = b'b{host="h1"} 3\n' * 100
+    assert gzip.decompress(gzip_stream([shared])) == shared
+    assert gzip.decompress(gzip_stream([b'first\n', shared, b'last\n'])) == b'first\n' + shared + b'last\n'
+
+
+def test_empty_gzip_stream():
+    assert gzip.decompress(gzip_stream([])) == b''
+
+
+def test_gzip_trailer_checks_crc_and_size():
+    data = b'c{host="h1"} 4\n' * 10
+    payload = gzip_stream([data])
+    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    assert decompressor.decompress(payload) == data
+    assert decompressor.eof
+
+
+def test_zstd_frames_concatenate():
+    zstandard = pytest.importorskip('zstandard')
+    stream = STREAMS['zstd']()
+    blocks = [b'x 1\n', b'y 2\n' * 100]
+    payload = stream.start() + b''.join(stream.add(block, stream.compress_block(block)) for block in blocks) + \
+        stream.finish()
+    reader = zstandard.ZstdDecompressor().stream_reader(payload, read_across_frames=True)
+    assert reader.read() == b''.join(blocks)
+
+
+def test_compression_stats():
+    stats = CompressionStats()
+    data = b'd 5\n' * 100
+    stats.compress('gzip', data)
+    assert stats.input_bytes['gzip'] == len(data)
+    assert 0 < stats.output_bytes['gzip'] < len(data)
+
+
+@pytest.mark.parametrize('accept_encoding, expected', [
+    (None, None),
+    ('', None),
+    ('identity', None),
+    ('gzip', 'gzip'),
+    ('gzip;q=0', None),
+    ('deflate, gzip;q=0.5', 'gzip'),
+    ('*', 'zstd' if 'zstd' in STREAMS else 'gzip'),
+])
+def test_negotiate_encoding(accept_encoding, expected):
+    assert negotiate_encoding(accept_encoding) == expected
@@ -0,0 +1,235 @@
+# This file is part of prometheus-enhanced-snmp-exporte.
+#
+# prometheus-enhanced-snmp-exporte is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# prometheus-enhanced-snmp-exporte is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with prometheus-enhanced-snmp-exporte. If not, see <https://www.gnu.org/licenses/>.
+
+import gzip
+import struct
+
+import pytest
+
+from prometheus_enhanced_snmp_exporter.exposition import OpenMetricsFormat, ProtobufFormat, TextFormat, \
+    negotiate_format
+from prometheus_enhanced_snmp_exporter.prometheus import PrometheusMetricStorage
+from prometheus_enhanced_snmp_exporter.protobuf import encode_varint, field_bytes, field_double, field_string, \
+    field_varint
+from prometheus_enhanced_snmp_exporter.storage import LabelStorage, TemplateStorage
+
+
+def read_varint(data, position):
+    value = 0
+    shift = 0
+    while True:
+        byte = data[position]
+        position += 1
+        value |= (byte & 0x7f) << shift
+        shift += 7
+        if not byte & 0x80:
+            return value, position
+
+
+def read_fields(message):
+    '''
+        fields of a protobuf message, as a list of (field number, value)
+    '''
+    fields = []
+    position = 0
+    while position < len(message):
+        key, position = read_varint(message, position)
+        field, wire_type = key >> 3, key & 7
+        if wire_type == 0:
+            value, position = read_varint(message, position)
+        elif wire_type == 1:
+            value = struct.unpack('<d', message[position:position + 8])[0]
+            position += 8
+        elif wire_type == 2:
+            size, position = read_varint(message, position)
+            value = message[position:position + size]
+            position += size
+        else:
+            raise ValueError('unexpected wire type {}'.format(wire_type))
+        fields.append((field, value))
+    return fields
+
+
+def read_delimited(data):
+    messages = []
+    position = 0
+    while position < len(data):
+        size, position = read_varint(data, position)
+        messages.append(data[position:position + size])
+        position += size
+    assert position == len(data)
+    return messages
+
+
+def decode_families(data):
+    '''
+        MetricFamily messages as (name, type, [(labels, value, timestamp)])
+    '''
+    families = []
+    for message in read_delimited(data):
+        fields = read_fields(message)
+        name = [value.decode() for field, value in fields if field == 1][0]
+        metric_type = [value for field, value in fields if field == 3][0]
+        metrics = []
+        for field, metric in fields:
+            if field != 4:
+                continue
+            labels = {}
+            value = None
+            timestamp = None
+            for metric_field, metric_value in read_fields(metric):
+                if metric_field == 1:
+                    pair = dict(read_fields(metric_value))
+                    labels[pair[1].decode()] = pair[2].decode()
+                elif metric_field in (2, 3, 5):
+                    value = dict(read_fields(metric_value))[1]
+                elif metric_field == 6:
+                    timestamp = metric_value
+            metrics.append((labels, value, timestamp))
+        families.append((name, metric_type, metrics))
+    return families
+
+
+@pytest.mark.parametrize('value', [0, 1, 127, 128, 300, 2 ** 32, 2 ** 63 - 1])
+def test_varint_round_trip(value):
+    assert read_varint(encode_varint(value), 0) == (value, len(encode_varint(value)))
+
+
+def test_negative_varint_is_ten_bytes():
+    encoded = encode_varint(-1)
+    assert len(encoded) == 10
+    assert read_varint(encoded, 0)[0] == 2 ** 64 - 1
+
+
+def test_fields():
+    assert field_varint(3, 1) == b'\x18\x01'
+    assert field_string(1, 'ab') == b'\x0a\x02ab'
+    assert field_double(1, 1.5) == b'\x09' + struct.pack('<d', 1.5)
+    assert read_fields(field_bytes(4, field_string(1, 'x')) + field_varint(6, 1000)) == \
+        [(4, b'\x0a\x01x'), (6, 1000)]
+
+
+def storage_with_hosts(hostnames, timestamps=False, usage_metrics=False):
+    metrics = PrometheusMetricStorage(':0', '/metrics', LabelStorage(), TemplateStorage(), timestamps,
+                                      usage_metrics=usage_metrics)
+    metrics.add_metric('ifInOctets', 'counter', 'octets in')
+    metrics.add_metric('sysUpTime', 'gauge', 'uptime')
+    metrics.add_metric('ifEmpty', 'gauge', 'never polled')
+    for position, hostname in enumerate(hostnames):
+        metrics.clear(hostname, 'ifInOctets')
+        for port in range(3):
+            metrics.update_metric(hostname, 'ifInOctets', {'host': hostname, 'port': str(port)}, str(port * 10))
+        metrics.release_update_lock(hostname, 'ifInOctets')
+        metrics.clear(hostname, 'sysUpTime')
+        metrics.update_metric(hostname, 'sysUpTime', {'host': hostname}, str(position))
+        metrics.release_update_lock(hostname, 'sysUpTime')
+    return metrics
+
+
+def test_protobuf_one_family_per_metric():
+    metrics = storage_with_hosts(['h1', 'h2', 'h3'])
+    families = decode_families(b''.join(metrics.metric_chunks(ProtobufFormat, with_self_metrics=False)))
+    assert [name for name, _, _ in families] == ['ifInOctets', 'sysUpTime']
+    name, metric_type, series = families[0]
+    assert metric_type == 0
+    assert len(series) == 9
+    assert ({'host': 'h2', 'port': '1'}, 10.0, None) in series
+    assert families[1][1] == 1
+    assert sorted(labels['host'] for labels, _, _ in families[1][2]) == ['h1', 'h2', 'h3']
+
+
+def test_protobuf_family_of_selected_targets():
+    metrics = storage_with_hosts(['h1', 'h2', 'h3'])
+    families = decode_families(b''.join(metrics.metric_chunks(ProtobufFormat, targets=['h3', 'h1'],
+                                                              with_self_metrics=False)))
+    assert [name for name, _, _ in families] == ['ifInOctets', 'sysUpTime']
+    assert sorted(labels['host'] for labels, _, _ in families[1][2]) == ['h1', 'h3']
+
+
+def test_protobuf_self_metrics_and_compression():
+    metrics = storage_with_hosts(['h1', 'h2'])
+    # a first compressed scrape, the next one reuse the cached segments
+    b''.join(metrics.metric_chunks(ProtobufFormat, 'gzip'))
+    data = gzip.decompress(b''.join(metrics.metric_chunks(ProtobufFormat, 'gzip')))
+    names = [name for name, _, _ in decode_families(data)]
+    assert names[:2] == ['ifInOctets', 'sysUpTime']
+    assert len(names) == len(set(names))
+    assert 'enhanced_snmp_exporter_compression_input_bytes_total' in names
+
+
+@pytest.mark.parametrize('usage_metrics', [False, True])
+def test_usage_metrics(usage_metrics):
+    metrics = storage_with_hosts(['h1'], usage_metrics=usage_metrics)
+    names = [name for name, _, _, _ in metrics.self_metrics()]
+    assert ('enhanced_snmp_exporter_series_bytes' in names) is usage_metrics
+
+
+def test_protobuf_timestamps():
+    metrics = storage_with_hosts(['h1'], timestamps=True)
+    _, _, series = decode_families(metrics._metrics['sysUpTime'].metric_print(ProtobufFormat))[0]
+    assert series[0][2] > 0
+
+
+def test_text_exposition():
+    metrics = storage_with_hosts(['h1', 'h2'])
+    text = b''.join(metrics.metric_chunks(TextFormat, with_self_metrics=False)).decode()
+    assert text.count('# TYPE ifInOctets counter\n') == 1
+    assert 'ifInOctets{host="h2",port="2"} 20\n' in text
+    assert '# TYPE ifEmpty gauge\n' in text
+
+
+def test_openmetrics_exposition():
+    metrics = storage_with_hosts(['h1'])
+    text = b''.join(metrics.metric_chunks(OpenMetricsFormat)).decode()
+    assert text.endswith('# EOF\n')
+    # counters without _total suffix keep their name as unknown
+    assert '# TYPE ifInOctets unknown\n' in text
+
+
+class Request(object):
+    def __init__(self, query):
+        self.headers = {}
+        self.query = query
+
+
+@pytest.mark.parametrize('query, expected', [
+    ({}, ['ifInOctets', 'sysUpTime', 'ifEmpty']),
+    ({'module': ['if_mib']}, ['ifInOctets', 'ifEmpty']),
+    ({'module': ['if_mib,system']}, ['ifInOctets', 'sysUpTime', 'ifEmpty']),
+    ({'metric': ['sysUpTime', 'ifInOctets']}, ['ifInOctets', 'sysUpTime']),
+    # different selectors narrow each other
+    ({'module': ['if_mib'], 'metric': ['sysUpTime,ifInOctets']}, ['ifInOctets']),
+    ({'module': ['system'], 'metric': ['ifInOctets']}, []),
+    ({'target': ['h2'], 'module': ['system']}, ['sysUpTime']),
+])
+def test_selectors(query, expected):
+    metrics = storage_with_hosts(['h1', 'h2'])
+    metrics.add_module('if_mib', ['ifInOctets', 'ifEmpty'])
+    metrics.add_module('system', ['sysUpTime'])
+    text = b''.join(metrics._print_metrics_http(Request(query)).body).decode()
+    names = [line.split()[2] for line in text.splitlines() if line.startswith('# TYPE ')]
+    assert [name for name in names if not name.startswith('enhanced_snmp_exporter_')] == expected
+
+
+@pytest.mark.parametrize('accept, expected', [
+    (None, TextFormat),
+    ('text/plain;version=0.0.4', TextFormat),
+    ('application/openmetrics-text;version=1.0.0,text/plain;q=0.5', OpenMetricsFormat),
+    ('application/vnd.google.protobuf;proto=io.prometheus.client.MetricFamily;encoding=delimited;q=0.7,'
+     'text/plain;version=0.0.4;q=0.3', ProtobufFormat),
+    ('application/vnd.google.protobuf;proto=other', TextFormat),
+])
+def test_negotiate_format(accept, expected):
+    assert negotiate_format(accept) is expected
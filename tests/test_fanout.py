@@ -0,0 +1,94 @@
+# This file is part of prometheus-enhanced-snmp-exporte.
+#
+# prometheus-enhanced-snmp-exporte is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# prometheus-enhanced-snmp-exporte is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with prometheus-enhanced-snmp-exporte. If not, see <https://www.gnu.org/licenses/>.
+
+import threading
+import time
+
+from prometheus_enhanced_snmp_exporter.driver import OutputDriver
+from prometheus_enhanced_snmp_exporter.fanout import FanOutDriver
+from prometheus_enhanced_snmp_exporter.prometheus import PrometheusMetricStorage
+from prometheus_enhanced_snmp_exporter.storage import LabelStorage, TemplateStorage
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+
+def poll(fanout, hostname, samples):
+    fanout.clear(hostname, 'ifInOctets')
+    for port, value in samples:
+        fanout.update_metric(hostname, 'ifInOctets', {'host': hostname, 'port': port}, value)
+    fanout.release_update_lock(hostname, 'ifInOctets')
+
+
+def test_failed_update_keeps_the_previous_poll(monkeypatch):
+    metrics = PrometheusMetricStorage(':0', '/metrics', LabelStorage(), TemplateStorage(), False)
+    fanout = FanOutDriver([('prometheus', metrics, 10)])
+    fanout.add_metric('ifInOctets', 'counter', 'octets in')
+    poll(fanout, 'h1', [('1', '10'), ('2', '20')])
+    wait_for(lambda: b'h1' in metrics.metric_print())
+    exposed = metrics.metric_print()
+
+    update_metric = metrics.update_metric
+
+    def failing_update(hostname, metric_name, labels, value):
+        if hostname == 'h1':
+            raise ValueError(value)
+        update_metric(hostname, metric_name, labels, value)
+
+    monkeypatch.setattr(metrics, 'update_metric', failing_update)
+    poll(fanout, 'h1', [('1', '11'), ('2', '21')])
+    # polls are applied in order, h1 is done once h2 is exposed
+    poll(fanout, 'h2', [('1', '30')])
+    wait_for(lambda: b'h2' in metrics.metric_print())
+    assert metrics.metric_print().replace(
+        b'ifInOctets{host="h2",port="1"} 30\n', b'') == exposed
+
+
+class BlockedDriver(OutputDriver):
+    def __init__(self):
+        self.running = threading.Event()
+        self.unblock = threading.Event()
+        self.forgotten = []
+
+    def clear(self, hostname, metric_name):
+        self.running.set()
+        self.unblock.wait()
+
+    def update_metric(self, hostname, metric_name, labels, value):
+        pass
+
+    def release_update_lock(self, hostname, metric_name):
+        pass
+
+    def forget(self, hostname, metric_name):
+        self.forgotten.append(hostname)
+
+
+def test_forget_does_not_block_on_a_late_driver():
+    driver = BlockedDriver()
+    fanout = FanOutDriver([('late', driver, 1)])
+    poll(fanout, 'h1', [])
+    driver.running.wait(5)
+    poll(fanout, 'h2', [])
+    fanout.forget('h3', 'ifInOctets')
+    assert fanout._workers[0].dropped == 1
+    driver.unblock.set()
+    wait_for(fanout._workers[0].queue.empty)
+    fanout.forget('h4', 'ifInOctets')
+    wait_for(lambda: driver.forgotten == ['h4'])
@@ -0,0 +1,375 @@
+# This file is part of prometheus-enhanced-snmp-exporte.
+#
+# prometheus-enhanced-snmp-exporte is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# prometheus-enhanced-snmp-exporte is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with prometheus-enhanced-snmp-exporte. If not, see <https://www.gnu.org/licenses/>.
+
+import asyncio
+import gzip
+import threading
+from socketserver import ThreadingMixIn
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+import pytest
+
+pytest.importorskip('apscheduler')
+
+from prometheus_enhanced_snmp_exporter import influxdb  # noqa: E402
+from prometheus_enhanced_snmp_exporter.influxdb import InfluxDBDriver, InfluxDBMeasurement, InfluxDBSpool, \
+    InfluxDBWriter, WRITE_FAILED, WRITE_OK, WRITE_REJECTED, line_series_key  # noqa: E402
+
+
+@pytest.fixture
+def loop():
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    yield loop
+    loop.close()
+    asyncio.set_event_loop(None)
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    '''
+        time of the points, in seconds
+    '''
+    now = [1000.0]
+    monkeypatch.setattr(influxdb.time, 'time', lambda: now[0])
+    return now
+
+
+def lines(measurement):
+    return [line for payload, _ in measurement.push_to_influx() for line in payload.decode().splitlines()]
+
+
+def test_line_series_key_escaping():
+    assert line_series_key('if stats,v2', {'port name': 'Gi0/1, uplink', 'a=b': 'x=y', 'empty': ''}) == \
+        'if\\ stats\\,v2,a\\=b=x\\=y,port\\ name=Gi0/1\\,\\ uplink'
+
+
+def test_line_protocol(clock):
+    measurement = InfluxDBMeasurement('interface', batch_size=100)
+    measurement.add_metric('in octets')
+    measurement.add_metric('out')
+    measurement.update('h1', {'host': 'h1', 'port': '1'}, 'in octets', '10')
+    measurement.update('h1', {'host': 'h1', 'port': '1'}, 'out', '2.5')
+    assert lines(measurement) == ['interface,host=h1,port=1 in\\ octets=10.0,out=2.5 1000000']
+    assert lines(measurement) == []
+
+
+def test_batches(clock):
+    measurement = InfluxDBMeasurement('interface', batch_size=2)
+    measurement.add_metric('in')
+    for port in range(5):
+        measurement.update('h1', {'port': str(port)}, 'in', str(port))
+    batches = measurement.push_to_influx()
+    assert [points for _, points in batches] == [2, 2, 1]
+    assert batches[2][0] == b'interface,port=4 in=4.0 1000000\n'
+
+
+class InfluxHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        self.server.requests.append((self.path, dict(self.headers), body))
+        status = self.server.statuses.pop(0) if self.server.statuses else 204
+        self.send_response(status)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+
+class InfluxServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+@pytest.fixture
+def server():
+    server = InfluxServer(('127.0.0.1', 0), InfluxHandler)
+    server.requests = []
+    server.statuses = []
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def test_writer(server):
+    writer = InfluxDBWriter('127.0.0.1', server.server_port, 'snmp', 'user', 'secret', concurrency=2)
+    server.statuses = [204, 400, 503]
+    payload = b'interface,port=1 in=1.0 1000000\n'
+    assert [writer.write(payload, 1) for _ in range(3)] == [WRITE_OK, WRITE_REJECTED, WRITE_FAILED]
+    path, headers, body = server.requests[0]
+    assert path == '/write?db=snmp&precision=ms'
+    assert headers['Content-Encoding'] == 'gzip'
+    assert headers['Authorization'] == 'Basic dXNlcjpzZWNyZXQ='
+    assert gzip.decompress(body) == payload
+    assert writer.write_many([(payload, 1), (payload, 1)]) == [WRITE_OK, WRITE_OK]
+
+
+def test_writer_unavailable():
+    writer = InfluxDBWriter('127.0.0.1', 1, 'snmp', None, None, compress=False, timeout=1)
+    assert writer.write(b'interface in=1.0\n', 1) == WRITE_FAILED
+
+
+class FakeWriter(object):
+    '''
+        record the points written, every write fails while down is set
+    '''
+    def __init__(self):
+        self.down = False
+        self.rejected = set()
+        self.written = []
+
+    def write_many(self, batches):
+        if self.down:
+            return [WRITE_FAILED] * len(batches)
+        results = []
+        for payload, points in batches:
+            if payload in self.rejected:
+                results.append(WRITE_REJECTED)
+            else:
+                self.written.append(payload)
+                results.append(WRITE_OK)
+        return results
+
+    def points(self):
+        # without the stats line of each push
+        return [payload for payload in self.written if not payload.startswith(b'enhanced_snmp_exporter_influxdb ')]
+
+
+def driver_with_writer(**kwargs):
+    driver = InfluxDBDriver(None, 'localhost', 'snmp', None, None, concurrency=1, **kwargs)
+    driver._writer = FakeWriter()
+    return driver
+
+
+def test_spooled_points_replay_in_order(tmp_path):
+    driver = driver_with_writer(buffer_points=3, spool_dir=str(tmp_path))
+    driver._writer.down = True
+    # 2 points and the stats line fill the buffer, the next ones go to the spool
+    assert driver._push_entry([(b'a\n', 2)])
+    assert driver._push_entry([(b'b\n', 2)])
+    assert driver._queued_points == 3
+    assert driver._spool.pending_points == 3
+    driver._writer.down = False
+    assert not driver._push_entry([(b'c\n', 1)])
+    assert driver._writer.points() == [b'a\n', b'b\n', b'c\n']
+    assert driver._queued_points == 0
+    assert driver._spool.pending_points == 0
+    assert not list(tmp_path.glob('*.spool'))
+
+
+def test_points_are_dropped_without_spool():
+    driver = driver_with_writer(buffer_points=3)
+    driver._writer.down = True
+    driver._push_entry([(b'a\n', 2)])
+    driver._push_entry([(b'b\n', 2)])
+    assert driver._dropped_points == 3
+    driver._writer.down = False
+    assert not driver._push_entry([])
+    assert driver._writer.points() == [b'a\n']
+
+
+def test_rejected_points_are_not_retried():
+    driver = driver_with_writer()
+    driver._writer.rejected.add(b'bad\n')
+    assert not driver._push_entry([(b'bad\n', 2), (b'good\n', 1)])
+    assert driver._writer.points() == [b'good\n']
+    assert driver._rejected_points == 2
+
+
+def test_spool_position_survives_restart(tmp_path):
+    spool = InfluxDBSpool(str(tmp_path), 1024)
+    for i in range(3):
+        assert spool.append('{}\n'.format(i).encode(), i + 1)
+    batches, position = spool.read(1)
+    assert batches == [(b'0\n', 1)]
+    spool.commit(batches, position)
+    spool = InfluxDBSpool(str(tmp_path), 1024)
+    assert spool.pending_points == 5
+    batches, position = spool.read(5)
+    assert batches == [(b'1\n', 2), (b'2\n', 3)]
+    spool.commit(batches, position)
+    assert spool.pending_points == 0
+    assert spool.size == 0
+
+
+def test_spool_max_size(tmp_path):
+    spool = InfluxDBSpool(str(tmp_path), 10)
+    assert spool.append(b'0123\n', 1)
+    assert not spool.append(b'0123\n', 1)
+    assert spool.pending_points == 1
+
+
+def poll(driver, port):
+    driver.update_metric('h1', 'in', {'port': str(port)}, '1')
+    driver.release_update_lock('h1', 'in')
+
+
+def test_flush_thresholds(loop, clock):
+    driver = driver_with_writer(flush_points=2, flush_interval=0.2)
+    driver.add_metric('in', 'interface', 'in')
+
+    async def scenario():
+        driver.start_serving()
+        await asyncio.sleep(0.05)
+        # below the threshold, the point waits for the timer
+        poll(driver, 1)
+        await asyncio.sleep(0.05)
+        assert driver._writer.points() == []
+        # the threshold is reached, flushed right away
+        poll(driver, 2)
+        await asyncio.sleep(0.05)
+        assert driver._writer.points() == [b'interface,port=1 in=1.0 1000000\ninterface,port=2 in=1.0 1000000\n']
+        # a single point is flushed by the timer
+        poll(driver, 3)
+        await asyncio.sleep(0.05)
+        assert len(driver._writer.points()) == 1
+        await asyncio.sleep(0.25)
+        assert driver._writer.points()[1:] == [b'interface,port=3 in=1.0 1000000\n']
+
+    loop.run_until_complete(scenario())
+
+
+def test_flush_bytes_threshold(loop, clock):
+    driver = driver_with_writer(flush_bytes=90, flush_interval=10)
+    driver.add_metric('in', 'interface', 'in')
+
+    async def scenario():
+        driver.start_serving()
+        await asyncio.sleep(0.05)
+        # each point is 32 bytes
+        for port in range(2):
+            poll(driver, port)
+        await asyncio.sleep(0.05)
+        assert driver._writer.points() == []
+        poll(driver, 2)
+        await asyncio.sleep(0.05)
+        assert len(driver._writer.points()) == 1
+
+    loop.run_until_complete(scenario())
+
+
+def test_point_written_once_the_row_is_complete(clock):
+    measurement = InfluxDBMeasurement('interface')
+    for field in ('in', 'out', 'errors'):
+        measurement.add_metric(field)
+    labels = {'port': '1'}
+    assert measurement.update('h1', labels, 'out', '2') == 0
+    assert measurement.update('h1', labels, 'in', '1') == 0
+    assert lines(measurement) == []
+    clock[0] += 1
+    assert measurement.update('h1', labels, 'errors', '0') > 0
+    # timestamped by the first field of the point
+    assert lines(measurement) == ['interface,port=1 in=1.0,out=2.0,errors=0.0 1000000']
+    # the next point needs every field again
+    measurement.update('h1', labels, 'in', '3')
+    measurement.update('h1', labels, 'in', '4')
+    assert lines(measurement) == []
+    measurement.update('h1', labels, 'out', '5')
+    measurement.update('h1', labels, 'errors', '6')
+    assert lines(measurement) == ['interface,port=1 in=4.0,out=5.0,errors=6.0 1001000']
+
+
+def test_nan_fields_are_omitted(clock):
+    measurement = InfluxDBMeasurement('interface')
+    measurement.add_metric('in')
+    measurement.add_metric('out')
+    measurement.update('h1', {'port': '1'}, 'in', 'nan')
+    measurement.update('h1', {'port': '1'}, 'out', '2')
+    measurement.update('h1', {'port': '2'}, 'in', 'nan')
+    measurement.update('h1', {'port': '2'}, 'out', 'inf')
+    assert lines(measurement) == ['interface,port=1 out=2.0 1000000']
+
+
+def test_rows_by_host(clock):
+    measurement = InfluxDBMeasurement('interface')
+    measurement.add_metric('in')
+    measurement.add_metric('out')
+    measurement.update('h1', {'port': '1'}, 'in', '1')
+    measurement.update('h2', {'port': '1'}, 'out', '2')
+    assert lines(measurement) == []
+    measurement.forget('h1')
+    measurement.update('h1', {'port': '1'}, 'out', '3')
+    measurement.update('h2', {'port': '1'}, 'in', '4')
+    assert lines(measurement) == ['interface,port=1 in=4.0,out=2.0 1000000']
+    with pytest.raises(ValueError):
+        measurement.update('h1', {'port': '1'}, 'unknown', '1')
+
+
+def test_unchanged_values_are_suppressed_until_the_heartbeat(clock):
+    measurement = InfluxDBMeasurement('interface', heartbeat=60)
+    measurement.add_metric('in')
+    measurement.add_metric('out')
+
+    def update(in_value, out_value):
+        clock[0] += 10
+        measurement.update('h1', {'port': '1'}, 'in', in_value)
+        measurement.update('h1', {'port': '1'}, 'out', out_value)
+        return lines(measurement)
+
+    assert update('1', '2') == ['interface,port=1 in=1.0,out=2.0 1010000']
+    assert update('1', '2') == []
+    assert update('3', '2') == ['interface,port=1 in=3.0 1030000']
+    for i in range(3):
+        assert update('3', '2') == []
+    # the last full point is 60s old
+    assert update('3', '2') == ['interface,port=1 in=3.0,out=2.0 1070000']
+    assert update('3', '2') == []
+
+
+def test_driver_dedup(clock):
+    driver = driver_with_writer(dedup=True, heartbeat=60)
+    driver.add_metric('in', 'interface', 'in')
+    assert driver._storage['interface']._heartbeat == 60000
+    assert driver_with_writer(heartbeat=60)._heartbeat is None
+
+
+def flush(driver):
+    return [line for payload, _ in sum((store.push_to_influx() for store in driver._retired +
+                                        list(driver._storage.values())), [])
+            for line in payload.decode().splitlines()]
+
+
+def test_reload_adds_and_removes_fields(clock):
+    driver = driver_with_writer()
+    driver.add_metric('ifIn', 'interface', 'in')
+    driver.add_metric('ifOut', 'interface', 'out')
+    driver.update_metric('h1', 'ifIn', {'port': '1'}, '1')
+    driver.update_metric('h1', 'ifOut', {'port': '1'}, '2')
+    driver.update_metric('h1', 'ifIn', {'port': '2'}, '3')
+
+    # a field is added, the rows are built again with room for it
+    driver.add_metric('ifErrors', 'interface', 'errors')
+    driver.update_metric('h1', 'ifIn', {'port': '1'}, '4')
+    driver.update_metric('h1', 'ifOut', {'port': '1'}, '5')
+    # the point written before the reload is still sent
+    assert flush(driver) == ['interface,port=1 in=1.0,out=2.0 1000000']
+    driver.update_metric('h1', 'ifErrors', {'port': '1'}, '6')
+    assert flush(driver) == ['interface,port=1 in=4.0,out=5.0,errors=6.0 1000000']
+
+    # a removed field isn't waited for anymore
+    driver.remove_metric('ifOut')
+    driver.update_metric('h1', 'ifIn', {'port': '1'}, '7')
+    driver.update_metric('h1', 'ifErrors', {'port': '1'}, '8')
+    # polls and forget queued before the reload are ignored
+    driver.update_metric('h1', 'ifOut', {'port': '1'}, '9')
+    driver.forget('h1', 'ifOut')
+    assert flush(driver) == ['interface,port=1 in=7.0,errors=8.0 1000000']
+
+    driver.remove_metric('ifIn')
+    driver.remove_metric('ifErrors')
+    assert 'interface' not in driver._storage
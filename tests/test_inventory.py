@@ -0,0 +1,122 @@
+# This file is part of prometheus-enhanced-snmp-exporte.
+#
+# prometheus-enhanced-snmp-exporte is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# prometheus-enhanced-snmp-exporte is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with prometheus-enhanced-snmp-exporte. If not, see <https://www.gnu.org/licenses/>.
+
+import json
+import os
+
+import pytest
+
+from prometheus_enhanced_snmp_exporter import inventory
+from prometheus_enhanced_snmp_exporter.config import InventoryConfiguration, ModulesConfiguration
+from prometheus_enhanced_snmp_exporter.inventory import Inventory, parse_inventory_file
+
+MODULES = ModulesConfiguration({
+    module_name: {'template_labels': {}, 'labels': {}, 'metrics': []} for module_name in ('system', 'interfaces')
+})
+
+SWITCHES = '''
+- targets: [switch1, switch2]
+  labels:
+    site: paris
+    __modules: system
+    __community: private
+'''
+
+
+@pytest.fixture
+def parsed(monkeypatch):
+    # paths of the parsed files
+    paths = []
+
+    def parse(path):
+        paths.append(os.path.basename(path))
+        return parse_inventory_file(path)
+
+    monkeypatch.setattr(inventory, 'parse_inventory_file', parse)
+    return paths
+
+
+def make_inventory(tmp_path, **config):
+    return Inventory(InventoryConfiguration(dict({'files': [str(tmp_path / '*.yml'), str(tmp_path / '*.json')]},
+                                                 **config)))
+
+
+def host_summary(hosts):
+    return [(host.hostname, host.community, host.static_labels, sorted(module for module, _ in host.items()))
+            for host in hosts]
+
+
+def test_file_sd_parsing(tmp_path):
+    (tmp_path / 'switches.yml').write_text(SWITCHES)
+    (tmp_path / 'routers.json').write_text(json.dumps([{'targets': ['router1'], 'labels': {'role': 'core'}}]))
+    inv = make_inventory(tmp_path, modules=[{'match': {'role': 'core|edge'}, 'modules': ['interfaces']}])
+    assert inv.scan()
+    assert host_summary(inv.hosts(MODULES, [])) == [
+        ('router1', 'public', {'role': 'core'}, ['interfaces']),
+        ('switch1', 'private', {'site': 'paris'}, ['system']),
+        ('switch2', 'private', {'site': 'paris'}, ['system']),
+    ]
+
+
+def test_only_modified_files_are_parsed(tmp_path, parsed):
+    switches = tmp_path / 'switches.yml'
+    switches.write_text(SWITCHES)
+    (tmp_path / 'empty.yml').write_text('')
+    inv = make_inventory(tmp_path)
+    assert inv.scan()
+    assert sorted(parsed) == ['empty.yml', 'switches.yml']
+    del parsed[:]
+    assert not inv.scan()
+    assert parsed == []
+    # same size, detected by its modification time
+    switches.write_text(SWITCHES.replace('switch2', 'switch3'))
+    stat = switches.stat()
+    os.utime(str(switches), (stat.st_atime, stat.st_mtime + 10))
+    assert inv.scan()
+    assert parsed == ['switches.yml']
+    assert [host.hostname for host in inv.hosts(MODULES, [])] == ['switch1', 'switch3']
+    switches.unlink()
+    assert inv.scan()
+    assert inv.hosts(MODULES, []) == []
+
+
+@pytest.mark.parametrize('content', ['- targets: [switch1', '{}', '- labels: {}'])
+def test_broken_file_keeps_its_previous_content(tmp_path, parsed, content):
+    switches = tmp_path / 'switches.yml'
+    switches.write_text(SWITCHES)
+    inv = make_inventory(tmp_path)
+    inv.scan()
+    switches.write_text(content)
+    assert not inv.scan()
+    assert [host.hostname for host in inv.hosts(MODULES, [])] == ['switch1', 'switch2']
+    # reported once, until the file changes again
+    del parsed[:]
+    assert not inv.scan()
+    assert parsed == []
+    switches.write_text('- targets: [switch4]\n')
+    assert inv.scan()
+    assert [host.hostname for host in inv.hosts(MODULES, [])] == ['switch4']
+
+
+def test_configured_targets_are_skipped(tmp_path):
+    (tmp_path / 'a.yml').write_text(SWITCHES)
+    (tmp_path / 'b.yml').write_text('- targets: [switch2, switch5]\n  labels: {__modules: interfaces}\n')
+    inv = make_inventory(tmp_path)
+    inv.scan()
+    # switch1 is in the hosts section, switch2 is already in a.yml
+    assert host_summary(inv.hosts(MODULES, ['switch1'])) == [
+        ('switch2', 'private', {'site': 'paris'}, ['system']),
+        ('switch5', 'public', {}, ['interfaces']),
+    ]
@@ -0,0 +1,121 @@
+# This file is part of prometheus-enhanced-snmp-exporte.
+#
+# prometheus-enhanced-snmp-exporte is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# prometheus-enhanced-snmp-exporte is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with prometheus-enhanced-snmp-exporte. If not, see <https://www.gnu.org/licenses/>.
+
+import asyncio
+import concurrent.futures
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip('pysnmp.hlapi.asyncio')
+
+from prometheus_enhanced_snmp_exporter.config import BadConfigurationException  # noqa: E402
+from prometheus_enhanced_snmp_exporter.reload import ConfigReloader  # noqa: E402
+
+CONFIG = '''
+hosts:
+  - hostname: switch1
+    version: v2c
+    modules:
+      - system
+modules:
+  system:
+    template_labels: {}
+    labels: {}
+    metrics:
+      - type: get
+        mappings:
+          sysUpTime: SNMPv2-MIB::sysUpTime.0
+description:
+  sysUpTime:
+    type: gauge
+    description: uptime
+'''
+
+
+def broken_resolver(oid):
+    raise RuntimeError('mib not loaded')
+
+
+@pytest.fixture
+def loop():
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    yield loop
+    loop.close()
+    asyncio.set_event_loop(None)
+
+
+def reloader(filename):
+    config = SimpleNamespace(descriptions={})
+    querier = SimpleNamespace(plans=[], resolve_oid=broken_resolver)
+    return ConfigReloader(filename, config, {}, [], querier, None, None, 1)
+
+
+@pytest.mark.parametrize('content, exception', [
+    (None, BadConfigurationException),
+    ('hosts: [', BadConfigurationException),
+    # unexpected errors are reported too, the http request is not left waiting
+    (CONFIG, RuntimeError),
+])
+def test_failed_reload_resolves_applied(loop, tmp_path, content, exception):
+    filename = tmp_path / 'config.yaml'
+    if content is not None:
+        filename.write_text(content)
+    applied = concurrent.futures.Future()
+    loop.run_until_complete(reloader(str(filename)).reload(applied))
+    assert applied.done()
+    with pytest.raises(exception):
+        applied.result()
+
+
+class RecordingMetrics(object):
+    def __init__(self):
+        self.calls = []
+
+    def add_metric(self, name, metric_type, description):
+        self.calls.append(('add', name))
+
+    def remove_metric(self, name):
+        self.calls.append(('remove', name))
+
+    def add_module(self, module_name, metric_names):
+        pass
+
+
+class RecordingQuerier(object):
+    def __init__(self):
+        self.plans = []
+
+    def resolve_oid(self, oid):
+        return oid
+
+    def set_plans(self, plans):
+        self.plans = plans
+
+    async def start_units(self, max_threads, scheduler, units):
+        pass
+
+
+def test_reload_adds_and_removes_metrics(loop, tmp_path):
+    filename = tmp_path / 'config.yaml'
+    filename.write_text(CONFIG)
+    metrics = RecordingMetrics()
+    config = SimpleNamespace(descriptions={'ifInOctets': {}})
+    reloader = ConfigReloader(str(filename), config, {}, [], RecordingQuerier(), metrics, None, 1)
+    applied = concurrent.futures.Future()
+    loop.run_until_complete(reloader.reload(applied))
+    assert applied.result() == 'configuration reloaded, 0 host modules stopped, 1 started'
+    assert metrics.calls == [('add', 'sysUpTime'), ('remove', 'ifInOctets')]
@@ -0,0 +1,151 @@
+# This file is part of prometheus-enhanced-snmp-exporte.
+#
+# prometheus-enhanced-snmp-exporte is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# prometheus-enhanced-snmp-exporte is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with prometheus-enhanced-snmp-exporte. If not, see <https://www.gnu.org/licenses/>.
+
+import importlib.util
+import os
+import threading
+import time
+
+import pytest
+
+from prometheus_enhanced_snmp_exporter import remote_write
+from prometheus_enhanced_snmp_exporter.remote_write import RemoteWriteDriver, snappy_compress
+
+# the stub receiver of the benchmarks decode the requests
+_spec = importlib.util.spec_from_file_location(
+    'remote_write_receiver', os.path.join(os.path.dirname(__file__), '..', 'benchmarks', 'remote_write_receiver.py'))
+receiver = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(receiver)
+
+
+class RecordingHandler(receiver.ReceiverHandler):
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        self.server.requests.append((dict(self.headers), body))
+        if self.server.fail_ratio:
+            self.server.stats.failed_requests += 1
+            self._reply(503)
+            return
+        self.server.bodies.append(body)
+        self._reply(204)
+
+
+@pytest.fixture
+def server():
+    server = receiver.ReceiverServer(('127.0.0.1', 0), RecordingHandler)
+    server.stats = receiver.Stats()
+    server.fail_ratio = 0
+    server.requests = []
+    server.bodies = []
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def decode_write_request(body):
+    '''
+        (labels, value, timestamp) of each sample of a snappy WriteRequest
+    '''
+    samples = []
+    for field, timeseries in receiver.fields(receiver.snappy_decompress(body)):
+        assert field == 1
+        labels = []
+        series_samples = []
+        for series_field, value in receiver.fields(timeseries):
+            if series_field == 1:
+                label = dict(receiver.fields(value))
+                labels.append((label[1].decode(), label[2].decode()))
+            else:
+                sample = dict(receiver.fields(value))
+                series_samples.append((sample[1], sample[2]))
+        for value, timestamp in series_samples:
+            samples.append((tuple(labels), value, timestamp))
+    return samples
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, 'timeout'
+        time.sleep(0.01)
+
+
+@pytest.mark.parametrize('size', [0, 1, 59, 60, 300, 65536, 70000])
+def test_snappy_literals(monkeypatch, size):
+    monkeypatch.setattr(remote_write, 'snappy', None)
+    data = bytes(index % 251 for index in range(size))
+    assert receiver.snappy_decompress(snappy_compress(data)) == data
+
+
+def poll(driver, hostname, values):
+    driver.clear(hostname, 'ifInOctets')
+    for port, value in values.items():
+        driver.update_metric(hostname, 'ifInOctets', {'host': hostname, 'port': port}, value)
+    driver.release_update_lock(hostname, 'ifInOctets')
+
+
+def queued(driver):
+    # encoded labels of the samples waiting in each shard
+    return [[b''.join(value for field, value in receiver.fields(sample) if field == 1)
+             for sample in shard.queue.queue] for shard in driver._shards]
+
+
+def test_series_keep_their_shard():
+    driver = RemoteWriteDriver('http://127.0.0.1:1/api/v1/write', shards=4)
+    ports = {str(port): str(port) for port in range(32)}
+    poll(driver, 'h1', ports)
+    first = queued(driver)
+    poll(driver, 'h1', ports)
+    second = queued(driver)
+    assert sum(len(samples) for samples in first) == 32
+    assert sum(1 for samples in first if samples) > 1
+    # the same series are queued on the same shards, a shard holds both samples of its series
+    for before, after in zip(first, second):
+        assert sorted(after) == sorted(before * 2)
+
+
+def test_write_request_round_trip(server):
+    driver = RemoteWriteDriver('http://127.0.0.1:{}/api/v1/write'.format(server.server_port), shards=2,
+                               flush_interval=0.05, username='user', password='secret')
+    driver.start_serving()
+    poll(driver, 'h1', {'1': '10', '2': '20.5'})
+    poll(driver, 'h2', {'1': '30', 'bad': 'not a number'})
+    wait_for(lambda: driver.counters()['sent'] == 3)
+    samples = sorted(sample for body in server.bodies for sample in decode_write_request(body))
+    assert [(labels, value) for labels, value, _ in samples] == [
+        ((('__name__', 'ifInOctets'), ('host', 'h1'), ('port', '1')), 10.0),
+        ((('__name__', 'ifInOctets'), ('host', 'h1'), ('port', '2')), 20.5),
+        ((('__name__', 'ifInOctets'), ('host', 'h2'), ('port', '1')), 30.0),
+    ]
+    assert all(abs(timestamp / 1000 - time.time()) < 60 for _, _, timestamp in samples)
+    headers = server.requests[0][0]
+    assert headers['Content-Encoding'] == 'snappy'
+    assert headers['X-Prometheus-Remote-Write-Version'] == '0.1.0'
+    assert headers['Authorization'] == 'Basic dXNlcjpzZWNyZXQ='
+
+
+def test_failed_writes_are_retried(server):
+    server.fail_ratio = 1
+    driver = RemoteWriteDriver('http://127.0.0.1:{}/'.format(server.server_port), shards=1, flush_interval=0.01,
+                               min_backoff=0.05, max_retries=5)
+    driver.start_serving()
+    poll(driver, 'h1', {'1': '10'})
+    wait_for(lambda: server.stats.failed_requests >= 1)
+    server.fail_ratio = 0
+    wait_for(lambda: driver.counters()['sent'] == 1)
+    assert driver.counters()['retries'] >= 1
+    assert [labels for labels, _, _ in decode_write_request(server.bodies[0])] == \
+        [(('__name__', 'ifInOctets'), ('host', 'h1'), ('port', '1'))]
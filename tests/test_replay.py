@@ -0,0 +1,123 @@
+# This file is part of prometheus-enhanced-snmp-exporte.
+#
+# prometheus-enhanced-snmp-exporte is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# prometheus-enhanced-snmp-exporte is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with prometheus-enhanced-snmp-exporte. If not, see <https://www.gnu.org/licenses/>.
+
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip('pysnmp.hlapi.asyncio')
+
+from pysnmp.proto import rfc1902, rfc1905  # noqa: E402
+from prometheus_enhanced_snmp_exporter import replay  # noqa: E402
+from prometheus_enhanced_snmp_exporter.driver import OutputDriver  # noqa: E402
+from prometheus_enhanced_snmp_exporter.replay import Recorder, Replayer  # noqa: E402
+from prometheus_enhanced_snmp_exporter.snmp import SNMPQuerier  # noqa: E402
+from prometheus_enhanced_snmp_exporter.storage import LabelStorage, TemplateStorage  # noqa: E402
+
+SYS_NAME = '1.3.6.1.2.1.1.5.0'
+IF_DESCR = '1.3.6.1.2.1.2.2.1.2'
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    '''
+        wall clock of the recording, and monotonic clock of the replay
+    '''
+    now = SimpleNamespace(time=1000.0, monotonic=0.0)
+    monkeypatch.setattr(replay.time, 'time', lambda: now.time)
+    monkeypatch.setattr(replay.time, 'monotonic', lambda: now.monotonic)
+    return now
+
+
+def sys_name(name):
+    return [[(rfc1902.ObjectName(SYS_NAME), rfc1902.OctetString(name))]]
+
+
+def if_descr(*names):
+    return [[(rfc1902.ObjectName('{}.{}'.format(IF_DESCR, index + 1)), rfc1902.OctetString(name))]
+            for index, name in enumerate(names)]
+
+
+@pytest.fixture
+def capture(tmp_path, clock):
+    recorder = Recorder(str(tmp_path))
+    recorder.record('h1', 'get', 'public', [SYS_NAME], sys_name('switch1'))
+    recorder.record('h1', 'walk', 'public', [IF_DESCR], if_descr('eth0', 'eth1'))
+    clock.time += 60
+    recorder.record('h1', 'get', 'public', [SYS_NAME], None)
+    clock.time += 60
+    recorder.record('h1', 'get', 'public', [SYS_NAME], sys_name('switch2'))
+    recorder.record('h1', 'get', 'private', [SYS_NAME], sys_name('hidden'))
+    return str(tmp_path)
+
+
+def test_values_round_trip(tmp_path, clock):
+    row = [(rfc1902.ObjectName('1.3.6.1.2.1.1.{}.0'.format(index)), value) for index, value in enumerate([
+        rfc1902.Integer32(-5), rfc1902.Counter64(2 ** 40), rfc1902.Gauge32(7), rfc1902.TimeTicks(1200),
+        rfc1902.IpAddress('10.0.0.1'), rfc1902.OctetString(b'\x00\xffbin'),
+        rfc1902.ObjectIdentifier('1.3.6.1.4.1.9'), rfc1905.noSuchInstance, rfc1905.endOfMibView])]
+    Recorder(str(tmp_path)).record('h1', 'get', 'public', ['1.3.6.1.2.1.1'], [row])
+    replayed = Replayer(str(tmp_path)).response('h1', 'get', 'public', ['1.3.6.1.2.1.1'])
+    assert [[(str(name), type(value), value.prettyPrint()) for name, value in replayed_row]
+            for replayed_row in replayed] == \
+        [[(str(name), type(value), value.prettyPrint()) for name, value in row]]
+
+
+def test_responses_follow_the_replay_clock(capture, clock):
+    replayer = Replayer(capture, speed=10)
+    assert replayer.response('h1', 'get', 'public', [SYS_NAME]) == sys_name('switch1')
+    assert replayer.response('h1', 'walk', 'public', [IF_DESCR]) == if_descr('eth0', 'eth1')
+    # a failed request is replayed as a failure
+    clock.monotonic += 6
+    assert replayer.response('h1', 'get', 'public', [SYS_NAME]) is None
+    clock.monotonic += 6
+    assert replayer.response('h1', 'get', 'public', [SYS_NAME]) == sys_name('switch2')
+    # end of the capture, the last responses stay
+    clock.monotonic += 600
+    assert replayer.response('h1', 'walk', 'public', [IF_DESCR]) == if_descr('eth0', 'eth1')
+    assert replayer.response('h2', 'get', 'public', [SYS_NAME]) is None
+
+
+def test_unknown_requests_fail_without_reading_ahead(capture, clock):
+    replayer = Replayer(capture)
+    host = replayer._hosts['h1']
+    # recorded later, not available yet
+    assert replayer.response('h1', 'get', 'private', [SYS_NAME]) is None
+    assert replayer.response('h1', 'get', 'public', ['1.3.6.1.2.1.1.1.0']) is None
+    assert not host.exhausted
+    assert replayer.response('h1', 'get', 'public', [SYS_NAME]) == sys_name('switch1')
+    clock.monotonic += 120
+    assert replayer.response('h1', 'get', 'private', [SYS_NAME]) == sys_name('hidden')
+    assert host.exhausted
+
+
+def test_querier_replays_a_capture(capture, clock):
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    try:
+        querier = SNMPQuerier(SimpleNamespace(query_cache_ttl=0), LabelStorage(), TemplateStorage(), OutputDriver(),
+                              replay=Replayer(capture))
+        assert loop.run_until_complete(
+            querier.query(SYS_NAME, 'h1', 'public', 'v2c', 'value', '', 'get')) == 'switch1'
+        assert loop.run_until_complete(
+            querier.query(IF_DESCR, 'h1', 'public', 'v2c', 'value', '', 'walk')) == {'1': 'eth0', '2': 'eth1'}
+        assert loop.run_until_complete(
+            querier.query_many((SYS_NAME,), 'h1', 'public', 'v2c', ('value',), ('',))) == ['switch1']
+        assert loop.run_until_complete(
+            querier.query(SYS_NAME, 'h1', 'private', 'v2c', 'value', '', 'get')) is None
+    finally:
+        loop.close()
+        asyncio.set_event_loop(None)
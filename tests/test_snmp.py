@@ -0,0 +1,231 @@
+# This file is part of prometheus-enhanced-snmp-exporte.
+#
+# prometheus-enhanced-snmp-exporte is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# prometheus-enhanced-snmp-exporte is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with prometheus-enhanced-snmp-exporte. If not, see <https://www.gnu.org/licenses/>.
+
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip('pysnmp.hlapi.asyncio')
+
+from prometheus_enhanced_snmp_exporter.driver import OutputDriver  # noqa: E402
+from prometheus_enhanced_snmp_exporter.plan import HostPlan  # noqa: E402
+from prometheus_enhanced_snmp_exporter.snmp import QueryCoalescer, SNMPQuerier  # noqa: E402
+from pysnmp.hlapi.asyncio import ObjectType  # noqa: E402
+from pysnmp.proto.rfc1902 import ObjectName, OctetString  # noqa: E402
+from prometheus_enhanced_snmp_exporter.storage import LabelStorage, TemplateStorage  # noqa: E402
+
+
+class RecordingDriver(OutputDriver):
+    def __init__(self):
+        self.calls = []
+
+    def clear(self, hostname, metric_name):
+        self.calls.append(('clear', hostname, metric_name))
+
+    def release_update_lock(self, hostname, metric_name):
+        self.calls.append(('release', hostname, metric_name))
+
+    def discard_update(self, hostname, metric_name):
+        self.calls.append(('discard', hostname, metric_name))
+
+    def update_metric(self, hostname, metric_name, labels, value):
+        self.calls.append(('update', metric_name, labels, value))
+
+
+def get_task(name, oid, query_type='get'):
+    return SimpleNamespace(name=name, oid=oid, type=query_type, store_method='value', oid_suffix='', filter_expr=None,
+                           template_name=None, community_template=None, label_group=[], max_series=0)
+
+
+@pytest.fixture
+def loop():
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    yield loop
+    loop.close()
+    asyncio.set_event_loop(None)
+
+
+@pytest.fixture
+def querier(loop):
+    config = SimpleNamespace(query_cache_ttl=0)
+    return SNMPQuerier(config, LabelStorage(), TemplateStorage(), RecordingDriver())
+
+
+def responding(outputs):
+    async def query(*args):
+        return outputs.pop(0)
+    return query
+
+
+HOST = HostPlan('h1', 'public', 'v2c', 10, {'site': 'par'}, [])
+TASKS = [get_task('sysUpTime', '1.3.6.1.2.1.1.3.0'), get_task('sysServices', '1.3.6.1.2.1.1.7.0')]
+
+
+def test_batch_poll(loop, querier):
+    querier.query_many = responding([['1200', '']])
+    loop.run_until_complete(querier._update_metric_batch(HOST, 'system', TASKS))
+    assert querier._metrics.calls == [
+        ('clear', 'h1', 'sysUpTime'),
+        ('update', 'sysUpTime', {'site': 'par'}, '1200'),
+        ('release', 'h1', 'sysUpTime'),
+        ('clear', 'h1', 'sysServices'),
+        ('release', 'h1', 'sysServices'),
+    ]
+    assert [(table, series) for table, series, _, _, _ in querier.accounting.tables()] == \
+        [(('h1', 'system', 'sysServices'), 0), (('h1', 'system', 'sysUpTime'), 1)]
+
+
+def test_failed_batch_poll_keeps_previous_series(loop, querier):
+    querier.query_many = responding([None])
+    loop.run_until_complete(querier._update_metric_batch(HOST, 'system', TASKS))
+    assert querier._metrics.calls == [
+        ('clear', 'h1', 'sysUpTime'),
+        ('discard', 'h1', 'sysUpTime'),
+        ('clear', 'h1', 'sysServices'),
+        ('discard', 'h1', 'sysServices'),
+    ]
+    assert querier.accounting.tables() == []
+
+
+def test_batch_poll_with_a_missing_value(loop, querier):
+    querier.query_many = responding([['1200', None]])
+    loop.run_until_complete(querier._update_metric_batch(HOST, 'system', TASKS))
+    assert querier._metrics.calls[-2:] == [('clear', 'h1', 'sysServices'), ('discard', 'h1', 'sysServices')]
+    assert [table for table, _, _, _, _ in querier.accounting.tables()] == [('h1', 'system', 'sysUpTime')]
+
+
+@pytest.mark.parametrize('query_type, output, calls', [
+    ('get', '42', [('update', 'ifNumber', {'site': 'par'}, '42'), ('release', 'h1', 'ifNumber')]),
+    ('walk', {'1': '10'}, [('release', 'h1', 'ifNumber')]),
+    ('get', None, [('discard', 'h1', 'ifNumber')]),
+    ('walk', None, [('discard', 'h1', 'ifNumber')]),
+])
+def test_metric_poll(loop, querier, query_type, output, calls):
+    # walked rows without labels are filtered
+    querier.query = responding([output])
+    loop.run_until_complete(querier._update_metric(HOST, 'interfaces', get_task('ifNumber', '1.3.6.1.2.1.2.1',
+                                                                                query_type)))
+    assert querier._metrics.calls == [('clear', 'h1', 'ifNumber')] + calls
+    assert len(querier.accounting.tables()) == (0 if output is None else 1)
+
+
+@pytest.mark.parametrize('query_type', ['get', 'walk'])
+def test_failed_template_label_poll_keeps_previous_labels(loop, querier, query_type):
+    querier._template_storage.set_label('h1', 'interfaces', 'vlan', '10', '1')
+    querier.query = responding([None])
+    loop.run_until_complete(querier._update_template_label(HOST, 'interfaces', 'vlan',
+                                                           get_task('vlan', '1.3.6.1.4.1.9.9.46', query_type)))
+    assert querier._template_storage.resolve_community('h1', 'interfaces', 'vlan', '{community}@{template}',
+                                                       'public') == [('public@10', 'vlan', '10')]
+    assert querier.accounting.tables() == []
+
+
+@pytest.mark.parametrize('query_type', ['get', 'walk'])
+def test_failed_label_poll_keeps_previous_labels(loop, querier, query_type):
+    querier._storage.set_label('h1', 'interfaces', 'ifName', 'name', 'eth0', None, None, '1')
+    querier.query = responding([None])
+    loop.run_until_complete(querier._update_label(HOST, 'interfaces', 'ifName', 'name',
+                                                  get_task('ifName', '1.3.6.1.2.1.31.1.1.1.1', query_type)))
+    assert querier._storage.resolve_label('h1', 'interfaces', '.ifName', None, None, '1') == {'name': 'eth0'}
+
+
+def test_templated_queries_respect_host_concurrency(loop, querier):
+    running = []
+    peak = []
+
+    async def query(oid, hostname, community, *args):
+        running.append(community)
+        peak.append(len(running))
+        await asyncio.sleep(0.01)
+        running.remove(community)
+        return community.split('@')[1]
+
+    querier.query = query
+    host = HostPlan('h1', 'public', 'v2c', 2, {}, [])
+    communities = [('public@{}'.format(vlan), 'vlan', str(vlan)) for vlan in range(7)]
+    outputs = loop.run_until_complete(querier.query_templated(host, communities, '1.3.6.1.2.1.1.3.0', 'value', '',
+                                                              'get'))
+    # every community is queried, in order, at most max_concurrency at once
+    assert outputs == [(community, community[2]) for community in communities]
+    assert max(peak) == 2
+    # the semaphore is shared by the polls of a host
+    assert querier._host_semaphore(host) is querier._host_semaphore(HostPlan('h1', 'public', 'v2c', 2, {}, []))
+
+
+class Agent(object):
+    '''
+        count the requests, answered after a short delay
+    '''
+    def __init__(self, result='up'):
+        self.requests = 0
+        self.result = result
+
+    async def query(self):
+        self.requests += 1
+        await asyncio.sleep(0.01)
+        return self.result
+
+
+def test_coalescer_merges_concurrent_queries(loop):
+    coalescer = QueryCoalescer()
+    agent = Agent()
+    results = loop.run_until_complete(asyncio.gather(*[coalescer.run(('h1', 'sysName'), agent.query)
+                                                       for _ in range(5)]))
+    assert results == ['up'] * 5
+    assert agent.requests == 1
+    # nothing is kept without ttl
+    loop.run_until_complete(coalescer.run(('h1', 'sysName'), agent.query))
+    assert agent.requests == 2
+
+
+def test_coalescer_ttl(loop):
+    coalescer = QueryCoalescer(0.05)
+    agent = Agent()
+    loop.run_until_complete(coalescer.run(('h1', 'sysName'), agent.query))
+    loop.run_until_complete(coalescer.run(('h1', 'sysName'), agent.query))
+    assert agent.requests == 1
+    loop.run_until_complete(asyncio.sleep(0.06))
+    loop.run_until_complete(coalescer.run(('h1', 'sysName'), agent.query))
+    assert agent.requests == 2
+
+
+def test_coalescer_does_not_keep_failures(loop):
+    coalescer = QueryCoalescer(60)
+    agent = Agent(None)
+    loop.run_until_complete(coalescer.run(('h1', 'sysName'), agent.query))
+    loop.run_until_complete(coalescer.run(('h1', 'sysName'), agent.query))
+    assert agent.requests == 2
+
+
+def test_store_methods_share_the_request(loop, querier):
+    requests = []
+    oid_obj = ObjectType(querier._mibstr_to_objstr('1.3.6.1.2.1.2.2.1.2')).resolveWithMib(querier.mib_controller)
+    rows = [[(ObjectName('1.3.6.1.2.1.2.2.1.2.1'), OctetString('user@example.com'))],
+            [(ObjectName('1.3.6.1.2.1.2.2.1.2.2'), OctetString('admin@example.org'))]]
+
+    async def query(*args):
+        requests.append(args)
+        await asyncio.sleep(0.01)
+        return oid_obj, rows
+
+    querier._query = query
+    values, realms = loop.run_until_complete(asyncio.gather(
+        querier.query('1.3.6.1.2.1.2.2.1.2', 'h1', 'public', 'v2c', 'value', '', 'walk'),
+        querier.query('1.3.6.1.2.1.2.2.1.2', 'h1', 'public', 'v2c', 'extract_realm', '', 'walk')))
+    assert len(requests) == 1
+    assert values == {'1': 'user@example.com', '2': 'admin@example.org'}
+    assert realms == {'1': 'example.com', '2': 'example.org'}